@@ -0,0 +1,108 @@
+__author__ = 'Kal Ahmed'
+
+"""
+Benchmark for the in-memory representation of a hub shard: the file holding the quads of a subject with
+a very large number of outgoing quads.
+
+Quads are asserted in random order into a single shard through a QuinceStore, looked up, retracted
+and finally flushed to disk. A single quad is then added and flushed again, which shows the effect of
+splitting the shard (--split-size). The same operations are timed against a plain bisect/list implementation
+for comparison.
+
+Usage: python benchmarks/hub_shard_benchmark.py [--quads N] [--split-size SIZE] [--skip-baseline]
+"""
+
+import argparse
+import bisect
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rdflib import URIRef, Literal
+
+from quince.core.cache import parse_size
+from quince.core.repo import QuinceStore, SortedSet
+
+HUB = URIRef('http://example.org/hub')
+PREDICATE = URIRef('http://example.org/linksTo')
+GRAPH = URIRef('http://example.org/graph')
+
+
+class ListSortedSet:
+    """A sorted set held in a single list, updated with list.insert and del"""
+    def __init__(self):
+        self.list = []
+
+    def insert(self, v):
+        i = bisect.bisect_left(self.list, v)
+        if i == len(self.list) or self.list[i] != v:
+            self.list.insert(i, v)
+
+    def __contains__(self, v):
+        i = bisect.bisect_left(self.list, v)
+        return i != len(self.list) and self.list[i] == v
+
+    def remove(self, v):
+        del self.list[bisect.bisect_left(self.list, v)]
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    func()
+    print('  {0:<10} {1:8.3f}s'.format(label, time.perf_counter() - start))
+
+
+def bench_store(lines, quads, split_size):
+    root = tempfile.mkdtemp(prefix='quince-bench-')
+    try:
+        store = QuinceStore(root)
+        store.split_size = split_size
+        timed('assert', lambda: [store.assert_quad(*q) for q in quads])
+        entry = store.update_manager.cache.get(store.make_file_path(HUB) + '.nqo')
+        timed('contains', lambda: [line in entry for line in lines])
+        timed('retract', lambda: [entry.remove(line) for line in lines[::2]])
+        timed('flush', store.flush)
+
+        def edit():
+            store.assert_quad(HUB, PREDICATE, Literal('edit'), GRAPH)
+            store.flush()
+        timed('edit', edit)
+    finally:
+        shutil.rmtree(root)
+
+
+def bench_set(set_class, lines):
+    s = set_class()
+    timed('insert', lambda: [s.insert(line) for line in lines])
+    timed('contains', lambda: [line in s for line in lines])
+    timed('remove', lambda: [s.remove(line) for line in lines[::2]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark updates to a hub shard')
+    parser.add_argument('--quads', type=int, default=200000, help='the number of quads in the hub shard')
+    parser.add_argument('--split-size', default='0',
+                        help='the size above which the shard is split, for example 1M (default: never split)')
+    parser.add_argument('--skip-baseline', action='store_true', help='do not time the list-based baseline')
+    args = parser.parse_args()
+
+    random.seed(42)
+    quads = [(HUB, PREDICATE, Literal(random.random()), GRAPH) for _ in range(args.quads)]
+    lines = [QuinceStore.make_nquad(*q) for q in quads]
+    print('Hub shard with {0} quads'.format(args.quads))
+    print('QuinceStore:')
+    bench_store(lines, quads, parse_size(args.split_size))
+    print('SortedSet:')
+    bench_set(SortedSet, lines)
+    if not args.skip_baseline:
+        print('List baseline:')
+        bench_set(ListSortedSet, lines)
+
+
+if __name__ == '__main__':
+    main()
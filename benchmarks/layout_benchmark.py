@@ -0,0 +1,100 @@
+__author__ = 'Kal Ahmed'
+
+"""
+Benchmark comparing the shard layouts (see quince.core.layout).
+
+For each layout a store is bulk loaded with quads for a number of distinct subjects. The benchmark then
+times point lookups of random subjects against a cold cache, a full scan of the store, and an update to
+a single quad followed by a flush. It also reports the number of files and directories created, which
+determines the cost of the layout for the file system and the git index.
+
+Usage: python benchmarks/layout_benchmark.py [--subjects N] [--quads-per-subject N] [--buckets N] [--lookups N]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rdflib import URIRef, Literal
+
+from quince.core.bulk import QuinceBulkSink
+from quince.core.layout import LAYOUTS, make_layout
+from quince.core.repo import QuinceStore
+
+PREDICATE = URIRef('http://example.org/value')
+GRAPH = URIRef('http://example.org/graph')
+
+
+def subject(i):
+    return URIRef('http://example.org/resource/{0}'.format(i))
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    result = func()
+    print('  {0:<10} {1:8.3f}s'.format(label, time.perf_counter() - start))
+    return result
+
+
+def load(store, subjects, quads_per_subject):
+    sink = QuinceBulkSink(store)
+    for i in range(subjects):
+        for j in range(quads_per_subject):
+            sink.quad(subject(i), PREDICATE, Literal(j), GRAPH)
+    sink.close()
+
+
+def count_entries(root):
+    files = dirs = 0
+    for _, dir_names, file_names in os.walk(root):
+        dirs += len(dir_names)
+        files += len(file_names)
+    return files, dirs
+
+
+def bench_layout(layout, args):
+    root = tempfile.mkdtemp(prefix='quince-bench-')
+    try:
+        store = QuinceStore(root)
+        store.set_layout(layout)
+        timed('load', lambda: load(store, args.subjects, args.quads_per_subject))
+        files, dirs = count_entries(root)
+        print('  {0:<10} {1} files in {2} directories'.format('size', files, dirs))
+        lookups = [subject(random.randrange(args.subjects)) for _ in range(args.lookups)]
+        store = QuinceStore(root)
+        timed('lookup', lambda: [list(store.exists(s, PREDICATE, Literal(0), GRAPH)) for s in lookups])
+        store = QuinceStore(root)
+        timed('scan', lambda: sum(1 for _ in store.all_quads(None)))
+
+        def update():
+            store.assert_quad(lookups[0], PREDICATE, Literal('updated'), GRAPH)
+            store.flush()
+        store = QuinceStore(root)
+        timed('update', update)
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the shard layouts')
+    parser.add_argument('--subjects', type=int, default=100000, help='the number of distinct subjects')
+    parser.add_argument('--quads-per-subject', type=int, default=5, help='the number of quads for each subject')
+    parser.add_argument('--buckets', type=int, help='the number of files used by the bucket layout')
+    parser.add_argument('--lookups', type=int, default=10000, help='the number of point lookups')
+    args = parser.parse_args()
+
+    for name in sorted(LAYOUTS):
+        random.seed(42)
+        layout = make_layout(name, args.buckets)
+        print('Layout {0}:'.format(layout))
+        bench_layout(layout, args)
+
+
+if __name__ == '__main__':
+    main()
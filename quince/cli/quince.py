@@ -5,7 +5,7 @@ import logging
 import traceback
 
 from quince.cli import pprint, quince_init, quince_import, quince_export, quince_diff, quince_namespace, \
-    quince_assert, quince_retract, quince_sort
+    quince_assert, quince_retract, quince_sort, quince_batch, quince_reshard, quince_index, quince_match
 from quince.core import repo as repo_lib
 
 VERSION = '0.1.0'
@@ -35,7 +35,11 @@ def main():
                 quince_namespace,
                 quince_assert,
                 quince_retract,
-                quince_sort]
+                quince_batch,
+                quince_sort,
+                quince_reshard,
+                quince_index,
+                quince_match]
     for sub_cmd in sub_cmds:
         sub_cmd.parser(subparsers)
 
@@ -1,6 +1,6 @@
 __author__ = 'Kal Ahmed'
 
-from quince.cli import pprint
+from quince.cli import pprint, stats_options
 
 from quince.core.repo import QUINCE_DEFAULT_GRAPH_IRI
 from quince.core import qassert
@@ -21,16 +21,19 @@ def parser(subparsers):
                                     'or a safe CURIE.')
     assert_parser.add_argument('graph', nargs='?',
                                help='The named graph to add the statement to. Must be an absolute IRI or a safe CURIE')
+    stats_options.add_arguments(assert_parser)
     assert_parser.set_defaults(graph=QUINCE_DEFAULT_GRAPH_IRI, func=main)
 
 
 def main(args):
+    stats = stats_options.make_stats(args)
     try:
-        s, p, o, g = qassert.assert_quad(args.subject, args.predicate, args.object, args.graph)
+        s, p, o, g = qassert.assert_quad(args.subject, args.predicate, args.object, args.graph, stats)
     except QuinceMultiException as e:
         for inner in e.inner_exceptions:
             pprint.err(inner.message)
         return False
     pprint.msg("{0} {1} {2} {3} .".format(s.n3(), p.n3(), o.n3(), g.n3()))
+    stats_options.report(args, stats)
 
 
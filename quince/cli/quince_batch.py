@@ -0,0 +1,41 @@
+__author__ = 'Kal Ahmed'
+
+import sys
+
+from quince.cli import pprint, stats_options
+
+from quince.core import qbatch
+from quince.core.exceptions import QuinceMultiException
+
+
+def parser(subparsers):
+    """Adds the batch command parser"""
+    batch_parser = subparsers.add_parser(
+        'batch',
+        help='Apply a sequence of assert and retract operations to the quince repository'
+    )
+    batch_parser.add_argument('filename', nargs='?', default='-',
+                              help='The file to read the operations from, one per line. Reads from stdin if '
+                                   'not specified or -. Each line starts with + (or assert) or - (or retract) '
+                                   'followed by the statement or pattern in the same syntax as the assert and '
+                                   'retract commands. IRIs may also be written in angle brackets.')
+    stats_options.add_arguments(batch_parser)
+    batch_parser.set_defaults(func=main)
+
+
+def main(args):
+    stats = stats_options.make_stats(args)
+    try:
+        if args.filename == '-':
+            asserted, retracted = qbatch.apply_batch(sys.stdin, stats)
+        else:
+            with open(args.filename, encoding='utf-8') as f:
+                asserted, retracted = qbatch.apply_batch(f, stats)
+    except QuinceMultiException as e:
+        for inner in e.inner_exceptions:
+            pprint.err(inner.message)
+        return False
+    pprint.msg('Asserted {0} quad{1}.'.format(asserted, '' if asserted == 1 else 's'))
+    pprint.msg('Retracted {0} quad{1}.'.format(len(retracted), '' if len(retracted) == 1 else 's'))
+    stats_options.report(args, stats)
+    return True
@@ -5,7 +5,7 @@ from sys import stdout
 from rdflib.util import guess_format
 from quince.core.repo import QUINCE_DEFAULT_GRAPH_IRI
 import quince.core.qexport as core_export
-from quince.cli import pprint
+from quince.cli import pprint, stats_options
 from quince.core.exceptions import QuinceNoSerializerException
 
 def parser(subparsers):
@@ -31,10 +31,12 @@ def parser(subparsers):
                                     'overwritten. The file extension is used to determine the syntax'
                                     'for the export. To see a list of the supported formats use the'
                                     'command "quince help formats".')
+    stats_options.add_arguments(export_parser)
     export_parser.set_defaults(func=main)
 
 
 def main(args):
+    stats = stats_options.make_stats(args)
     output_stream = open(args.filename, 'wb') if args.filename else stdout
     if args.graph:
         graphs = list(map((lambda g: ('<' + QUINCE_DEFAULT_GRAPH_IRI + '>') if g == 'default' else ('<' + g + '>')),
@@ -48,9 +50,10 @@ def main(args):
         else:
             output_format = "nquads"
     try:
-        core_export.export(output_stream, output_format, graphs)
+        core_export.export(output_stream, output_format, graphs, stats)
     except QuinceNoSerializerException:
         pprint.err("No serializer available for the specified file extension or output format")
     finally:
         if args.filename:
-            output_stream.close()
\ No newline at end of file
+            output_stream.close()
+    stats_options.report(args, stats)
\ No newline at end of file
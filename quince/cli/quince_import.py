@@ -4,7 +4,7 @@ import logging
 
 from quince.core import qimport as core_import
 from quince.core.exceptions import QuinceParseException, QuinceNoParserException
-from quince.cli import pprint
+from quince.cli import pprint, stats_options
 
 
 def parser(subparsers):
@@ -15,19 +15,85 @@ def parser(subparsers):
     )
     import_parser.set_defaults(func=main)
     import_parser.add_argument('-g', '--default-graph', help='the IRI of the default graph to import into')
-    import_parser.add_argument('filename', help='the path to the files to be imported', nargs='+')
+    import_parser.add_argument('--bulk', action='store_true',
+                               help='stage the imported quads in sorted runs on disk and merge them into the '
+                                    'repository in a single pass. Recommended for large imports.')
+    import_parser.add_argument('--run-size', type=int, default=core_import.DEFAULT_RUN_SIZE,
+                               help='the maximum number of quads held in memory by a bulk import '
+                                    '(default: %(default)s)')
+    import_parser.add_argument('--raw', action='store_true',
+                               help='use the fast line-based reader for N-Triples and N-Quads files. Lines are '
+                                    'validated and written to the repository without building RDF terms.')
+    import_parser.add_argument('-j', '--jobs', type=int, default=1,
+                               help='the number of worker processes used to parse and merge the files. '
+                                    'When greater than 1, all files are imported in bulk mode.')
+    import_parser.add_argument('-c', '--connections', type=int, default=4,
+                               help='the maximum number of concurrent downloads when importing several http(s) '
+                                    'URLs (default: %(default)s)')
+    import_parser.add_argument('-f', '--format',
+                               help='the RDF syntax of the files to be imported (nt, nquads, turtle or trig). '
+                                    'Overrides the syntax determined from the file extension. Required when '
+                                    'importing from stdin.')
+    import_parser.add_argument('--skolemize', choices=[core_import.SKOLEMIZE_RANDOM,
+                                                       core_import.SKOLEMIZE_DETERMINISTIC],
+                               default=core_import.SKOLEMIZE_RANDOM,
+                               help='how blank nodes are replaced with IRIs. deterministic derives each IRI from '
+                                    'the data around the blank node, so re-importing an unchanged file does not '
+                                    'modify the repository (default: %(default)s)')
+    import_parser.add_argument('--replace-graph', metavar='GRAPH_IRI',
+                               help='replace the content of the graph with the imported data. Only the '
+                                    'differences between the current content of the graph and the imported data '
+                                    'are applied to the repository. Triples are imported into this graph unless '
+                                    '--default-graph is also specified.')
+    import_parser.add_argument('filename', nargs='+',
+                               help='the path to the files to be imported. Files compressed with gzip, bzip2 or xz '
+                                    'are decompressed as they are read. Use - to read from stdin.')
+    stats_options.add_arguments(import_parser)
 
 
 def main(args):
+    stats = stats_options.make_stats(args)
+    try:
+        return _import(args, stats)
+    finally:
+        stats_options.report(args, stats)
+
+
+def _import(args, stats):
     log = logging.getLogger('quince')
-    for file in args.filename:
+    if core_import.STDIN in args.filename and args.format is None:
+        log.error('The --format option is required when importing from stdin')
+        return False
+    urls = [f for f in args.filename if core_import.is_url(f)]
+    if args.jobs > 1 or (args.replace_graph and len(args.filename) > 1 and len(urls) < len(args.filename)):
+        # All of the files must be staged before a graph can be replaced
+        results = core_import.import_files(args.filename, args.default_graph, args.jobs, args.run_size,
+                                           args.raw, args.format, args.skolemize, args.replace_graph, stats)
+        for file in args.filename:
+            _report(log, file, results[file])
+        return
+    files = args.filename
+    if len(urls) > 1:
+        results = core_import.import_urls(urls, args.default_graph, args.connections, args.bulk, args.run_size,
+                                          args.raw, args.format, args.skolemize, args.replace_graph, stats)
+        for url in urls:
+            _report(log, url, results[url])
+        files = [f for f in files if f not in results]
+    for file in files:
         try:
-            core_import.import_file(file, args.default_graph)
-            log.info("'{0}' - OK".format(file))
-        except QuinceParseException as e:
-            log.error("'{0}' - Parser Error: {1}".format(file, e.parser_msg))
-        except QuinceNoParserException:
-            log.error("'{0}' - No parser available for files with this file extension".format(file))
-
+            core_import.import_file(file, args.default_graph, args.bulk, args.run_size, args.raw, args.format,
+                                    args.skolemize, args.replace_graph, stats)
+            _report(log, file, None)
+        except (QuinceParseException, QuinceNoParserException) as e:
+            _report(log, file, e)
 
 
+def _report(log, file, error):
+    if error is None:
+        log.info("'{0}' - OK".format(file))
+    elif isinstance(error, QuinceParseException):
+        log.error("'{0}' - Parser Error: {1}".format(file, error.parser_msg))
+    elif isinstance(error, QuinceNoParserException):
+        log.error("'{0}' - No parser available for files with this file extension".format(file))
+    else:
+        log.error("'{0}' - {1}".format(file, error.message))
@@ -0,0 +1,62 @@
+__author__ = 'Kal Ahmed'
+
+from quince.cli import pprint, stats_options
+from quince.core import qindex
+from quince.core.bulk import DEFAULT_RUN_SIZE
+
+
+def parser(subparsers):
+    """Adds the index command parser to the given subparsers object"""
+    index_parser = subparsers.add_parser(
+        'index',
+        help='Manage the predicate and object indexes of the Quince repository.'
+    )
+    index_parser.set_defaults(func=lambda a: main(a, index_parser))
+    index_subparsers = index_parser.add_subparsers(dest='index_subcmd')
+    rebuild_parser = index_subparsers.add_parser(
+        'rebuild',
+        help='Build the indexes from all of the quads in the repository. Once built, the indexes are kept up '
+             'to date by the quince commands.'
+    )
+    rebuild_parser.add_argument('--run-size', type=int, default=DEFAULT_RUN_SIZE,
+                                help='the maximum number of index lines held in memory (default: %(default)s)')
+    stats_options.add_arguments(rebuild_parser)
+    rebuild_parser.set_defaults(subfunc=rebuild)
+    update_parser = index_subparsers.add_parser(
+        'update',
+        help='Apply the changes made since the indexes were last built or updated by a git merge, checkout or '
+             'bulk import. Run by the quince git hooks.'
+    )
+    update_parser.add_argument('--since', '-s',
+                               help='Apply the changes made since the specified commit')
+    update_parser.add_argument('--run-size', type=int, default=DEFAULT_RUN_SIZE,
+                               help='the maximum number of changed lines to apply. The indexes are rebuilt if '
+                                    'more lines have changed. (default: %(default)s)')
+    stats_options.add_arguments(update_parser)
+    update_parser.set_defaults(subfunc=update)
+
+
+def main(args, p):
+    if args.index_subcmd is None:
+        p.print_help()
+        return False
+    else:
+        return args.subfunc(args)
+
+
+def rebuild(args):
+    stats = stats_options.make_stats(args)
+    count = qindex.rebuild(args.run_size, stats)
+    pprint.msg('Indexed {0} quad{1}.'.format(count, '' if count == 1 else 's'))
+    stats_options.report(args, stats)
+    return True
+
+
+def update(args):
+    stats = stats_options.make_stats(args)
+    count = qindex.update(args.since, args.run_size, stats)
+    if count is None:
+        pprint.err('The repository has no indexes. Use quince index rebuild to build them.')
+        return False
+    stats_options.report(args, stats)
+    return True
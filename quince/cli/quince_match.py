@@ -0,0 +1,41 @@
+__author__ = 'Kal Ahmed'
+
+from quince.cli import pprint, stats_options
+from quince.core import qmatch
+from quince.core.exceptions import QuinceMultiException
+
+
+def parser(subparsers):
+    """Adds the match command parser"""
+    match_parser = subparsers.add_parser(
+        'match',
+        help='Writes the statements in the quince repository that match a pattern to stdout as NQuads'
+    )
+    match_parser.add_argument('subject',
+                              help='The subject of the statement. '
+                                   'May be an absolute IRI, a safe CURIE or a * wildcard.')
+    match_parser.add_argument('predicate', nargs='?', default='*',
+                              help='The predicate of the statement. '
+                                   'May be an absolute IRI, a safe CURIE or a * wildcard (the default).')
+    match_parser.add_argument('object', nargs='?', default='*',
+                              help='The object of the statement. '
+                                   'May be a quoted literal, absolute IRI, a safe CURIE or a * wildcard (the default).')
+    match_parser.add_argument('graph', nargs='?', default='*',
+                              help='The named graph of the statement. '
+                                   'May be an absolute IRI, a safe CURIE or a * wildcard (the default).')
+    stats_options.add_arguments(match_parser)
+    match_parser.set_defaults(func=main)
+
+
+def main(args):
+    stats = stats_options.make_stats(args)
+    try:
+        lines = qmatch.match(args.subject, args.predicate, args.object, args.graph, stats)
+    except QuinceMultiException as e:
+        for inner in e.inner_exceptions:
+            pprint.err(inner.message)
+        return False
+    for line in lines:
+        pprint.out(line[:-1])
+    stats_options.report(args, stats)
+    return True
@@ -0,0 +1,41 @@
+__author__ = 'Kal Ahmed'
+
+from quince.cli import pprint
+from quince.core import qreshard
+from quince.core.bulk import DEFAULT_RUN_SIZE
+from quince.core.exceptions import QuinceArgumentException
+from quince.core.layout import LAYOUTS, make_layout
+
+
+def parser(subparsers):
+    """
+    Adds a parser for the quince reshard sub-command
+    :param subparsers: The list of quince sub-command parsers to append the resulting parser to
+    :return: None
+    """
+    reshard_parser = subparsers.add_parser(
+        'reshard',
+        help='move the quads in the Quince repository into a different layout of shard files'
+    )
+    reshard_parser.add_argument('layout', choices=sorted(LAYOUTS),
+                                help='the new layout. flat uses one file per subject in 256 directories, nested '
+                                     'uses one file per subject in two levels of directories and bucket merges '
+                                     'the subjects into a fixed number of files.')
+    reshard_parser.add_argument('--buckets', type=int,
+                                help='the number of files used by the bucket layout (default: 4096)')
+    reshard_parser.add_argument('--run-size', type=int, default=DEFAULT_RUN_SIZE,
+                                help='the maximum number of quads held in memory (default: %(default)s)')
+    reshard_parser.set_defaults(func=main)
+
+
+def main(args):
+    try:
+        layout = make_layout(args.layout, args.buckets)
+        count = qreshard.reshard(layout, args.run_size)
+    except QuinceArgumentException as e:
+        pprint.err(e.message)
+        return False
+    if count is not None:
+        pprint.msg('The repository now uses the {0} layout with {1} shard file{2}.'.format(
+            layout, count, '' if count == 1 else 's'))
+    return True
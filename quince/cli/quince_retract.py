@@ -1,6 +1,6 @@
 __author__ = 'Kal Ahmed'
 
-from quince.cli import pprint
+from quince.cli import pprint, stats_options
 
 from quince.core.repo import QUINCE_DEFAULT_GRAPH_IRI
 from quince.core import qassert
@@ -27,12 +27,14 @@ def parser(subparsers):
     retract_parser.add_argument('graph', nargs='?',
                                 help='The named graph to add the statement to. '
                                      'May be an absolute IRI, a safe CURIE or a * wildcard')
+    stats_options.add_arguments(retract_parser)
     retract_parser.set_defaults(graph=QUINCE_DEFAULT_GRAPH_IRI, func=main)
 
 
 def main(args):
+    stats = stats_options.make_stats(args)
     try:
-        retracted = qassert.retract_quad(args.subject, args.predicate, args.object, args.graph)
+        retracted = qassert.retract_quad(args.subject, args.predicate, args.object, args.graph, stats)
     except QuinceMultiException as e:
         for inner in e.inner_exceptions:
             pprint.err(inner.message)
@@ -40,5 +42,6 @@ def main(args):
     pprint.msg('Retracted {0} quad{1}.'.format(len(retracted), '' if len(retracted) == 1 else 's'))
     for r in retracted:
         pprint.msg(r)
+    stats_options.report(args, stats)
 
 
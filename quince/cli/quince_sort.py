@@ -1,5 +1,6 @@
 __author__ = 'Kal Ahmed'
 
+from quince.cli import stats_options
 from quince.core.qsort import sort_all, sort_modified
 
 
@@ -18,12 +19,15 @@ def parser(subparsers):
                              action='store_true')
     sort_parser.add_argument('--since', '-s',
                              help='Check the sorting of all files modified since the specified commit')
+    stats_options.add_arguments(sort_parser)
     sort_parser.set_defaults(func=main)
 
 
 def main(args):
+    stats = stats_options.make_stats(args)
     if args.all:
-        sort_all()
+        sort_all(stats)
     else:
-        sort_modified(args.since)
+        sort_modified(args.since, stats)
+    stats_options.report(args, stats)
     return True
\ No newline at end of file
@@ -0,0 +1,33 @@
+__author__ = 'Kal Ahmed'
+"""Support for the --stats and --stats-json options shared by several commands."""
+
+from quince.cli import pprint
+from quince.core.stats import QuinceStats
+
+
+def add_arguments(parser):
+    """Add the statistics options to a command parser"""
+    parser.add_argument('--stats', action='store_true',
+                        help='print cache and file I/O statistics when the command completes')
+    parser.add_argument('--stats-json', metavar='FILE',
+                        help='write cache and file I/O statistics as JSON to FILE when the command completes. '
+                             'Use - to write to stdout.')
+
+
+def make_stats(args):
+    """Returns a new QuinceStats if statistics were requested on the command line, otherwise None"""
+    return QuinceStats() if args.stats or args.stats_json else None
+
+
+def report(args, stats):
+    """Output the statistics in the formats requested on the command line"""
+    if stats is None:
+        return
+    if args.stats:
+        for line in str(stats).split('\n'):
+            pprint.msg(line)
+    if args.stats_json == '-':
+        pprint.out(stats.to_json())
+    elif args.stats_json:
+        with open(args.stats_json, 'w') as f:
+            f.write(stats.to_json())
@@ -0,0 +1,390 @@
+__author__ = 'Kal Ahmed'
+
+"""
+Bulk loading support for quince.
+
+Rather than routing every quad through the LRU file cache, the bulk loader writes (shard, line) records
+into sorted runs on disk, each holding at most run_size records. When parsing completes the runs are
+merged into a single sorted stream and each shard file is updated with one sequential merge pass,
+so memory use is bounded by the run size no matter how large the input is.
+
+Runs can optionally be partitioned by the top-level directory of the shard they belong to. Every shard
+then belongs to exactly one partition, so partitions can be merged into the store concurrently without
+two writers ever touching the same file.
+
+A bulk load can also replace the content of a single graph. The existing lines in the graph are compared
+with the incoming lines in the same merge pass, so only the shards whose content actually changes are
+rewritten.
+"""
+
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+import zlib
+
+from quince.core.index import manifest_shards
+from quince.core.repo import NQOUT, NQSPLIT, LOCAL_DIRS
+
+DEFAULT_RUN_SIZE = 500000
+MAX_MERGE_FAN_IN = 64
+
+_SEP = b'\t'
+
+
+class QuinceBulkSink:
+    def __init__(self, store, run_size=DEFAULT_RUN_SIZE, tmp_dir=None, partitions=1, replace_graph=None):
+        """
+        A parser sink that stages quads in sorted runs on disk and merges them into the store
+        when :meth:`close` is called.
+
+        :param store: The :class:`QuinceStore` to load into
+        :param run_size: The maximum number of records held in memory before a run is written to disk
+        :param tmp_dir: The directory to create the temporary run files in. Defaults to the system temp directory
+        :param partitions: The number of partitions to split the runs into
+        :param replace_graph: If specified, the IRI of a graph whose content is replaced by the staged quads.
+            Quads in that graph which are not staged are removed from the store when the sink is closed.
+        """
+        self.store = store
+        self.run_size = run_size
+        self.tmp_dir = tmp_dir
+        self.partitions = partitions
+        self.replace_graph = replace_graph
+        self.buffer = []
+        self.runs = [[] for _ in range(partitions)]
+        self._work_dir = None
+        self._run_count = 0
+
+    def quad(self, s, p, o, g):
+        file_path, line = self.store.make_quad_entry(s, p, o, g)
+        self.add_line(file_path, line)
+
+    def triple(self, s, p, o):
+        self.quad(s, p, o, None)
+
+    def raw_quad(self, s, p, o, g):
+        file_path, line = self.store.make_raw_quad_entry(s, p, o, g)
+        self.add_line(file_path, line)
+
+    def add_line(self, file_path, line):
+        """
+        Stage a single NQuads line for addition to the file at file_path
+        """
+        key = os.path.relpath(file_path, self.store.root)
+        self.buffer.append(key.encode('utf-8') + _SEP + line.encode('utf-8'))
+        if len(self.buffer) >= self.run_size:
+            self._spill()
+
+    def close(self):
+        """
+        Merge all staged quads into the store and remove the temporary run files.
+
+        :return: The number of shard files that were modified
+        """
+        try:
+            if self.buffer:
+                self._spill()
+            return sum(merge_runs(self.store.root, runs, self.replace_graph, partition, self.partitions,
+                                  self.store.stats)
+                       for partition, runs in enumerate(self.runs))
+        finally:
+            self._cleanup()
+
+    def detach_runs(self):
+        """
+        Write any buffered records to disk and hand over ownership of the run files to the caller,
+        who becomes responsible for merging them (see :func:`merge_runs`) and removing them.
+
+        :return: A list containing the list of run file paths for each partition
+        """
+        if self.buffer:
+            self._spill()
+        runs = self.runs
+        self.runs = [[] for _ in range(self.partitions)]
+        self._work_dir = None
+        return runs
+
+    def discard(self):
+        """Remove all staged records without applying them to the store"""
+        self._cleanup()
+
+    def _spill(self):
+        self.buffer.sort()
+        if self.partitions == 1:
+            path = self._new_run_path()
+            with open(path, 'wb') as f:
+                f.writelines(_unique(self.buffer))
+            self.runs[0].append(path)
+        else:
+            files = {}
+            try:
+                for top_dir, records in itertools.groupby(_unique(self.buffer), key=_top_dir):
+                    partition = zlib.crc32(top_dir) % self.partitions
+                    if partition not in files:
+                        path = self._new_run_path()
+                        files[partition] = open(path, 'wb')
+                        self.runs[partition].append(path)
+                    files[partition].writelines(records)
+            finally:
+                for f in files.values():
+                    f.close()
+        self.buffer = []
+
+    def _new_run_path(self):
+        if self._work_dir is None:
+            self._work_dir = tempfile.mkdtemp(prefix='quince-bulk-', dir=self.tmp_dir)
+        self._run_count += 1
+        return os.path.join(self._work_dir, 'run{0:06d}'.format(self._run_count))
+
+    def _cleanup(self):
+        if self._work_dir is not None:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+        self.runs = [[] for _ in range(self.partitions)]
+        self.buffer = []
+
+
+def merge_runs(root, runs, replace_graph=None, partition=0, partitions=1, stats=None):
+    """
+    Merge a set of sorted run files into the shard files of the store at root.
+    The run files are consumed by the merge.
+
+    :param root: The root directory of the store
+    :param runs: The paths of the run files to merge
+    :param replace_graph: If specified, the IRI of a graph whose content is replaced by the content of the runs.
+        The shards in the partition that hold quads in the graph are scanned for quads that are not in the runs.
+        These are the shards listed for the graph by the graph manifest, or every shard if the store has no
+        graph manifest.
+    :param partition: The index of the partition that runs belong to
+    :param partitions: The number of partitions that the store is split into
+    :param stats: The :class:`QuinceStats` to record file activity in
+    :return: The number of shard files that were modified
+    """
+    graph_suffix = None if replace_graph is None else _graph_suffix(replace_graph)
+    modified = 0
+    merged = set()
+    for key, lines in shard_groups(runs):
+        if merge_into_file(os.path.join(root, key), lines, graph_suffix, stats):
+            modified += 1
+        if graph_suffix is not None:
+            merged.add(key)
+    if graph_suffix is not None:
+        for key in _graph_shard_keys(root, replace_graph, partition, partitions):
+            if key not in merged and merge_into_file(os.path.join(root, key), iter(()), graph_suffix, stats):
+                modified += 1
+    for run in runs:
+        os.remove(run)
+    return modified
+
+
+def shard_keys(root, partition=0, partitions=1):
+    """
+    Returns an iterator over the relative paths of the shard files of the store at root that
+    belong to the specified partition
+    """
+    for dir_path, dirs, files in os.walk(root):
+        # Skip the local caches and indexes
+        dirs[:] = [d for d in dirs if d not in LOCAL_DIRS]
+        for f in files:
+            if f.endswith(NQOUT):
+                key = os.path.relpath(os.path.join(dir_path, f), root)
+                if partitions == 1 or zlib.crc32(_top_dir(key.encode('utf-8'))) % partitions == partition:
+                    yield key
+
+
+def _graph_shard_keys(root, graph, partition=0, partitions=1):
+    """
+    Returns the relative paths of the shard files in a partition that may hold quads in the graph with IRI graph
+    """
+    shards = manifest_shards(root, '<{0}>'.format(graph))
+    if shards is None:
+        return shard_keys(root, partition, partitions)
+    keys = []
+    for shard in shards:
+        if partitions > 1 and zlib.crc32(shard.partition(os.sep)[0].encode('utf-8')) % partitions != partition:
+            continue
+        keys.append(shard + NQOUT)
+        split_dir = os.path.join(root, shard + NQSPLIT)
+        if os.path.isdir(split_dir):
+            keys.extend(os.path.join(shard + NQSPLIT, f) for f in sorted(os.listdir(split_dir)) if f.endswith(NQOUT))
+    return keys
+
+
+def shard_groups(runs):
+    """
+    Returns an iterator over (relative shard path, sorted line iterator) pairs for the records in a set of run files
+    """
+    records = _merge_run_files(runs)
+    for key, group in itertools.groupby(records, key=lambda r: r.partition(_SEP)[0]):
+        yield key.decode('utf-8'), (r.partition(_SEP)[2] for r in group)
+
+
+def _merge_run_files(runs):
+    runs = list(runs)
+    while len(runs) > MAX_MERGE_FAN_IN:
+        # Reduce the number of runs with intermediate merge passes to keep open file handles bounded
+        batch, runs = runs[:MAX_MERGE_FAN_IN], runs[MAX_MERGE_FAN_IN:]
+        path = batch[0] + '.merged'
+        with open(path, 'wb') as out:
+            out.writelines(_unique(_merge_files(batch)))
+        for run in batch:
+            os.remove(run)
+        os.replace(path, batch[0])
+        runs.append(batch[0])
+    return _unique(_merge_files(runs))
+
+
+def _top_dir(record):
+    key = record.partition(_SEP)[0]
+    return key.partition(os.sep.encode())[0]
+
+
+def _graph_suffix(graph):
+    """Returns the endings of an NQuads line (with and without a newline) for a quad in the graph with IRI graph"""
+    suffix = ' <{0}> .'.format(graph).encode('utf-8')
+    return suffix + b'\n', suffix
+
+
+def merge_into_file(file_path, lines, replace_suffix=None, stats=None):
+    """
+    Merge a sorted iterator of NQuads lines (as UTF-8 encoded bytes) into the sorted file at file_path.
+    The file is only rewritten if the merge adds or removes a line. A file left with no lines is deleted.
+
+    :param replace_suffix: If specified, a line ending (or tuple of line endings) that selects the existing lines
+        that are to be replaced. Selected lines that are not also in lines are removed from the file.
+    :param stats: The :class:`QuinceStats` to record file activity in
+    :return: True if the file was modified, False otherwise
+    """
+    writer = _LazyFileWriter(file_path, stats)
+    try:
+        with _open_existing(file_path, stats) as existing:
+            old = next(existing, None)
+            new = next(lines, None)
+            while old is not None or new is not None:
+                if new is None or (old is not None and old < new):
+                    if replace_suffix is not None and old.endswith(replace_suffix):
+                        writer.drop()
+                    else:
+                        writer.same(old)
+                    old = next(existing, None)
+                elif old is None or new < old:
+                    writer.write(new)
+                    new = next(lines, None)
+                else:
+                    writer.same(old)
+                    old = next(existing, None)
+                    new = next(lines, None)
+    except:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+class _LazyFileWriter:
+    """
+    Writes a modified copy of a file, deferring opening the file for writing until the first difference
+    from the original content is found. The unchanged prefix is then copied straight from the original file.
+    """
+    def __init__(self, file_path, stats=None):
+        self.path = file_path
+        self.tmp_path = file_path + '.tmp'
+        self.stats = stats
+        self.unchanged = 0
+        self.out = None
+
+    def same(self, line):
+        if not line.endswith(b'\n'):
+            self.write(line + b'\n')
+        elif self.out is None:
+            self.unchanged += len(line)
+        else:
+            self.out.write(line)
+
+    def write(self, line):
+        if self.out is None:
+            self._open()
+        self.out.write(line)
+
+    def drop(self):
+        """Omit the next line of the original file from the copy"""
+        if self.out is None:
+            self._open()
+
+    def _open(self):
+        dir_name = os.path.dirname(self.path)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        self.out = open(self.tmp_path, 'wb')
+        if self.unchanged:
+            with open(self.path, 'rb') as original:
+                remaining = self.unchanged
+                while remaining:
+                    chunk = original.read(min(remaining, 1 << 20))
+                    self.out.write(chunk)
+                    remaining -= len(chunk)
+
+    def close(self):
+        if self.out is None:
+            return False
+        size = self.out.tell()
+        self.out.close()
+        if self.stats is not None:
+            if size == 0:
+                self.stats.files_deleted += 1
+            else:
+                self.stats.files_written += 1
+                self.stats.bytes_written += size
+                if not os.path.exists(self.path):
+                    self.stats.files_created += 1
+        if size == 0:
+            os.remove(self.tmp_path)
+            os.remove(self.path)
+        else:
+            os.replace(self.tmp_path, self.path)
+        return True
+
+    def abort(self):
+        if self.out is not None:
+            self.out.close()
+            os.remove(self.tmp_path)
+            self.out = None
+
+
+class _open_existing:
+    """Context manager yielding an iterator over the lines of a file, or an empty iterator if it does not exist"""
+    def __init__(self, file_path, stats=None):
+        self.path = file_path
+        self.stats = stats
+        self.f = None
+
+    def __enter__(self):
+        try:
+            self.f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return iter(())
+        if self.stats is not None:
+            self.stats.files_read += 1
+            self.stats.bytes_read += os.fstat(self.f.fileno()).st_size
+        return iter(self.f)
+
+    def __exit__(self, *args):
+        if self.f is not None:
+            self.f.close()
+
+
+def _merge_files(paths):
+    files = [open(p, 'rb') for p in paths]
+    try:
+        yield from heapq.merge(*files)
+    finally:
+        for f in files:
+            f.close()
+
+
+def _unique(sorted_records):
+    prev = None
+    for r in sorted_records:
+        if r != prev:
+            yield r
+            prev = r
@@ -0,0 +1,323 @@
+__author__ = 'Kal Ahmed'
+
+"""
+In-memory caches with pluggable eviction policies.
+
+Every cache is bounded by a maximum number of entries and, optionally, by a byte budget. The size of each
+entry is estimated by a sizeof function when it is added and re-estimated when :meth:`Cache.resize` is
+called after the entry has been modified. When the cache is over either bound, entries chosen by the
+eviction policy are removed and passed to the eviction callback.
+"""
+
+import abc
+import collections
+import re
+
+from quince.core.exceptions import QuinceArgumentException
+
+POLICY_LRU = 'lru'
+POLICY_CLOCK = 'clock'
+POLICY_2Q = '2q'
+
+_MISSING = object()
+
+_SIZE = re.compile(r'^\s*(?P<n>\d+)\s*(?P<unit>[kmg]?)b?\s*$', re.IGNORECASE)
+_UNITS = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+
+
+class Cache(abc.ABC):
+    def __init__(self, capacity, eviction_callback=None, max_bytes=None, sizeof=None):
+        """
+        Base class for the cache policies.
+
+        :param capacity: The maximum number of entries in the cache
+        :param eviction_callback: A function called with the key and value of each evicted entry
+        :param max_bytes: The maximum total size of the entries in the cache, or None for no byte budget
+        :param sizeof: A function returning the estimated size in bytes of a value. Required if max_bytes is set.
+        """
+        self.capacity = capacity
+        self.eviction_callback = eviction_callback
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof if max_bytes else None
+        self.sizes = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abc.abstractmethod
+    def __contains__(self, key):
+        """Returns True if the cache holds an entry for key"""
+
+    @abc.abstractmethod
+    def __len__(self):
+        """Returns the number of entries in the cache"""
+
+    def get(self, key, default=None):
+        value = self._lookup(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.drop(key)
+        self._add(key, value)
+        self._set_size(key, value)
+        self._evict(key)
+
+    def drop(self, key):
+        """Remove an entry from the cache without calling the eviction callback"""
+        if key in self:
+            self._remove(key)
+            self.total_bytes -= self.sizes.pop(key, 0)
+
+    def resize(self, key):
+        """Re-estimate the size of an entry that has been modified, evicting other entries if necessary"""
+        if self.sizeof and key in self:
+            self._set_size(key, self._peek(key))
+            self._evict(key)
+
+    @abc.abstractmethod
+    def items(self):
+        """Returns the cached values"""
+
+    def _set_size(self, key, value):
+        if self.sizeof:
+            size = self.sizeof(value)
+            self.total_bytes += size - self.sizes.get(key, 0)
+            self.sizes[key] = size
+
+    def _over_budget(self):
+        return len(self) > self.capacity or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+
+    def _evict(self, keep):
+        """Evict entries until the cache is within its bounds. The entry with key keep is never evicted."""
+        while self._over_budget() and len(self) > 1:
+            key, value = self._victim(keep)
+            self.total_bytes -= self.sizes.pop(key, 0)
+            self.evictions += 1
+            if self.eviction_callback:
+                self.eviction_callback(key, value)
+
+    @abc.abstractmethod
+    def _lookup(self, key, default):
+        """Returns the value for key, recording an access, or default if key is not in the cache"""
+
+    @abc.abstractmethod
+    def _add(self, key, value):
+        """Add an entry for a key that is not in the cache"""
+
+    @abc.abstractmethod
+    def _remove(self, key):
+        """Remove the entry for key"""
+
+    @abc.abstractmethod
+    def _peek(self, key):
+        """Returns the value for key without recording an access"""
+
+    @abc.abstractmethod
+    def _victim(self, keep):
+        """Remove and return the (key, value) of the entry to be evicted next"""
+
+
+class LRUCache(Cache):
+    """A cache that evicts the least recently used entry"""
+    def __init__(self, capacity, eviction_callback=None, max_bytes=None, sizeof=None):
+        super().__init__(capacity, eviction_callback, max_bytes, sizeof)
+        self.cache = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def _lookup(self, key, default):
+        try:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        except KeyError:
+            return default
+
+    def items(self):
+        return self.cache.values()
+
+    def _add(self, key, value):
+        self.cache[key] = value
+
+    def _remove(self, key):
+        del self.cache[key]
+
+    def _peek(self, key):
+        return self.cache[key]
+
+    def _victim(self, keep):
+        key = next(iter(self.cache))
+        if key == keep:
+            self.cache.move_to_end(key)
+            key = next(iter(self.cache))
+        return key, self.cache.pop(key)
+
+
+class ClockCache(Cache):
+    """
+    A cache using the CLOCK approximation of LRU. A hit only sets a reference flag on the entry. The entries form
+    a ring, and eviction sweeps the ring from the oldest entry, giving each referenced entry a second chance by
+    clearing its flag and evicting the first entry that is not referenced.
+    """
+    def __init__(self, capacity, eviction_callback=None, max_bytes=None, sizeof=None):
+        super().__init__(capacity, eviction_callback, max_bytes, sizeof)
+        self.cache = collections.OrderedDict()
+        self.referenced = set()
+
+    def __contains__(self, key):
+        return key in self.cache
+
+    def __len__(self):
+        return len(self.cache)
+
+    def _lookup(self, key, default):
+        try:
+            value = self.cache[key]
+        except KeyError:
+            return default
+        self.referenced.add(key)
+        return value
+
+    def items(self):
+        return self.cache.values()
+
+    def _add(self, key, value):
+        self.cache[key] = value
+
+    def _remove(self, key):
+        del self.cache[key]
+        self.referenced.discard(key)
+
+    def _peek(self, key):
+        return self.cache[key]
+
+    def _victim(self, keep):
+        while True:
+            key = next(iter(self.cache))
+            if key == keep or key in self.referenced:
+                self.referenced.discard(key)
+                self.cache.move_to_end(key)
+            else:
+                return key, self.cache.pop(key)
+
+
+class TwoQueueCache(Cache):
+    """
+    A scan-resistant cache using the 2Q policy. New entries go into a FIFO queue. The keys of entries evicted
+    from that queue are remembered in a ghost queue, and an entry that is requested again while its key is
+    remembered goes into the main LRU queue. Entries that are only accessed once, such as those loaded by a
+    scan over the whole store, therefore never displace the frequently used entries in the main queue.
+    """
+    # The share of the cache reserved for the FIFO queue
+    IN_RATIO = 0.25
+    # The number of evicted keys remembered, as a share of the cache capacity
+    OUT_RATIO = 0.5
+
+    def __init__(self, capacity, eviction_callback=None, max_bytes=None, sizeof=None):
+        super().__init__(capacity, eviction_callback, max_bytes, sizeof)
+        self.a1in = collections.OrderedDict()
+        self.am = collections.OrderedDict()
+        self.a1out = collections.OrderedDict()
+        self.a1in_bytes = 0
+
+    def __contains__(self, key):
+        return key in self.a1in or key in self.am
+
+    def __len__(self):
+        return len(self.a1in) + len(self.am)
+
+    def _lookup(self, key, default):
+        if key in self.am:
+            self.am.move_to_end(key)
+            return self.am[key]
+        return self.a1in.get(key, default)
+
+    def items(self):
+        return list(self.a1in.values()) + list(self.am.values())
+
+    def _set_size(self, key, value):
+        if self.sizeof and key in self.a1in:
+            size = self.sizeof(value)
+            self.a1in_bytes += size - self.sizes.get(key, 0)
+        super()._set_size(key, value)
+
+    def _add(self, key, value):
+        if key in self.a1out:
+            del self.a1out[key]
+            self.am[key] = value
+        else:
+            self.a1in[key] = value
+
+    def _remove(self, key):
+        if key in self.am:
+            del self.am[key]
+        else:
+            del self.a1in[key]
+            self.a1in_bytes -= self.sizes.get(key, 0)
+
+    def _peek(self, key):
+        return self.am[key] if key in self.am else self.a1in[key]
+
+    def _victim(self, keep):
+        in_full = len(self.a1in) > self.capacity * self.IN_RATIO or \
+            (self.max_bytes is not None and self.a1in_bytes > self.max_bytes * self.IN_RATIO)
+        candidates = [k for k in (next(iter(self.a1in), None), next(iter(self.am), None)) if k is not None]
+        if not in_full or not self.a1in:
+            candidates.reverse()
+        key = next((k for k in candidates if k != keep), None)
+        if key is None:
+            # keep is at the head of the only non-empty queue
+            queue = self.a1in if keep in self.a1in else self.am
+            queue.move_to_end(keep)
+            key = next(iter(queue))
+        if key in self.a1in:
+            self.a1in_bytes -= self.sizes.get(key, 0)
+            value = self.a1in.pop(key)
+            self.a1out[key] = None
+            while len(self.a1out) > max(1, int(self.capacity * self.OUT_RATIO)):
+                self.a1out.popitem(last=False)
+        else:
+            value = self.am.pop(key)
+        return key, value
+
+
+POLICIES = {
+    POLICY_LRU: LRUCache,
+    POLICY_CLOCK: ClockCache,
+    POLICY_2Q: TwoQueueCache
+}
+
+
+def make_cache(policy, capacity, eviction_callback=None, max_bytes=None, sizeof=None):
+    """
+    Create a cache with the named eviction policy
+
+    :param policy: One of 'lru', 'clock' or '2q'
+    :raises: QuinceArgumentException if the policy is not recognized
+    """
+    try:
+        cache_class = POLICIES[policy.lower()]
+    except KeyError:
+        raise QuinceArgumentException('Unknown cache policy "{0}". Expected one of {1}.'.format(
+            policy, ', '.join(sorted(POLICIES))))
+    return cache_class(capacity, eviction_callback, max_bytes, sizeof)
+
+
+def parse_size(size):
+    """
+    Parse a size in bytes with an optional K, M or G suffix (e.g. 512M)
+
+    :raises: QuinceArgumentException if the size cannot be parsed
+    """
+    m = _SIZE.match(str(size))
+    if not m:
+        raise QuinceArgumentException('Could not parse "{0}" as a size in bytes.'.format(size))
+    return int(m.group('n')) * _UNITS[m.group('unit').lower()]
@@ -0,0 +1,114 @@
+__author__ = 'Kal Ahmed'
+
+"""
+Support for downloading many HTTP(S) resources concurrently over pooled keep-alive connections.
+"""
+
+import collections
+import contextlib
+import http.client
+import threading
+from urllib.parse import urlsplit, urljoin
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+DEFAULT_TIMEOUT = 60
+
+
+class ConnectionPool:
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_redirects=MAX_REDIRECTS):
+        """
+        A thread-safe pool of keep-alive HTTP and HTTPS connections. Idle connections are keyed by scheme,
+        host and port and are reused by later requests to the same server.
+
+        :param timeout: The socket timeout in seconds for new connections
+        :param max_redirects: The maximum number of redirects followed for a single request
+        """
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.idle = collections.defaultdict(list)
+        self.lock = threading.Lock()
+        self.connections_created = 0
+
+    @contextlib.contextmanager
+    def urlopen(self, url):
+        """
+        Issue a GET request for url, following redirects, and yield the response as a readable stream.
+        The connection is returned to the pool once the response has been read.
+
+        :raises: IOError if the server does not return the resource
+        """
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            key = (parts.scheme.lower(), parts.netloc)
+            path = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+            conn, response = self._request(key, path)
+            if response.status in REDIRECT_CODES and response.getheader('Location'):
+                response.read()
+                self._release(key, conn, response)
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            if response.status != 200:
+                response.read()
+                self._release(key, conn, response)
+                raise IOError('{0} returned HTTP {1} {2}'.format(url, response.status, response.reason))
+            try:
+                yield response
+            except:
+                conn.close()
+                raise
+            response.read()
+            self._release(key, conn, response)
+            return
+        raise IOError('Too many redirects requesting {0}'.format(url))
+
+    def close(self):
+        """Close all idle connections"""
+        with self.lock:
+            for connections in self.idle.values():
+                for conn in connections:
+                    conn.close()
+            self.idle.clear()
+
+    def _request(self, key, path):
+        conn, reused = self._acquire(key)
+        try:
+            conn.request('GET', path, headers={'Accept-Encoding': 'identity'})
+            return conn, conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            if not reused:
+                raise
+        # The server may close an idle connection at any time, so retry once on a new connection
+        conn = self._connect(key)
+        try:
+            conn.request('GET', path, headers={'Accept-Encoding': 'identity'})
+            return conn, conn.getresponse()
+        except:
+            conn.close()
+            raise
+
+    def _acquire(self, key):
+        with self.lock:
+            if self.idle[key]:
+                return self.idle[key].pop(), True
+        return self._connect(key), False
+
+    def _connect(self, key):
+        scheme, netloc = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        elif scheme == 'http':
+            conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        else:
+            raise IOError('Unsupported URL scheme "{0}"'.format(scheme))
+        with self.lock:
+            self.connections_created += 1
+        return conn
+
+    def _release(self, key, conn, response):
+        if response.will_close:
+            conn.close()
+        else:
+            with self.lock:
+                self.idle[key].append(conn)
@@ -56,6 +56,12 @@ class QuinceNoSuchRemoteException(QuinceException):
         self.remote_name = remote_name
         self.message = 'No remote with the name "' + remote_name + '".'
 
+class QuinceReadOnlyException(QuinceException):
+    """Raised when an attempt is made to modify a repository that was opened read-only"""
+    def __init__(self):
+        self.message = 'The quince repository was opened read-only.'
+
+
 class QuinceArgumentException(QuinceException):
     def __init__(self, msg):
         self.message = msg
@@ -0,0 +1,224 @@
+__author__ = 'Kal Ahmed'
+
+"""
+Secondary indexes of the quads in a quince store.
+
+The shard files of a store are addressed by subject, so finding the quads with a given predicate or object
+means reading every shard. The indexes hold a second copy of every quad with its terms in a different order:
+
+* pos - predicate, object, subject, graph: the quads with a given predicate (and object)
+* osp - object, subject, predicate, graph: the quads that reference a given object
+
+Alongside the indexes, a graph manifest records the shards that hold the quads of each graph (see
+:class:`GraphManifest`), so that the quads of a graph can be exported without reading every shard.
+
+Each index is itself a :class:`QuinceStore` in a directory under .quince/index, whose lines are the permuted
+quads. The first term of an index line selects its shard file just as the subject does in the store, so a
+lookup reads a single shard with a binary search (or the sub-files of the shard if it has been split). The
+index directory is excluded from git, as it can be rebuilt from the store.
+
+The indexes are optional. Once they have been built with `quince index rebuild`, every assertion and
+retraction made through a :class:`QuinceStore` is applied to the indexes as well, and the index files are
+written when the store is flushed. Changes made by other means, such as a git merge or checkout or a bulk
+import, are applied by `quince index update` (see :mod:`quince.core.qindex`), which is run by the quince git
+hooks.
+"""
+
+import glob
+import hashlib
+import os
+
+# The directory of the indexes in the .quince directory
+INDEX_DIR = 'index'
+# The file in the index directory that records the commit that the indexes were last updated from
+INDEX_HEAD = 'HEAD'
+
+INDEX_POS = 'pos'
+INDEX_OSP = 'osp'
+INDEX_NAMES = (INDEX_POS, INDEX_OSP)
+
+# The directory of the graph manifest in the index directory
+GRAPH_MANIFEST = 'graphs'
+MANIFEST_SUFFIX = '.lst'
+
+# The position of each term in a quad
+_QUAD_POSITIONS = 'spog'
+
+
+def split_terms(line, literal_position=2):
+    """
+    Returns the four terms of an NQuads line.
+
+    :param line: The line
+    :param literal_position: The position of the only term that may contain spaces. This is the object, which
+        is at position 2 in the lines of a store.
+    """
+    head = line.split(' ', literal_position)
+    tail = head.pop().rsplit(' ', 4 - literal_position)
+    return head + tail[:-1]
+
+
+class QuinceIndex:
+    def __init__(self, name, store):
+        """
+        An index of the quads of a store with the terms in the order given by the name of the index
+
+        :param name: The order of the subject, predicate and object in the index lines (e.g. 'pos')
+        :param store: The :class:`QuinceStore` that holds the index lines
+        """
+        self.name = name
+        self.store = store
+        # The position in a quad of each term of an index line
+        self.order = [_QUAD_POSITIONS.index(t) for t in name + 'g']
+        self.object_position = name.index('o')
+
+    def entry(self, line):
+        """Returns the path of the index file and the index line for an NQuads line of the store"""
+        terms = split_terms(line)
+        return self.store.make_raw_quad_entry(*[terms[i] for i in self.order])
+
+    def to_quad_line(self, index_line):
+        """Returns the NQuads line of the store for a line of the index"""
+        quad = [None] * 4
+        for term, position in zip(split_terms(index_line, self.object_position), self.order):
+            quad[position] = term
+        return '{0} {1} {2} {3} .\n'.format(*quad)
+
+    def add(self, line):
+        file_path, index_line = self.entry(line)
+        self.store.update_manager.add_line_to_file(file_path, index_line)
+
+    def remove(self, line):
+        file_path, index_line = self.entry(line)
+        self.store.update_manager.remove_line_from_file(file_path, index_line)
+
+    def lines(self, *terms):
+        """
+        Returns an iterator over the NQuads lines of the store whose terms, taken in the order of the index,
+        start with the specified terms
+
+        :param terms: One or more terms in NQuads syntax
+        """
+        prefix = ' '.join(terms) + ' '
+        for file_path in self.store.files_for_key(terms[0]):
+            for index_line in self.store.update_manager.iter_lines(file_path, prefix):
+                yield self.to_quad_line(index_line)
+
+
+class QuinceIndexes:
+    def __init__(self, indexes):
+        """
+        The secondary indexes of a store
+
+        :param indexes: A list of :class:`QuinceIndex`
+        """
+        self.indexes = {index.name: index for index in indexes}
+
+    def __getitem__(self, name):
+        return self.indexes[name]
+
+    def __iter__(self):
+        return iter(self.indexes.values())
+
+    def add(self, lines):
+        """Add NQuads lines of the store to every index"""
+        for line in lines:
+            for index in self.indexes.values():
+                index.add(line)
+
+    def remove(self, lines):
+        """Remove NQuads lines of the store from every index"""
+        for line in lines:
+            for index in self.indexes.values():
+                index.remove(line)
+
+    def flush(self):
+        for index in self.indexes.values():
+            index.store.flush()
+
+
+def index_dir(root):
+    """Returns the path to the index directory of the store at root"""
+    return os.path.join(root, INDEX_DIR)
+
+
+def line_graph(line):
+    """Returns the graph of an NQuads line of the store"""
+    return split_terms(line)[3]
+
+
+class GraphManifest:
+    def __init__(self, root, manager):
+        """
+        A record of the shards that hold the quads of each graph of a store, so that the quads of a graph can
+        be read without reading every shard. The manifest of a graph is a directory named after the SHA-1 hash of
+        the graph, holding a file for each top level directory of the store that lists the shards in that
+        directory that hold quads in the graph. Splitting the lists by directory keeps each file small even for
+        a graph, such as the default graph, that has quads in most of the shards.
+
+        :param root: The path to the manifest directory. The manifest can be passed to a :class:`QuinceBulkSink`
+            in place of a store to bulk load the lines returned by :meth:`entry`.
+        :param manager: The :class:`CachingFileManager` used to read and write the manifest files
+        """
+        self.root = root
+        self.manager = manager
+        self.stats = manager.stats
+
+    def entry(self, graph, shard):
+        """
+        Returns the path of the manifest file and the line that record that a shard holds quads in a graph
+
+        :param graph: The graph IRI in NQuads syntax
+        :param shard: The path of the shard relative to the store root, without the file extension
+        """
+        top, _, rest = shard.partition(os.sep)
+        return os.path.join(_graph_dir(self.root, graph), top + MANIFEST_SUFFIX), rest + '\n'
+
+    def add(self, graph, shard):
+        file_path, line = self.entry(graph, shard)
+        if line not in self.manager.iter_lines(file_path, line):
+            self.manager.add_line_to_file(file_path, line)
+
+    def remove(self, graph, shard):
+        file_path, line = self.entry(graph, shard)
+        self.manager.remove_line_from_file(file_path, line)
+
+    def shards(self, graph):
+        """Returns an iterator over the shards that hold quads in a graph"""
+        graph_dir = _graph_dir(self.root, graph)
+        file_paths = set(glob.glob(os.path.join(graph_dir, '*' + MANIFEST_SUFFIX)))
+        # Include the files that have been created in the cache but not yet written
+        file_paths.update(e.path for e in self.manager.cache.items() if os.path.dirname(e.path) == graph_dir)
+        file_paths.update(p for p in self.manager.evicted if os.path.dirname(p) == graph_dir)
+        for file_path in sorted(file_paths):
+            top = os.path.basename(file_path)[:-len(MANIFEST_SUFFIX)]
+            for line in self.manager.iter_lines(file_path):
+                yield os.path.join(top, line[:-1])
+
+    def flush(self):
+        self.manager.flush()
+
+
+def manifest_shards(root, graph):
+    """
+    Returns a list of the shards that the graph manifest of the store at root lists for a graph, read straight
+    from the manifest files, or None if the store has no graph manifest. Changes to the manifest that have not
+    been flushed are not seen.
+
+    :param root: The path to the .quince directory
+    :param graph: The graph IRI in NQuads syntax
+    """
+    manifest_root = os.path.join(index_dir(root), GRAPH_MANIFEST)
+    if not os.path.isdir(manifest_root):
+        return None
+    shards = []
+    for file_path in sorted(glob.glob(os.path.join(_graph_dir(manifest_root, graph), '*' + MANIFEST_SUFFIX))):
+        top = os.path.basename(file_path)[:-len(MANIFEST_SUFFIX)]
+        with open(file_path, encoding='utf-8', mode='r') as f:
+            shards.extend(os.path.join(top, line.rstrip('\n')) for line in f)
+    return shards
+
+
+def _graph_dir(manifest_root, graph):
+    h = hashlib.sha1(graph.encode('utf-8')).hexdigest()
+    return os.path.join(manifest_root, h[:2], h)
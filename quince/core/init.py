@@ -9,20 +9,30 @@ from quince.core import repo as repo_lib
 SUCCESS = 1
 NOTHING_TO_INIT = 2
 
+# Brings the quince indexes up to date with the working tree, if the repository has indexes
+_INDEX_UPDATE = '''
+# Quince index update
+if [ -d .quince/index ]
+then
+    quince index update || echo Error updating the quince indexes. Run quince index rebuild to rebuild them.
+fi
+'''
+
 # Hooks to add
 QUINCE_HOOKS = {
+    # The merged shards are sorted before the indexes are updated from them
     'post-merge': '''
 # Quince post-merge clean-up
 echo Calling quince post-merge clean-up
 if quince sort -s "HEAD^"
 then
     echo Post-merge clean-up completed OK
-    exit 0
 else
     echo Error running post-merge clean-up
     echo You may need to run the quince sort command manually to return the repository to a consistent state
     exit 1
-fi'''
+fi''' + _INDEX_UPDATE,
+    'post-checkout': _INDEX_UPDATE
 }
 
 
@@ -0,0 +1,122 @@
+__author__ = 'Kal Ahmed'
+
+"""
+Shard layouts: the strategies that map the SHA-1 hash of a subject to the file holding its quads.
+
+* flat - one file per subject hash, grouped into 256 directories by the most significant byte of the hash
+* nested - one file per subject hash, in two levels of directory using the first and then the first two bytes
+  of the hash, so that no directory holds more than 256 entries
+* bucket - the subjects are merged into a fixed number of bucket files, grouped into directories by the most
+  significant byte of the bucket number. Fewer, larger files are cheaper for the file system and the git index
+  but each update rewrites more data.
+
+The layout of a repository is stored in the [Store] section of its config file. Use `quince reshard` to
+change the layout of an existing repository.
+"""
+
+import abc
+import os
+
+from quince.core.exceptions import QuinceArgumentException
+
+LAYOUT_FLAT = 'flat'
+LAYOUT_NESTED = 'nested'
+LAYOUT_BUCKET = 'bucket'
+
+DEFAULT_BUCKETS = 4096
+
+# The options of the [Store] section of the config file that describe the layout
+LAYOUT_OPTIONS = ('layout', 'buckets')
+
+
+class ShardLayout(abc.ABC):
+    # The name of the layout in the config file
+    name = None
+    # The number of directory levels between the store root and the shard files
+    depth = 1
+
+    @abc.abstractmethod
+    def file_path(self, h):
+        """
+        Returns the path of the shard file for a subject hash, relative to the store root and without the file
+        extension
+
+        :param h: The hex SHA-1 digest of the subject
+        """
+
+    def options(self):
+        """Returns the options that are written to the [Store] section of the config file with the layout name"""
+        return {}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.options() == other.options()
+
+    def __str__(self):
+        options = ', '.join('{0}={1}'.format(k, v) for k, v in sorted(self.options().items()))
+        return '{0} ({1})'.format(self.name, options) if options else self.name
+
+
+class FlatLayout(ShardLayout):
+    name = LAYOUT_FLAT
+
+    def file_path(self, h):
+        return os.path.join(h[:2], h)
+
+
+class NestedLayout(ShardLayout):
+    name = LAYOUT_NESTED
+    depth = 2
+
+    def file_path(self, h):
+        return os.path.join(h[:2], h[:4], h)
+
+
+class BucketLayout(ShardLayout):
+    name = LAYOUT_BUCKET
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: The number of bucket files
+        """
+        if buckets < 1:
+            raise QuinceArgumentException('The number of buckets must be at least 1.')
+        self.buckets = buckets
+        self.width = max(2, len('{0:x}'.format(buckets - 1)))
+
+    def file_path(self, h):
+        bucket = '{0:0{1}x}'.format(int(h[:16], 16) % self.buckets, self.width)
+        return os.path.join(bucket[:2], bucket)
+
+    def options(self):
+        return {'buckets': str(self.buckets)}
+
+
+LAYOUTS = {
+    LAYOUT_FLAT: FlatLayout,
+    LAYOUT_NESTED: NestedLayout,
+    LAYOUT_BUCKET: BucketLayout
+}
+
+
+def make_layout(name, buckets=None):
+    """
+    Create a shard layout
+
+    :param name: One of 'flat', 'nested' or 'bucket'
+    :param buckets: The number of bucket files for the bucket layout. Defaults to 4096.
+    :raises: QuinceArgumentException if the layout is not recognized
+    """
+    try:
+        layout_class = LAYOUTS[name.lower()]
+    except KeyError:
+        raise QuinceArgumentException('Unknown shard layout "{0}". Expected one of {1}.'.format(
+            name, ', '.join(sorted(LAYOUTS))))
+    if layout_class is BucketLayout:
+        return BucketLayout(int(buckets) if buckets else DEFAULT_BUCKETS)
+    return layout_class()
+
+
+def layout_from_config(config):
+    """Returns the shard layout specified by the [Store] section of a quince config, defaulting to the flat layout"""
+    section = config['Store'] if 'Store' in config else {}
+    return make_layout(section.get('layout', LAYOUT_FLAT), section.get('buckets'))
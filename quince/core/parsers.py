@@ -1,6 +1,12 @@
 __author__ = 'Kal Ahmed'
 
+import bz2
 from codecs import getreader
+import gzip
+import io
+import lzma
+import os.path
+import re
 
 from rdflib.plugins.parsers.ntriples import NTriplesParser
 from rdflib.plugins.parsers.ntriples import ParseError
@@ -8,19 +14,82 @@ from rdflib.plugins.parsers.ntriples import r_tail
 from rdflib.plugins.parsers.ntriples import r_wspace
 from rdflib.util import guess_format
 
+from quince.core.repo import canonical_literal
+from quince.core.turtle import TurtleParser, TriGParser
+
 # Extension to format mappings to use in addition to the default ones in rdflib
 ext_map = {
     'ntriples': 'nt',
     'nquads': 'nquads'
 }
 
+# Compressed file extensions and the modules used to decompress them
+compression_map = {
+    '.gz': gzip,
+    '.bz2': bz2,
+    '.xz': lzma
+}
 
-def get_parser(file_path, sink):
-    fmt = guess_format(file_path) or guess_format(file_path, ext_map)
+# Magic numbers at the start of compressed streams
+compression_magic = [
+    (b'\x1f\x8b', gzip),
+    (b'BZh', bz2),
+    (b'\xfd7zXZ\x00', lzma)
+]
+
+READ_BUFFER_SIZE = 1 << 20
+
+
+def strip_compression_ext(file_path):
+    """Returns file_path without the extension of a supported compression format"""
+    root, ext = os.path.splitext(file_path)
+    return root if ext.lower() in compression_map else file_path
+
+
+def decompressing_reader(stream, file_path=None):
+    """
+    Wraps a binary stream in a large buffered reader, decompressing it on the fly if it is gzip,
+    bzip2 or xz compressed. The compression format is determined from the extension of file_path
+    if one is given or else from the first bytes of the stream.
+    """
+    module = compression_map.get(os.path.splitext(file_path)[1].lower()) if file_path else None
+    if not isinstance(stream, io.BufferedReader):
+        stream = io.BufferedReader(stream, READ_BUFFER_SIZE)
+    if module is None:
+        head = stream.peek(6)
+        module = next((m for magic, m in compression_magic if head.startswith(magic)), None)
+    if module is None:
+        return stream
+    return io.BufferedReader(module.open(stream), READ_BUFFER_SIZE)
+
+
+def get_parser(file_path, sink, raw=False, fmt=None):
+    """
+    Returns a parser for the RDF syntax indicated by the extension of file_path, ignoring
+    any compression extension.
+
+    :param file_path: The path to the file to be parsed
+    :param sink: The sink that receives the parsed triples and quads
+    :param raw: If True, N-Triples and N-Quads files are parsed with the :class:`RawNQuadsParser`.
+        The sink must implement raw_quad.
+    :param fmt: The RDF syntax of the file. Overrides the syntax determined from the file extension.
+    :return: A parser or None if the format is not supported
+    """
+    if fmt is None:
+        file_path = strip_compression_ext(file_path)
+        fmt = guess_format(file_path) or guess_format(file_path, ext_map)
+    else:
+        fmt = ext_map.get(fmt, fmt)
+    if raw and fmt in ('nt', 'nquads'):
+        return RawNQuadsParser(sink)
     if fmt == 'nt':
         return NTriplesParser(sink=sink)
     if fmt == 'nquads':
         return NQuadsParser(sink)
+    if fmt == 'turtle':
+        return TurtleParser(sink)
+    if fmt == 'trig':
+        return TriGParser(sink)
     return None
 
 
@@ -76,3 +145,40 @@ class NQuadsParser(NTriplesParser):
         # Must have a context aware store - add on a normal Graph
         # discards anything where the ctx != graph.identifier
         self.sink.quad(subject, predicate, obj, context)
+
+
+_IRI = r'<[^:\s"<>\\]+:[^\s"<>\\]*>'
+_RAW_LINE = re.compile(r'[ \t]*({iri})[ \t]+({iri})[ \t]+(?:({iri})|"([^"\\]*(?:\\.[^"\\]*)*)"'
+                       r'(?:@([a-zA-Z]+(?:-[a-zA-Z0-9]+)*)|\^\^<([^:\s"<>\\]+:[^\s"<>\\]*)>)?)'
+                       r'(?:[ \t]+({iri}))?[ \t]*\.[ \t]*(?:#.*)?'.format(iri=_IRI))
+
+
+class RawNQuadsParser(NQuadsParser):
+    """
+    A fast parser for N-Triples and N-Quads documents that avoids constructing rdflib terms.
+
+    Each line is validated and split into terms with a single regular expression, literals are converted to the
+    canonical form used in quince files and the terms are passed to the raw_quad method of the sink as strings.
+    Lines that the fast path does not handle (blank nodes and escaped IRIs) fall back to the rdflib-based
+    :class:`NQuadsParser` line parser and are delivered to the quad method of the sink.
+    """
+    def parse(self, source):
+        if not hasattr(source, 'read'):
+            raise ParseError("Item to parse must be a file-like object.")
+        for raw_line in source:
+            # The line is decoded whole as the terms are written out as text. The store hashes the subject to find
+            # its shard from the decoded term, which costs no more than hashing a slice of raw_line.
+            line = raw_line.decode('utf-8').rstrip('\r\n')
+            m = _RAW_LINE.fullmatch(line)
+            if m is None:
+                self.line = line
+                try:
+                    self.parseline()
+                except ParseError as msg:
+                    raise ParseError("Invalid line (%s):\n%r" % (msg, line))
+                continue
+            s, p, o, lexical, language, datatype, g = m.groups()
+            if o is None:
+                o = canonical_literal(lexical, language, datatype)
+            self.sink.raw_quad(s, p, o, g)
+        return self.sink
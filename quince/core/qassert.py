@@ -12,8 +12,8 @@ CURIE = re.compile(r'\[(?P<prefix>[^:]+):(?P<ref>[^\]]+)\]')
 LITERAL = re.compile(r'"(?P<lit>[^"\\]*(?:\\.[^"\\]*)*)"(\^\^<(?P<dt>[^>]*)>)?(@(?P<lang>[^\s]*))?')
 
 
-def assert_quad(subj, pred, obj, graph):
-    store = QuinceStore(qdir())
+def assert_quad(subj, pred, obj, graph, stats=None):
+    store = QuinceStore(qdir(), stats=stats)
     s, p, o, g = make_quad(store, subj, pred, obj, graph)
     store.assert_quad(s, p, o, g)
     store.flush()
@@ -21,8 +21,8 @@ def assert_quad(subj, pred, obj, graph):
     return s, p, o, g
 
 
-def retract_quad(subj, pred, obj, graph):
-    store = QuinceStore(qdir())
+def retract_quad(subj, pred, obj, graph, stats=None):
+    store = QuinceStore(qdir(), stats=stats)
     s, p, o, g = make_quad(store, subj, pred, obj, graph, True)
     retracted = store.retract_quad(s, p, o, g)
     store.flush()
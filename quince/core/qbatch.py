@@ -0,0 +1,125 @@
+__author__ = 'Kal Ahmed'
+
+import itertools
+import re
+
+from rdflib import Literal
+from rdflib.plugins.parsers.ntriples import unquote
+
+from quince.core.repo import QuinceStore, QUINCE_DEFAULT_GRAPH_IRI, qdir, git_add_files
+from quince.core.qassert import make_node
+from quince.core.exceptions import QuinceArgumentException, QuinceMultiException
+
+ASSERT = 'assert'
+RETRACT = 'retract'
+
+OPERATIONS = {'+': ASSERT, 'assert': ASSERT, '-': RETRACT, 'retract': RETRACT}
+
+OPERATION = re.compile(r'\s*(?P<op>[+-]|assert\s|retract\s)')
+TERM = re.compile(r'\s*(?P<term><[^>]*>|"[^"\\]*(?:\\.[^"\\]*)*"(?:\^\^<[^>]*>|@[^\s]*)?|[^\s]+)')
+LITERAL = re.compile(r'"(?P<lit>[^"\\]*(?:\\.[^"\\]*)*)"(\^\^<(?P<dt>[^>]*)>)?(@(?P<lang>[^\s]*))?$')
+
+
+def apply_batch(lines, stats=None):
+    """
+    Apply a sequence of assert and retract operations to the quince repository with a single flush and git add.
+
+    Each line holds one operation, starting with '+' or 'assert' to assert a quad or '-' or 'retract' to
+    retract all quads matching a pattern. The operation is followed by the subject, predicate, object and
+    optional graph, each written as an IRI in angle brackets, a safe CURIE or a quoted literal, and an optional
+    trailing '.', so the lines of an NQuads diff are valid operations. Retractions may use * as a wildcard
+    and may omit the predicate and object. Blank lines and lines starting with # are ignored.
+
+    All lines are parsed before any are applied, so a batch containing an invalid line makes no changes.
+    Consecutive operations of the same kind are applied together (see :meth:`QuinceStore.assert_quads`).
+
+    :param lines: An iterable over the operation lines
+    :param stats: The :class:`QuinceStats` to record cache and file activity in
+    :return: A tuple of (number of quads asserted, list of the NQuads lines retracted)
+    :raises: QuinceMultiException if any of the lines cannot be parsed
+    """
+    store = QuinceStore(qdir(), stats=stats)
+    operations = parse_operations(lines, store.ns_prefix_mappings)
+    asserted = 0
+    retracted = []
+    for op, group in itertools.groupby(operations, key=lambda x: x[0]):
+        quads = [q for _, q in group]
+        if op == ASSERT:
+            store.assert_quads(quads)
+            asserted += len(quads)
+        else:
+            retracted.extend(store.retract_quads(quads))
+    store.flush()
+    git_add_files()
+    return asserted, retracted
+
+
+def parse_operations(lines, prefix_mappings):
+    """
+    Parse batch operation lines (see :func:`apply_batch`).
+
+    :return: A list of (operation, (s, p, o, g)) tuples
+    :raises: QuinceMultiException if any of the lines cannot be parsed
+    """
+    operations = []
+    errors = []
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            operations.append(parse_operation(line, prefix_mappings))
+        except QuinceMultiException as e:
+            errors.extend(QuinceArgumentException('Line {0}: {1}'.format(line_number, inner.message))
+                          for inner in e.inner_exceptions)
+        except QuinceArgumentException as e:
+            errors.append(QuinceArgumentException('Line {0}: {1}'.format(line_number, e.message)))
+    if errors:
+        raise QuinceMultiException(errors)
+    return operations
+
+
+def parse_operation(line, prefix_mappings):
+    m = OPERATION.match(line)
+    if not m:
+        raise QuinceArgumentException('Expected the line to start with +, -, assert or retract.')
+    op = OPERATIONS[m.group('op').strip()]
+    terms = []
+    pos = m.end()
+    while pos < len(line):
+        m = TERM.match(line, pos)
+        if not m:
+            break
+        terms.append(m.group('term'))
+        pos = m.end()
+    if terms and terms[-1] == '.':
+        terms.pop()
+    min_terms = 3 if op == ASSERT else 1
+    if not min_terms <= len(terms) <= 4:
+        raise QuinceArgumentException('Expected between {0} and 4 terms but found {1}.'.format(min_terms, len(terms)))
+    if op == RETRACT:
+        terms += ['*'] * (3 - len(terms))
+    if len(terms) == 3:
+        terms.append(QUINCE_DEFAULT_GRAPH_IRI)
+    errors = []
+    quad = []
+    for position, term in enumerate(terms):
+        try:
+            quad.append(_make_term(term, op == RETRACT, position == 2, prefix_mappings))
+        except QuinceArgumentException as e:
+            errors.append(e)
+    if errors:
+        raise QuinceMultiException(errors)
+    return op, tuple(quad)
+
+
+def _make_term(term, allow_wildcards, allow_literals, prefix_mappings):
+    if allow_wildcards and term == '*':
+        return term
+    if allow_literals:
+        m = LITERAL.match(term)
+        if m:
+            return Literal(unquote(m.group('lit')), datatype=m.group('dt'), lang=m.group('lang'))
+    if term.startswith('<') and term.endswith('>'):
+        term = term[1:-1]
+    return make_node(term, prefix_mappings, allow_literals)
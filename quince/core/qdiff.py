@@ -5,7 +5,7 @@ import re
 
 import git
 
-from quince.core.repo import git_dir, QUINCE_DIR, QuinceStore
+from quince.core.repo import git_dir, QUINCE_DIR, QuinceStore, NQOUT
 
 LINE_REGEX = re.compile(r"(?P<s>" + QuinceStore.IRI_MATCH + r")\s+(?P<p>" + QuinceStore.IRI_MATCH + r")\s+" +
                         r"(?P<o>" + QuinceStore.URI_OR_LITERAL_MATCH + ")\s+" +
@@ -26,6 +26,9 @@ def generate_diffs(commits=None, resource=None, graph=None, output_format='nquad
         to_commit = g.commit(commits[1])
         diff_index = from_commit.diff(to_commit, paths=QUINCE_DIR, create_patch=True)
     for diff in diff_index:
+        # Only the shard files hold quads
+        if not (diff.b_path or diff.a_path).endswith(NQOUT):
+            continue
         diff_str = diff.diff.decode()
         for line in filter(lambda x: _filter_diff(x, resource, graph),  dropwhile(lambda x: not(x.startswith("@@")), diff_str.split("\n"))):
             diff_list.add(line.strip())
@@ -7,16 +7,17 @@ from quince.core import serializers
 from quince.core.repo import QuinceStore, qdir
 
 
-def export(output_stream, output_format, graphs):
+def export(output_stream, output_format, graphs, stats=None):
     """
     Export the contents of the Quince repository
 
     :param output_stream: The stream to write to
     :param output_format: The RDF syntax to export
     :param graphs: A list of graph IRIs or None to export all graphs
+    :param stats: The :class:`QuinceStats` to record cache and file activity in
     :return: 0 on success, non-zero on error
     """
-    store = QuinceStore(qdir(), None)
+    store = QuinceStore(qdir(), None, stats, read_only=True)
     serializer = serializers.get_serializer(output_format, output_stream, "utf-8")
     for line in store.all_quads(graphs):
         serializer.on_line(line)
\ No newline at end of file
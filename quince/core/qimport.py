@@ -1,35 +1,367 @@
 __author__ = 'Kal Ahmed'
 
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
 import os.path
+import queue
+import shutil
+import sys
+import tempfile
+import threading
 import urllib.request
+from urllib.parse import urlsplit
 
-from quince.core.parsers import get_parser
+from quince.core import qindex
+from quince.core.bulk import QuinceBulkSink, DEFAULT_RUN_SIZE, merge_runs, shard_groups
+from quince.core.download import ConnectionPool
+from quince.core.index import index_dir
+from quince.core.parsers import get_parser, decompressing_reader, READ_BUFFER_SIZE
 from quince.core.repo import qdir, QuinceStore, QuinceTripleSink, git_add_files
-from quince.core.exceptions import QuinceParseException, QuinceNoParserException
+from quince.core.skolem import SkolemizingSink
+from quince.core.stats import QuinceStats
+from quince.core.exceptions import QuinceParseException, QuinceNoParserException, QuinceArgumentException
 
 SUCCESS = 0
 
+# The file path used to import from standard input
+STDIN = '-'
 
-def import_file(file_path, default_graph=None):
-    store = QuinceStore(qdir(), default_graph)
-    sink = QuinceTripleSink(store)
-    parser = get_parser(file_path, sink)
+# The number of run partitions created for each worker process in a parallel import
+PARTITIONS_PER_JOB = 4
+
+# The number of parsed quads passed from a download thread to the store writer at a time
+QUEUE_BATCH_SIZE = 1000
+# The maximum number of batches waiting for the store writer
+QUEUE_SIZE = 64
+
+# Blank node skolemization modes
+SKOLEMIZE_RANDOM = 'random'
+SKOLEMIZE_DETERMINISTIC = 'deterministic'
+
+
+def import_file(file_path, default_graph=None, bulk=False, run_size=DEFAULT_RUN_SIZE, raw=False, fmt=None,
+                skolemize=SKOLEMIZE_RANDOM, replace_graph=None, stats=None):
+    """
+    Import the quads from a local file or URL into the quince repository. gzip, bzip2 and xz compressed
+    files are decompressed as they are read.
+
+    :param file_path: The path or http(s) URL of the file to import, or '-' to read from stdin
+    :param default_graph: The IRI of the graph to import triples into
+    :param bulk: If True, stage the parsed quads in sorted runs on disk and merge them into the
+        repository in a single pass rather than updating each file through the file cache
+    :param run_size: The maximum number of quads held in memory by a bulk import
+    :param raw: If True, use the :class:`RawNQuadsParser` for N-Triples and N-Quads files
+    :param fmt: The RDF syntax of the file. Required when reading from stdin.
+    :param skolemize: SKOLEMIZE_RANDOM to replace blank nodes with random IRIs, or SKOLEMIZE_DETERMINISTIC to
+        derive the IRIs from the content of the source (see :class:`SkolemizingSink`)
+    :param replace_graph: If specified, the IRI of a graph whose content is replaced by the imported data.
+        Triples are imported into this graph unless default_graph is specified. Implies bulk.
+    :param stats: The :class:`QuinceStats` to record cache and file activity in
+    """
+    store = QuinceStore(qdir(), default_graph or replace_graph, stats)
+    store_sink = _store_sink(store, bulk, run_size, replace_graph)
+    sink = _skolemizing(store_sink, skolemize)
+    parser = get_parser(file_path, sink, raw, fmt)
     if not parser:
         raise QuinceNoParserException(file_path)
     try:
-        if os.path.isfile(file_path):
-            with open(file_path, 'rb') as f:
-                parser.parse(f)
-        elif file_path.lower().startswith('http://') or file_path.lower().startswith('https://'):
-            with urllib.request.urlopen(file_path) as f:
-                parser.parse(f)
-        else:
-            raise IOError("File not found")
+        _parse(file_path, parser)
+        sink.close()
         store.flush()
         git_add_files()
-        return SUCCESS
     except Exception as e:
+        if isinstance(store_sink, QuinceBulkSink):
+            # Remove the runs staged before the failure
+            store_sink.discard()
         raise QuinceParseException(file_path, e)
+    if store.indexes is not None and (bulk or replace_graph is not None):
+        # The bulk loader writes the shard files directly
+        qindex.update(run_size=run_size, stats=stats)
+    return SUCCESS
+
+
+def import_files(file_paths, default_graph=None, jobs=1, run_size=DEFAULT_RUN_SIZE, raw=False, fmt=None,
+                 skolemize=SKOLEMIZE_RANDOM, replace_graph=None, stats=None):
+    """
+    Import several files into the quince repository using a pool of worker processes.
+
+    Each file is parsed by a worker process into sorted runs partitioned by shard directory. Once all files
+    are parsed, the partitions are merged into the repository in parallel. As each shard belongs to exactly
+    one partition, no two workers ever write to the same file. The repository is staged in git once
+    all of the partitions have been merged.
+
+    :param file_paths: The paths or http(s) URLs of the files to import
+    :param default_graph: The IRI of the graph to import triples into
+    :param jobs: The number of worker processes to use
+    :param run_size: The maximum number of quads held in memory by each worker
+    :param raw: If True, use the :class:`RawNQuadsParser` for N-Triples and N-Quads files
+    :param fmt: The RDF syntax of the files. Overrides the syntax determined from the file extensions.
+    :param skolemize: The blank node skolemization mode (see :func:`import_file`)
+    :param replace_graph: The IRI of a graph whose content is replaced by the imported data
+        (see :func:`import_file`). If any of the files cannot be imported, the store is not modified.
+    :param stats: The :class:`QuinceStats` to record file activity in. The activity of the worker processes
+        is added to it once they have finished.
+    :return: A dictionary mapping each file path to None if it was imported successfully,
+        or to the :class:`QuinceException` raised when importing it
+    """
+    root = qdir()
+    default_graph = default_graph or replace_graph
+    results = {}
+    partitions = jobs * PARTITIONS_PER_JOB
+    runs = [[] for _ in range(partitions)]
+    work_dir = tempfile.mkdtemp(prefix='quince-import-')
+    try:
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = {}
+            for file_path in file_paths:
+                if file_path == STDIN:
+                    results[file_path] = QuinceArgumentException('Cannot read from stdin in a parallel import')
+                elif get_parser(file_path, None, raw, fmt) is None:
+                    results[file_path] = QuinceNoParserException(file_path)
+                else:
+                    futures[file_path] = pool.submit(_stage_file, root, file_path, default_graph, run_size,
+                                                     work_dir, partitions, raw, fmt, skolemize)
+            for file_path, future in futures.items():
+                file_runs, error = future.result()
+                if error is None:
+                    results[file_path] = None
+                    for partition, partition_runs in enumerate(file_runs):
+                        runs[partition].extend(partition_runs)
+                else:
+                    results[file_path] = QuinceParseException(file_path, error)
+            if replace_graph is not None and any(results.values()):
+                # Replacing the graph with partial data would remove the quads from the failed files
+                replace_graph, runs = None, [[] for _ in range(partitions)]
+            for worker_stats in pool.map(_merge_partition, [root] * partitions, runs, [replace_graph] * partitions,
+                                         range(partitions), [partitions] * partitions):
+                if stats is not None:
+                    stats.add(worker_stats)
+        git_add_files()
+        if os.path.isdir(index_dir(root)):
+            # The bulk loader writes the shard files directly
+            qindex.update(run_size=run_size, stats=stats)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def import_urls(urls, default_graph=None, connections=4, bulk=False, run_size=DEFAULT_RUN_SIZE, raw=False,
+                fmt=None, skolemize=SKOLEMIZE_RANDOM, replace_graph=None, stats=None):
+    """
+    Import several http(s) URLs into the quince repository concurrently.
+
+    Up to `connections` downloads are in flight at a time over pooled keep-alive connections. Each response is
+    parsed as it downloads and the parsed quads are passed through a bounded queue to a single writer,
+    which stages the quads of each URL in sorted runs on disk. The runs of a URL are only applied to the
+    repository if the whole URL is imported successfully. The repository is flushed and staged in git once
+    at the end.
+
+    :param urls: The http(s) URLs to import
+    :param default_graph: The IRI of the graph to import triples into
+    :param connections: The maximum number of concurrent downloads
+    :param bulk: If True, merge the staged runs into the repository in a single pass (see :func:`import_file`)
+        rather than updating each file through the file cache
+    :param run_size: The maximum number of quads held in memory by the writer
+    :param raw: If True, use the :class:`RawNQuadsParser` for N-Triples and N-Quads files
+    :param fmt: The RDF syntax of the files. Overrides the syntax determined from the URLs.
+    :param skolemize: The blank node skolemization mode (see :func:`import_file`). Blank nodes are
+        skolemized separately for each URL.
+    :param replace_graph: The IRI of a graph whose content is replaced by the imported data
+        (see :func:`import_file`). If any of the URLs cannot be imported, the store is not modified.
+    :param stats: The :class:`QuinceStats` to record cache and file activity in
+    :return: A dictionary mapping each URL to None if it was imported successfully,
+        or to the :class:`QuinceException` raised when importing it
+    """
+    urls = list(collections.OrderedDict.fromkeys(urls))
+    store = QuinceStore(qdir(), default_graph or replace_graph, stats)
+    batches = queue.Queue(QUEUE_SIZE)
+    stop = threading.Event()
+    pool = ConnectionPool()
+    results = {}
+    # The runs of the URLs that were imported successfully
+    runs = []
+    # The staging sink of each URL that is still downloading
+    staged = {}
+    # Each URL being staged holds its share of the run size in memory
+    staging_run_size = max(1, run_size // connections)
+    work_dir = tempfile.mkdtemp(prefix='quince-import-')
+
+    def download(url):
+        error = None
+        try:
+            queue_sink = _skolemizing(_QueueSink(url, batches, stop), skolemize)
+            parser = get_parser(url, queue_sink, raw, fmt)
+            if not parser:
+                raise QuinceNoParserException(url)
+            with pool.urlopen(url) as response:
+                parser.parse(decompressing_reader(response, urlsplit(url).path))
+            queue_sink.close()
+        except QuinceNoParserException as e:
+            error = e
+        except Exception as e:
+            error = QuinceParseException(url, e)
+        finally:
+            _put(batches, (url, None, error), stop)
+
+    try:
+        with ThreadPoolExecutor(connections) as executor:
+            for url in urls:
+                executor.submit(download, url)
+            try:
+                while len(results) < len(urls):
+                    url, batch, error = batches.get()
+                    if batch is not None:
+                        if url not in staged:
+                            staged[url] = QuinceBulkSink(store, staging_run_size, tmp_dir=work_dir)
+                        for method, args in batch:
+                            getattr(staged[url], method)(*args)
+                        continue
+                    results[url] = error
+                    url_sink = staged.pop(url, None)
+                    if url_sink is None:
+                        continue
+                    if error is None:
+                        runs.extend(url_sink.detach_runs()[0])
+                    else:
+                        # A URL that fails part-way leaves the store untouched
+                        url_sink.discard()
+            except:
+                # Release any download threads waiting on the queue
+                stop.set()
+                raise
+        if replace_graph is not None and any(results.values()):
+            # Replacing the graph with partial data would remove the quads from the failed URLs
+            replace_graph, runs = None, []
+        if bulk or replace_graph is not None:
+            merge_runs(store.root, runs, replace_graph, stats=store.stats)
+        else:
+            for key, lines in shard_groups(runs):
+                store.assert_lines(os.path.join(store.root, key), [line.decode('utf-8') for line in lines])
+        store.flush()
+        git_add_files()
+        if store.indexes is not None and (bulk or replace_graph is not None):
+            # The bulk loader writes the shard files directly
+            qindex.update(run_size=run_size, stats=stats)
+    finally:
+        pool.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+class _QueueSink:
+    """
+    A parser sink that passes batches of the calls it receives to another thread through a queue. Each batch is
+    queued as a tuple of the URL being parsed, the list of calls and None.
+    """
+    def __init__(self, url, batches, stop):
+        self.url = url
+        self.batches = batches
+        self.stop = stop
+        self.batch = []
+
+    def quad(self, s, p, o, g):
+        self._add('quad', (s, p, o, g))
+
+    def triple(self, s, p, o):
+        self._add('triple', (s, p, o))
+
+    def raw_quad(self, s, p, o, g):
+        self._add('raw_quad', (s, p, o, g))
+
+    def _add(self, method, args):
+        self.batch.append((method, args))
+        if len(self.batch) >= QUEUE_BATCH_SIZE:
+            self.close()
+
+    def close(self):
+        if self.batch:
+            if not _put(self.batches, (self.url, self.batch, None), self.stop):
+                raise IOError('Import cancelled')
+            self.batch = []
+
+
+def _put(batches, item, stop):
+    """Put item on the queue, giving up if the stop event is set while waiting. Returns True if item was queued."""
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _store_sink(store, bulk, run_size, replace_graph):
+    if replace_graph is not None:
+        return QuinceBulkSink(store, run_size, replace_graph=replace_graph)
+    if bulk:
+        return QuinceBulkSink(store, run_size)
+    return QuinceTripleSink(store)
+
+
+def _skolemizing(sink, skolemize):
+    if skolemize == SKOLEMIZE_DETERMINISTIC:
+        return SkolemizingSink(sink)
+    if skolemize != SKOLEMIZE_RANDOM:
+        raise QuinceArgumentException('Unknown skolemization mode "{0}"'.format(skolemize))
+    return sink
+
+
+def is_url(file_path):
+    return file_path.lower().startswith('http://') or file_path.lower().startswith('https://')
+
+
+def _stage_file(root, file_path, default_graph, run_size, work_dir, partitions, raw, fmt, skolemize):
+    """
+    Worker process entry point for :func:`import_files`. Parses a single file into partitioned runs.
+
+    :return: A tuple of (runs, error message). On error the runs are discarded.
+    """
+    store = QuinceStore.entry_maker(root, default_graph)
+    sink = QuinceBulkSink(store, run_size, tmp_dir=work_dir, partitions=partitions)
+    try:
+        parser_sink = _skolemizing(sink, skolemize)
+        _parse(file_path, get_parser(file_path, parser_sink, raw, fmt))
+        if parser_sink is not sink:
+            # Write out the skolemized quads without merging the runs
+            parser_sink.flush()
+        return sink.detach_runs(), None
+    except Exception as e:
+        sink.discard()
+        return None, str(e)
+
+
+def _merge_partition(root, runs, replace_graph, partition, partitions):
+    """
+    Worker process entry point for :func:`import_files`. Merges the runs of a partition into the store.
+
+    :return: The :class:`QuinceStats` recorded by the merge
+    """
+    stats = QuinceStats()
+    merge_runs(root, runs, replace_graph, partition, partitions, stats)
+    return stats
+
 
+def _parse(file_path, parser):
+    with open_source(file_path) as f:
+        parser.parse(f)
 
 
+@contextlib.contextmanager
+def open_source(file_path):
+    """
+    Opens a local file, http(s) URL or stdin (if file_path is '-') as a buffered binary stream,
+    decompressing gzip, bzip2 and xz compressed content as it is read.
+    """
+    if file_path == STDIN:
+        yield decompressing_reader(sys.stdin.buffer)
+        return
+    if os.path.isfile(file_path):
+        f = open(file_path, 'rb', buffering=READ_BUFFER_SIZE)
+    elif is_url(file_path):
+        f = urllib.request.urlopen(file_path)
+    else:
+        raise IOError("File not found")
+    with f:
+        yield decompressing_reader(f, file_path)
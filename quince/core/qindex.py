@@ -0,0 +1,156 @@
+__author__ = 'Kal Ahmed'
+
+import logging
+import os
+import shutil
+
+import git
+import gitdb.exc
+
+from quince.core.bulk import QuinceBulkSink, DEFAULT_RUN_SIZE, shard_keys
+from quince.core.index import INDEX_DIR, INDEX_HEAD, INDEX_NAMES, GRAPH_MANIFEST, line_graph
+from quince.core.layout import BucketLayout
+from quince.core.repo import QuinceStore, qdir, git_dir, git_ignore, QUINCE_DIR, NQOUT
+
+
+def rebuild(run_size=DEFAULT_RUN_SIZE, stats=None):
+    """
+    Build the predicate and object indexes and the graph manifest of the quince repository from scratch (see
+    :mod:`quince.core.index`). Once built, they are maintained by every change made through quince.
+
+    The lines of the index files are staged in sorted runs and merged into the index files in a single pass
+    (see :mod:`quince.core.bulk`), so memory use is bounded by run_size however large the repository is.
+
+    :param run_size: The maximum number of lines held in memory by each index
+    :param stats: The :class:`QuinceStats` to record cache and file activity in
+    :return: The number of quads indexed
+    """
+    root = qdir()
+    index_root = os.path.join(root, INDEX_DIR)
+    shutil.rmtree(index_root, ignore_errors=True)
+    for name in INDEX_NAMES + (GRAPH_MANIFEST,):
+        os.makedirs(os.path.join(index_root, name))
+    git_ignore(root, INDEX_DIR)
+    store = QuinceStore(root, stats=stats)
+    sinks = []
+    for index in store.indexes:
+        # Bucket files keep the number of index files bounded however many distinct objects there are
+        index.store.set_layout(BucketLayout())
+        sinks.append((index, QuinceBulkSink(index.store, run_size)))
+    manifest_sink = QuinceBulkSink(store.graph_manifest, run_size)
+    count = 0
+    file_paths = [os.path.join(root, key) for key in shard_keys(root)]
+    try:
+        for file_path in store.update_manager.prefetch(file_paths):
+            graphs = set()
+            for line in store.update_manager.iter_lines(file_path):
+                for index, sink in sinks:
+                    sink.add_line(*index.entry(line))
+                graphs.add(line_graph(line))
+                count += 1
+            shard = store.shard_key(file_path)
+            for graph in graphs:
+                manifest_sink.add_line(*store.graph_manifest.entry(graph, shard))
+        for _, sink in sinks + [(None, manifest_sink)]:
+            sink.close()
+    except:
+        # Remove the runs of every sink, including those that were not closed
+        for _, sink in sinks + [(None, manifest_sink)]:
+            sink.discard()
+        raise
+    _write_head(index_root, _head_commit())
+    return count
+
+
+def update(since=None, run_size=DEFAULT_RUN_SIZE, stats=None):
+    """
+    Bring the indexes of the quince repository up to date with changes that were not made through a
+    :class:`QuinceStore`, such as a git merge or checkout or a bulk import.
+
+    The lines that differ between a commit and the working tree are found with git diff. Each line is added to
+    the indexes if the repository holds it and removed from them if not, so applying a change that the indexes
+    already reflect does no harm. If the indexes have not been built, this does nothing. If no commit is
+    specified and the indexes do not record the commit that they were last updated from, they are rebuilt.
+    They are also rebuilt if more than run_size lines have changed, as the rebuild is done in bounded memory
+    and the changed lines are not.
+
+    :param since: The commit to find the changes from. Defaults to the commit recorded when the indexes
+        were last built or updated.
+    :param run_size: The maximum number of changed lines to apply to the indexes. Above this, the indexes
+        are rebuilt with run_size as the maximum number of lines held in memory by each index.
+    :param stats: The :class:`QuinceStats` to record cache and file activity in
+    :return: The number of changed lines found, the number of quads indexed if the indexes were rebuilt,
+        or None if the repository has no indexes
+    """
+    log = logging.getLogger('quince')
+    root = qdir()
+    index_root = os.path.join(root, INDEX_DIR)
+    store = QuinceStore(root, stats=stats)
+    if store.indexes is None:
+        return None
+    since = since or _read_head(index_root)
+    if not since:
+        log.info('Rebuilding the indexes as the commit they were last updated from is not known.')
+        return rebuild(run_size, stats)
+    repo = git.Repo(git_dir())
+    try:
+        commit = repo.commit(since)
+    except (gitdb.exc.BadName, ValueError):
+        log.info('Rebuilding the indexes as commit {0} cannot be found.'.format(since))
+        return rebuild(run_size, stats)
+    changes = _changed_files(repo, commit.hexsha)
+    changed = sum(count for _, count in changes)
+    if changed > run_size:
+        log.info('Rebuilding the indexes as {0} lines have changed since commit {1}.'.format(changed, since))
+        return rebuild(run_size, stats)
+    work_dir = repo.working_tree_dir
+    for path, _ in changes:
+        store.update_indexes(os.path.join(work_dir, path), _changed_lines(repo, commit.hexsha, path))
+    store.flush()
+    log.debug('Checked {0} changed lines against the indexes'.format(changed))
+    _write_head(index_root, _head_commit())
+    return changed
+
+
+def _changed_files(repo, commit):
+    """
+    Returns a list of the path of each shard file that differs between a commit and the working tree paired
+    with the number of lines added to and removed from it. Without rename detection a moved file shows as the
+    removal of all of its lines from its old path and their addition at the new path, so that the graph
+    manifest is updated for both shards.
+    """
+    changes = []
+    for stat in repo.git.diff(commit, '--numstat', '--no-renames', '--', QUINCE_DIR).splitlines():
+        added, removed, path = stat.split('\t', 2)
+        if path.endswith(NQOUT):
+            changes.append((path, int(added) + int(removed)))
+    return changes
+
+
+def _changed_lines(repo, commit, path):
+    """Returns a list of the lines added to or removed from a file since a commit"""
+    patch = repo.git.diff(commit, '--no-renames', '--unified=0', '--', path).split('\n')
+    # The lines before the first hunk are the header of the patch
+    first_hunk = next((i for i, diff_line in enumerate(patch) if diff_line.startswith('@@')), len(patch))
+    return [diff_line[1:] + '\n' for diff_line in patch[first_hunk:] if diff_line.startswith(('+', '-'))]
+
+
+def _head_commit():
+    try:
+        return git.Repo(git_dir()).head.commit.hexsha
+    except ValueError:
+        # The repository has no commits
+        return ''
+
+
+def _read_head(index_root):
+    try:
+        with open(os.path.join(index_root, INDEX_HEAD)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ''
+
+
+def _write_head(index_root, commit):
+    with open(os.path.join(index_root, INDEX_HEAD), 'w') as f:
+        f.write(commit + '\n')
@@ -0,0 +1,20 @@
+__author__ = 'Kal Ahmed'
+
+from quince.core.qassert import make_quad
+from quince.core.repo import QuinceStore, qdir
+
+
+def match(subj, pred, obj, graph, stats=None):
+    """
+    Find the quads in the Quince repository that match a pattern (see :meth:`QuinceStore.match`)
+
+    :param subj: The subject as an absolute IRI, a safe CURIE or a * wildcard
+    :param pred: The predicate as an absolute IRI, a safe CURIE or a * wildcard
+    :param obj: The object as a quoted literal, an absolute IRI, a safe CURIE or a * wildcard
+    :param graph: The graph as an absolute IRI, a safe CURIE or a * wildcard
+    :param stats: The :class:`QuinceStats` to record cache and file activity in
+    :return: An iterator over the matching NQuads lines
+    """
+    store = QuinceStore(qdir(), stats=stats, read_only=True)
+    s, p, o, g = make_quad(store, subj, pred, obj, graph, True)
+    return store.match(s, p, o, g)
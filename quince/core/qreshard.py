@@ -0,0 +1,77 @@
+__author__ = 'Kal Ahmed'
+
+import logging
+import os
+import shutil
+
+from quince.core import qindex
+from quince.core.bulk import QuinceBulkSink, DEFAULT_RUN_SIZE, shard_keys
+from quince.core.repo import QuinceStore, qdir, repo_dir, git_add_files, NQOUT
+
+# The directory in the working tree that the new shard files are built in
+STAGING_DIR = '.quince-reshard'
+
+
+def reshard(layout, run_size=DEFAULT_RUN_SIZE):
+    """
+    Move the quads in the quince repository into the shard files of a new layout.
+
+    The lines of the existing shard files are streamed into sorted runs keyed by their new shard file, and
+    the runs are merged into a staging directory (see :mod:`quince.core.bulk`), so memory use is bounded by
+    run_size however large the repository is. The old shard files are then replaced by the staged files,
+    the new layout is recorded in the repository config and the changes are staged in git. If the command
+    is interrupted, the repository can be restored from git. As the graph manifest records the shards that hold
+    each graph, the indexes of the repository, if it has any, are rebuilt.
+
+    :param layout: The :class:`ShardLayout` to move to
+    :param run_size: The maximum number of lines held in memory
+    :return: The number of shard files in the new layout, or None if the repository already uses the layout
+    """
+    log = logging.getLogger('quince')
+    root = qdir()
+    store = QuinceStore(root)
+    if store.layout == layout:
+        log.warning('The repository already uses the {0} layout.'.format(layout))
+        return None
+    staging = os.path.join(repo_dir(), STAGING_DIR)
+    # Remove the output of an interrupted reshard
+    shutil.rmtree(staging, ignore_errors=True)
+    os.mkdir(staging)
+    try:
+        target = QuinceStore(staging)
+        target.layout = layout
+        sink = QuinceBulkSink(target, run_size)
+        old_keys = []
+        try:
+            for key in shard_keys(root):
+                old_keys.append(key)
+                with open(os.path.join(root, key), encoding='utf-8', mode='r') as f:
+                    for line in f:
+                        if not line.endswith('\n'):
+                            line += '\n'
+                        # Subjects are IRIs, which cannot contain spaces
+                        sink.add_line(target.make_file_path_for_n3(line.partition(' ')[0]) + NQOUT, line)
+        except:
+            sink.discard()
+            raise
+        log.debug('Merging the lines of {0} shard files'.format(len(old_keys)))
+        sink.close()
+        for key in old_keys:
+            os.remove(os.path.join(root, key))
+        _remove_empty_directories(root)
+        new_keys = list(shard_keys(staging))
+        for key in new_keys:
+            os.renames(os.path.join(staging, key), os.path.join(root, key))
+        store.set_layout(layout)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    git_add_files()
+    if store.graph_manifest is not None:
+        qindex.rebuild(run_size)
+    return len(new_keys)
+
+
+def _remove_empty_directories(root):
+    for dir_path, dirs, files in os.walk(root, topdown=False):
+        if dir_path != root and not os.listdir(dir_path):
+            os.rmdir(dir_path)
@@ -4,16 +4,16 @@ import logging
 
 import git
 
-from quince.core.repo import QuinceStore, qdir, git_dir, QUINCE_DIR
+from quince.core.repo import QuinceStore, qdir, git_dir, QUINCE_DIR, NQOUT
 
 
-def sort_all():
-    store = QuinceStore(qdir())
+def sort_all(stats=None):
+    store = QuinceStore(qdir(), stats=stats)
     store.sort_quads()
     return True
 
 
-def sort_modified(since=None):
+def sort_modified(since=None, stats=None):
     g = git.Repo(git_dir())
     log = logging.getLogger('quince')
     if since is None:
@@ -24,12 +24,12 @@ def sort_modified(since=None):
         diff_index = since_commit.diff(paths=QUINCE_DIR)
     path_list = []
     for d in diff_index:
-        if not d.deleted_file:
+        if not d.deleted_file and d.b_blob.path.endswith(NQOUT):
             path_list.append(d.b_blob.path)
     if len(path_list) == 0:
         log.warn('No locally modified files found in the quince repository.')
         return
     log.debug('Checking sort order for {0} file{1}'.format(len(path_list), '' if len(path_list) == 1 else 's'))
-    store = QuinceStore(qdir())
+    store = QuinceStore(qdir(), stats=stats)
     store.sort_quads(path_list)
     return True
@@ -1,27 +1,67 @@
 __author__ = 'Kal Ahmed'
 
+import array
 import bisect
 import collections
+from concurrent.futures import ThreadPoolExecutor
 import configparser
 from enum import Enum
 import glob
 import hashlib
 import itertools
 import logging
+import mmap
+import operator
 import os
 import re
+import struct
+import sys
+import threading
 
 import git
 import git.cmd
 import rdflib
-
+from rdflib.plugins.parsers.ntriples import unquote
+import rdflib.term
+import rdflib.util
+
+from quince.core.cache import LRUCache, make_cache, parse_size, POLICY_LRU
+from quince.core.index import QuinceIndex, QuinceIndexes, GraphManifest, INDEX_DIR, INDEX_NAMES, INDEX_POS, \
+    INDEX_OSP, GRAPH_MANIFEST, line_graph, split_terms
+from quince.core.layout import layout_from_config, LAYOUT_OPTIONS
+from quince.core.shardcache import ShardCache, CACHE_DIR
+from quince.core.stats import QuinceStats
 from quince.core.exceptions import QuincePreconditionFailedException, QuinceNamespaceExistsException, \
-    QuinceNoSuchNamespaceException, QuinceRemoteExistsException, QuinceNoSuchRemoteException
+    QuinceNoSuchNamespaceException, QuinceRemoteExistsException, QuinceNoSuchRemoteException, \
+    QuinceReadOnlyException
 
 QUINCE_DIR = '.quince'
 QUINCE_DEFAULT_GRAPH_IRI = 'http://networkedplanet.com/quince/.well-known/default-graph'
 NQOUT = '.nqo'
 NQIN = '.nqi'
+# The suffix of the directory that the lines of a split shard are moved into
+NQSPLIT = '.nqs'
+# The names of the files in the directory of a split shard
+SPLIT_FILES = ['{0:02x}'.format(i) + NQOUT for i in range(256)]
+TMP = '.tmp'
+FLUSH_JOURNAL = 'flush.journal'
+# The git ignore file of the .quince directory, which excludes the local caches and indexes
+GITIGNORE = '.gitignore'
+# The directories of the .quince directory that do not hold shard files
+LOCAL_DIRS = frozenset([CACHE_DIR, INDEX_DIR])
+
+# Default settings for the [Cache] section of the quince config file
+DEFAULT_CACHE_ENTRIES = 10000
+DEFAULT_CACHE_BYTES = '512M'
+DEFAULT_WRITER_THREADS = 4
+DEFAULT_READER_THREADS = 4
+DEFAULT_PREFETCH_DEPTH = 32
+DEFAULT_MISSING_ENTRIES = 100000
+# The shard cache is disabled by default (see quince.core.shardcache)
+DEFAULT_SHARD_CACHE_BYTES = '0'
+
+# Default settings for the [Store] section of the quince config file
+DEFAULT_SPLIT_SIZE = '64M'
 
 
 def git_dir():
@@ -52,6 +92,26 @@ def qdir():
     return os.path.join(repo_dir(), QUINCE_DIR)
 
 
+def git_ignore(path, name):
+    """
+    Exclude a directory of the .quince directory from git by adding it to the .gitignore file of the
+    .quince directory, unless it is already there.
+
+    :param path: The path to the .quince directory
+    :param name: The name of the directory
+    """
+    ignore_path = os.path.join(path, GITIGNORE)
+    pattern = '/{0}/'.format(name)
+    try:
+        with open(ignore_path, encoding='utf-8') as f:
+            if pattern in f.read().splitlines():
+                return
+    except FileNotFoundError:
+        pass
+    with open(ignore_path, encoding='utf-8', mode='a') as f:
+        f.write(pattern + '\n')
+
+
 def init(path, init_git=False):
     if init_git:
         git.Repo.init(path)
@@ -109,6 +169,20 @@ class QuinceTripleSink:
             raise QuincePreconditionFailedException(self.update_mode, s, p, o, g)
         self.failed_preconditions.append((self.update_mode, s, p, o, g))
 
+    def raw_quad(self, s, p, o, g):
+        """
+        Receives a quad whose terms are already in canonical NQuads form. The graph may be None.
+        """
+        if self.update_mode is UpdateMode.ASSERT:
+            self.store.assert_raw_quad(s, p, o, g)
+        else:
+            self.quad(*[rdflib.util.from_n3(t) if t else None for t in (s, p, o, g)])
+
+    def close(self):
+        """Called once the parser has delivered all of its quads. Updates are applied immediately so there is
+        nothing to do here."""
+        pass
+
 
 class RdflibGraphAdapter(rdflib.ConjunctiveGraph):
     def __init__(self, sink):
@@ -126,7 +200,7 @@ class RdflibGraphAdapter(rdflib.ConjunctiveGraph):
         self.current_context = c
 
     def add(self, triple):
-        self.sink.quad(triple[0], triple[1]. triple[2], self.current_context)
+        self.sink.quad(triple[0], triple[1], triple[2], self.current_context)
 
 
 class QuinceStore:
@@ -135,11 +209,89 @@ class QuinceStore:
     LITERAL_MATCH = r'"[^"\\]*(?:\\.[^"\\]*)*"(\^\^\<[^\>]*\>)?(@[^\s]*)?'
     URI_OR_LITERAL_MATCH = '(' + IRI_MATCH + '|' + LITERAL_MATCH + ')'
 
-    def __init__(self, path, default_graph=None):
+    def __init__(self, path, default_graph=None, stats=None, read_only=False):
+        """
+        :param path: The path to the .quince directory
+        :param default_graph: The IRI of the graph that quads without a graph are added to
+        :param stats: The :class:`QuinceStats` to record cache and file activity in. If not specified,
+            a new QuinceStats is created. The statistics are available from the stats attribute.
+        :param read_only: If True, the store never creates, modifies or deletes any file. Methods that would
+            modify the store raise a QuinceReadOnlyException.
+        """
+        self._init_layout(path, default_graph, stats, read_only)
+        journal_path = os.path.join(self.root, FLUSH_JOURNAL)
+        if not read_only:
+            FlushJournal.recover(journal_path)
+        elif os.path.exists(journal_path):
+            logging.getLogger('quince').warning('The repository has an interrupted write that will be completed '
+                                                'or discarded when it is next opened for update')
+        cache_config = self.config['Cache'] if 'Cache' in self.config else {}
+        shard_cache = None
+        shard_cache_bytes = parse_size(cache_config.get('shard_cache', DEFAULT_SHARD_CACHE_BYTES))
+        if shard_cache_bytes:
+            if not read_only:
+                git_ignore(self.root, CACHE_DIR)
+            shard_cache = ShardCache(os.path.join(self.root, CACHE_DIR), self.root, shard_cache_bytes, self.stats)
+        self.update_manager = CachingFileManager(int(cache_config.get('max_entries', DEFAULT_CACHE_ENTRIES)),
+                                                 journal_path,
+                                                 parse_size(cache_config.get('max_bytes', DEFAULT_CACHE_BYTES)),
+                                                 cache_config.get('policy', POLICY_LRU),
+                                                 self.stats,
+                                                 int(cache_config.get('writers', DEFAULT_WRITER_THREADS)),
+                                                 int(cache_config.get('readers', DEFAULT_READER_THREADS)),
+                                                 int(cache_config.get('prefetch', DEFAULT_PREFETCH_DEPTH)),
+                                                 int(cache_config.get('max_missing', DEFAULT_MISSING_ENTRIES)),
+                                                 read_only,
+                                                 shard_cache)
+        self.indexes = None
+        index_root = os.path.join(self.root, INDEX_DIR)
+        if os.path.isdir(index_root):
+            self.indexes = QuinceIndexes([QuinceIndex(name, QuinceStore(os.path.join(index_root, name),
+                                                                        stats=self.stats, read_only=read_only))
+                                          for name in INDEX_NAMES])
+        self.graph_manifest = None
+        manifest_root = os.path.join(index_root, GRAPH_MANIFEST)
+        # The manifest is only used once it has been built, as it must list every shard that holds a graph
+        if os.path.isdir(manifest_root):
+            manifest_journal_path = os.path.join(manifest_root, FLUSH_JOURNAL)
+            if not read_only:
+                FlushJournal.recover(manifest_journal_path)
+            self.graph_manifest = GraphManifest(manifest_root,
+                                                CachingFileManager(DEFAULT_CACHE_ENTRIES, manifest_journal_path,
+                                                                   stats=self.stats, read_only=read_only))
+        # The graphs of the lines added to and removed from each shard since the graph manifest was last updated
+        self._graph_adds = collections.defaultdict(set)
+        self._graph_removes = collections.defaultdict(set)
+
+    def _init_layout(self, path, default_graph, stats, read_only):
         self.root = os.path.abspath(path)
-        self.default_graph = default_graph or rdflib.URIRef(QUINCE_DEFAULT_GRAPH_IRI)
-        self.update_manager = CachingFileManager(10000)
+        self.stats = stats or QuinceStats()
+        self.default_graph = rdflib.URIRef(default_graph or QUINCE_DEFAULT_GRAPH_IRI)
+        self.read_only = read_only
         self._config = None
+        self.layout = layout_from_config(self.config)
+        store_config = self.config['Store'] if 'Store' in self.config else {}
+        self.split_size = parse_size(store_config.get('split_size', DEFAULT_SPLIT_SIZE))
+        self.split_shards = LRUCache(DEFAULT_MISSING_ENTRIES)
+
+    @classmethod
+    def entry_maker(cls, path, default_graph=None, stats=None):
+        """
+        Returns a read-only store that can only map quads to the files and lines that hold them (see
+        :meth:`make_quad_entry`), for processes that prepare changes to a store without reading it, such as
+        the workers of a parallel import. Unlike opening the store, this neither recovers an interrupted
+        write nor creates a file cache.
+
+        :param path: The path to the .quince directory
+        :param default_graph: The IRI of the graph that quads without a graph are added to
+        :param stats: The :class:`QuinceStats` to record file activity in
+        """
+        store = cls.__new__(cls)
+        store._init_layout(path, default_graph, stats, True)
+        store.update_manager = None
+        store.indexes = None
+        store.graph_manifest = None
+        return store
 
     @property
     def config(self):
@@ -149,6 +301,7 @@ class QuinceStore:
         return self._config
 
     def add_namespace(self, prefix, iri):
+        self._check_writable()
         config = self.config
         try:
             ns_section = config['Namespaces']
@@ -161,6 +314,7 @@ class QuinceStore:
         self._flush_config()
 
     def remove_namespace(self, prefix):
+        self._check_writable()
         config = self.config
         try:
             ns_section = config['Namespaces']
@@ -171,6 +325,30 @@ class QuinceStore:
             del ns_section[prefix]
             self._flush_config()
 
+    def _check_writable(self):
+        if self.read_only:
+            raise QuinceReadOnlyException()
+
+    def set_layout(self, layout):
+        """
+        Record the shard layout of the store in the config file. The other options of the [Store] section are
+        kept. This does not move any existing files: see :func:`quince.core.qreshard.reshard`.
+
+        :param layout: The :class:`ShardLayout` to use
+        """
+        self._check_writable()
+        config = self.config
+        if 'Store' in config:
+            for option in LAYOUT_OPTIONS:
+                config.remove_option('Store', option)
+        else:
+            config.add_section('Store')
+        config['Store']['layout'] = layout.name
+        for option, value in layout.options().items():
+            config['Store'][option] = value
+        self._flush_config()
+        self.layout = layout
+
     def add_remote(self, name, endpoint):
         """
         Add a configuration entry for a new remote
@@ -179,6 +357,7 @@ class QuinceStore:
         :param endpoint: The remote endpoint IRI
         :raises: QuinceRemoteExistsException if a remote with the specified name already exists
         """
+        self._check_writable()
         config = self.config
         section_name = 'Remote "{0}"'.format(name)
         if section_name in config:
@@ -196,6 +375,7 @@ class QuinceStore:
         :param name:
         :raises: QuinceNoSuchRemoteException if a remote with the specified name does not exist
         """
+        self._check_writable()
         config = self.config
         section_name = 'Remote "{0}"'.format(name)
         try:
@@ -224,46 +404,309 @@ class QuinceStore:
             self.config.write(f)
 
     def assert_quad(self, s, p, o, g=None):
-        s, p, o = self.skolemize(s, p, o)
-        subject_file_path = self.make_file_path(s) + NQOUT
-        nq = self.make_nquad(s, p, o, g or self.default_graph)
+        subject_file_path, nq = self.make_quad_entry(s, p, o, g)
         self.update_manager.add_line_to_file(subject_file_path, nq)
+        self._record_changes(subject_file_path, [nq])
+
+    def assert_raw_quad(self, s, p, o, g=None):
+        subject_file_path, nq = self.make_raw_quad_entry(s, p, o, g)
+        self.update_manager.add_line_to_file(subject_file_path, nq)
+        self._record_changes(subject_file_path, [nq])
+
+    def assert_lines(self, file_path, lines):
+        """
+        Add NQuads lines to a file of the store
+
+        :param file_path: The path of the file that holds the lines
+        :param lines: A list of NQuads lines, each ending with a newline
+        """
+        self.update_manager.add_lines_to_file(file_path, lines)
+        self._record_changes(file_path, lines)
 
     def retract_quad(self, s, p, o, g=None):
-        subject_file_path = self.make_file_path(s) + NQOUT
         nq = self.make_nquad_pattern(s, p, o, g or self.default_graph)
-        print(nq)
-        return self.update_manager.remove_lines_from_file(subject_file_path, nq)
+        prefix = self._line_prefix(s, p, o)
+        retracted = []
+        for file_path in self._files_for_pattern(s, p, o):
+            removed = self.update_manager.remove_lines_from_file(file_path, nq, prefix)
+            self._record_changes(file_path, removed, True)
+            retracted.extend(removed)
+        return retracted
+
+    def assert_quads(self, quads):
+        """
+        Assert a collection of quads. The quads are grouped by the file that holds them and each file
+        is updated with all of its new lines at once.
+
+        :param quads: An iterable of (s, p, o, g) tuples. g may be None to assert into the default graph.
+        """
+        by_file = collections.defaultdict(list)
+        for s, p, o, g in quads:
+            file_path, nq = self.make_quad_entry(s, p, o, g)
+            by_file[file_path].append(nq)
+        for file_path, lines in by_file.items():
+            self.update_manager.add_lines_to_file(file_path, lines)
+            self._record_changes(file_path, lines)
+
+    def retract_quads(self, patterns):
+        """
+        Retract all quads that match any of a collection of patterns. The patterns are grouped by the file
+        that holds the matching quads and each file is scanned once for all of its patterns.
+
+        :param patterns: An iterable of (s, p, o, g) tuples. Any term may be '*' to match all values. g may be
+            None to retract from the default graph. A pattern with a wildcard subject is applied to every file.
+        :return: A list of the NQuads lines that were removed
+        """
+        by_file = collections.defaultdict(list)
+        all_files = None
+        for s, p, o, g in patterns:
+            nq = self.make_nquad_pattern(s, p, o, g or self.default_graph)
+            if s == '*':
+                if all_files is None:
+                    # Include files created in the cache that have not yet been written to disk
+                    all_files = set(self._iterate_quad_files())
+                    all_files.update(f.path for f in self.update_manager.cache.items())
+                for file_path in all_files:
+                    by_file[file_path].append(nq)
+            else:
+                for file_path in self._files_for_pattern(s, p, o):
+                    by_file[file_path].append(nq)
+        retracted = []
+        for file_path in self.update_manager.prefetch(list(by_file)):
+            pattern = '|'.join('(?:{0})'.format(p) for p in by_file[file_path])
+            removed = self.update_manager.remove_lines_from_file(file_path, pattern)
+            self._record_changes(file_path, removed, True)
+            retracted.extend(removed)
+        return retracted
+
+    def _record_changes(self, file_path, lines, removed=False):
+        """Apply the lines added to or removed from a file of the store to its indexes and graph manifest"""
+        if self.indexes is None or not lines:
+            return
+        if removed:
+            self.indexes.remove(lines)
+        else:
+            self.indexes.add(lines)
+        if self.graph_manifest is not None:
+            changes = self._graph_removes if removed else self._graph_adds
+            changes[self.shard_key(file_path)].update(map(line_graph, lines))
+
+    def update_indexes(self, file_path, lines):
+        """
+        Bring the indexes and graph manifest of the store up to date with lines of a file that may have been
+        added or removed by other means. Each line is added to the indexes if the store holds it and removed
+        from them if not.
+
+        The files are loaded through the cache before they are searched, as a file changed by a merge or by
+        hand may not be in sorted order.
+
+        :param file_path: The path of the file that held or holds the lines
+        :param lines: The NQuads lines
+        """
+        loaded = set()
+        for line in lines:
+            for path in self._line_file_paths(line):
+                if path not in loaded:
+                    self.update_manager.touch(path)
+                    loaded.add(path)
+            if self.contains_line(line):
+                self.indexes.add([line])
+            else:
+                self.indexes.remove([line])
+        if self.graph_manifest is not None:
+            # Whether the shard still holds each graph is checked when the store is flushed
+            self._graph_removes[self.shard_key(file_path)].update(map(line_graph, lines))
 
     def exists(self, s, p, o, g=None):
-        subject_file_path = self.make_file_path(s) + NQOUT
         nq = self.make_nquad_pattern(s, p, o, g or self.default_graph)
-        return self.match_quads_in_file(subject_file_path, nq)
+        prefix = self._line_prefix(s, p, o)
+        return itertools.chain.from_iterable(self.match_quads_in_file(file_path, nq, prefix)
+                                             for file_path in self._files_for_pattern(s, p, o))
+
+    def _line_prefix(self, s, p, o):
+        """Returns the text that every NQuads line matching a pattern with a concrete subject starts with"""
+        if p == '*':
+            return s.n3() + ' '
+        if o == '*':
+            return '{0} {1} '.format(s.n3(), p.n3())
+        line = self.make_nquad(s, p, o, self.default_graph)
+        # Everything before the graph IRI
+        return line[:line.rindex(' ', 0, line.rindex(' ')) + 1]
 
     def flush(self):
+        """
+        Write all pending changes to disk. Any cached shard that has grown larger than the split size is first
+        split (see :meth:`split_shard`). The changes to the indexes and graph manifest of the store, if it has
+        any, are written after the changes to the shards.
+        """
+        if self.split_size and not self.read_only:
+            manager = self.update_manager
+            for entry in list(manager.cache.items()) + list(manager.evicted.values()):
+                if entry.chars > self.split_size and not self._in_split_shard(entry.path):
+                    self.split_shard(entry.path)
         self.update_manager.flush()
+        if self.indexes is not None:
+            self.indexes.flush()
+        if self.graph_manifest is not None:
+            self._update_graph_manifest()
+            self.graph_manifest.flush()
+
+    def _update_graph_manifest(self):
+        """
+        Apply the graphs of the lines added to and removed from each shard to the graph manifest. A shard that has
+        had lines removed is read to find out which of the graphs it still holds.
+        """
+        for shard, graphs in self._graph_removes.items():
+            graphs |= self._graph_adds.pop(shard, set())
+            shard_path = os.path.join(self.root, shard)
+            held = set(line_graph(line) for file_path in self.files_for_shard(shard_path)
+                       for line in self.update_manager.iter_lines(file_path))
+            for graph in graphs:
+                if graph in held:
+                    self.graph_manifest.add(graph, shard)
+                else:
+                    self.graph_manifest.remove(graph, shard)
+        for shard, graphs in self._graph_adds.items():
+            for graph in graphs:
+                self.graph_manifest.add(graph, shard)
+        self._graph_adds.clear()
+        self._graph_removes.clear()
+
+    def contains_line(self, line):
+        """Returns True if the store holds an NQuads line"""
+        return any(line in self.update_manager.iter_lines(file_path, line)
+                   for file_path in self._line_file_paths(line))
+
+    def _line_file_paths(self, line):
+        """Returns the paths of the files that could hold an NQuads line"""
+        shard_path = self.make_file_path_for_n3(line.partition(' ')[0])
+        file_paths = [shard_path + NQOUT]
+        if self._is_split(shard_path):
+            file_paths.append(self._split_file_path(shard_path, line))
+        return file_paths
+
+    def split_shard(self, file_path):
+        """
+        Split a shard file that holds too many lines to be rewritten efficiently. The lines are moved into
+        a directory of sub-files named after the shard with the suffix .nqs. Each line goes into one of 256
+        sub-files chosen by a hash of its subject, predicate and object, so an update to a single quad only
+        rewrites one sub-file. Once a shard is split, new quads for its subjects are added to the sub-files.
+
+        :param file_path: The path of the shard file to split
+        """
+        log = logging.getLogger('quince')
+        shard_path = file_path[:-len(NQOUT)]
+        by_file = collections.defaultdict(list)
+        for line in self.update_manager.iter_lines(file_path):
+            by_file[self._split_file_path(shard_path, line)].append(line)
+        self.split_shards.set(shard_path, True)
+        for split_file_path, lines in by_file.items():
+            self.update_manager.add_lines_to_file(split_file_path, lines)
+        # The empty pattern matches every line
+        removed = self.update_manager.remove_lines_from_file(file_path, '')
+        log.debug('Split {0} lines of {1} into {2} files'.format(len(removed), file_path, len(by_file)))
+
+    def _is_split(self, shard_path):
+        split = self.split_shards.get(shard_path)
+        if split is None:
+            split = os.path.isdir(shard_path + NQSPLIT)
+            self.split_shards.set(shard_path, split)
+        return split
+
+    @staticmethod
+    def _in_split_shard(file_path):
+        return os.path.dirname(file_path).endswith(NQSPLIT)
+
+    @staticmethod
+    def _split_file_path(shard_path, line):
+        """Returns the path of the sub-file of a split shard that holds an NQuads line"""
+        # The subject, predicate and object are everything before the last two spaces, which precede the graph IRI
+        key = line[:line.rindex(' ', 0, line.rindex(' '))]
+        return os.path.join(shard_path + NQSPLIT, SPLIT_FILES[hashlib.sha1(key.encode()).digest()[0]])
+
+    def _route(self, shard_path, line):
+        """Returns the path of the file that holds an NQuads line given the path of the shard of its subject"""
+        if self._is_split(shard_path):
+            return self._split_file_path(shard_path, line)
+        return shard_path + NQOUT
+
+    def _files_for_pattern(self, s, p, o):
+        """
+        Returns the paths of the files that may hold the quads matching a pattern with a concrete subject.
+        The shard file is included even if the shard is split, in case the split was interrupted.
+        """
+        shard_path = self.make_file_path(s)
+        if not self._is_split(shard_path):
+            return [shard_path + NQOUT]
+        if p == '*' or o == '*':
+            return self.files_for_key(s.n3())
+        return [shard_path + NQOUT, self._split_file_path(shard_path, self.make_nquad(s, p, o, self.default_graph))]
+
+    def files_for_key(self, n3):
+        """
+        Returns the paths of the files that may hold the quads whose first term is n3: the shard file of the term
+        and, if the shard is split, all of its sub-files
+        """
+        return self.files_for_shard(self.make_file_path_for_n3(n3))
+
+    def files_for_shard(self, shard_path):
+        """Returns the paths of the shard file and, if the shard is split, all of its sub-files"""
+        if not self._is_split(shard_path):
+            return [shard_path + NQOUT]
+        return [shard_path + NQOUT] + [os.path.join(shard_path + NQSPLIT, f) for f in SPLIT_FILES]
+
+    def shard_key(self, file_path):
+        """
+        Returns the path relative to the store root, without the file extension, of the shard that a file belongs
+        to. The sub-files of a split shard belong to the shard that was split.
+        """
+        dir_path = os.path.dirname(file_path)
+        if dir_path.endswith(NQSPLIT):
+            shard_path = dir_path[:-len(NQSPLIT)]
+        else:
+            shard_path = file_path[:-len(NQOUT)]
+        return os.path.relpath(shard_path, self.root)
+
+    def make_quad_entry(self, s, p, o, g=None):
+        """
+        Generates the path to the file that holds a quad together with the NQuads line that represents the
+        quad in that file.
+
+        :return: A tuple of (file path, NQuads line)
+        """
+        s, p, o = self.skolemize(s, p, o)
+        nq = self.make_nquad(s, p, o, g or self.default_graph)
+        return self._route(self.make_file_path(s), nq), nq
+
+    def make_raw_quad_entry(self, s, p, o, g=None):
+        """
+        As :meth:`make_quad_entry` but for terms that are already in canonical NQuads form.
+        Blank nodes are not supported.
+
+        :return: A tuple of (file path, NQuads line)
+        """
+        nq = "{0} {1} {2} {3} .\n".format(s, p, o, g or self.default_graph.n3())
+        return self._route(self.make_file_path_for_n3(s), nq), nq
 
     def make_file_path(self, node):
         """
         Generates the path to the file that contains the quads for a given node. This is the method by which
         quince splits the RDF graphs across multiple NQuad files. If a single NQuad file contains more distinct
         nodes, performance improves due to fewer file accesses at the cost of larger files that need to be processed
-        (and cached).
+        (and cached). The mapping is determined by the shard layout of the store (see :mod:`quince.core.layout`).
 
         :param node: The RDFLib Resource to be mapped to a file path
         :return: A file path
         """
-        h = hashlib.sha1(node.n3().encode()).hexdigest()
-        # This option will create a separate file for each distinct hash. The files are grouped into directories
-        # using the most significant byte of the hash
-        return os.path.join(self.root, h[:2], h)
+        return self.make_file_path_for_n3(node.n3())
 
-        # This option will create 2 levels of directory, using the first and then the second most significant byte
-        # It keeps each distinct hash in a separate file.
-        # return os.path.join(self.root, h[:2], h[:4], h)
-
-        # This option will create files that contain a merge of several hashes
-        # return os.path.join(self.root, h[:3])
+    def make_file_path_for_n3(self, n3):
+        """
+        Generates the path to the file that contains the quads for a node given in NQuads syntax.
+        See :meth:`make_file_path`.
+        """
+        h = hashlib.sha1(n3.encode()).hexdigest()
+        return os.path.join(self.root, self.layout.file_path(h))
 
     def sort_quads(self, path_iter=None):
         """
@@ -274,37 +717,102 @@ class QuinceStore:
         log = logging.getLogger('quince')
         path_iter = path_iter or self._iterate_quad_files()
         visit_count = 0
-        for file_path in path_iter:
+        for file_path in self.update_manager.prefetch(path_iter):
             log.debug(file_path)
             self.update_manager.touch(file_path)
             visit_count += 1
         log.debug('{0} files visited. Writing updates to disk - this may take a while...'.format(visit_count))
-        self.update_manager.flush()
+        self.flush()
 
     def _iterate_quad_files(self):
         """
         Return an iterator over the nquads files in the repository
         """
-        return glob.iglob(os.path.join(self.root, '*', '*.nqo'))
+        dirs = ['*'] * self.layout.depth
+        return itertools.chain(glob.iglob(os.path.join(self.root, *(dirs + ['*' + NQOUT]))),
+                               glob.iglob(os.path.join(self.root, *(dirs + ['*' + NQSPLIT, '*' + NQOUT]))))
 
     def all_quads(self, graphs):
-        filter_regex = None if graphs is None else "|".join(map(lambda x: "(" + re.escape(x) + ")", graphs)) + r"\s*.\s*\n$"
+        """
+        Returns an iterator over the NQuads lines of the store. If the store has a graph manifest, only the shards
+        that hold quads in the requested graphs are read.
+
+        :param graphs: A list of the graph IRIs in NQuads syntax to return the quads of, or None for all quads
+        """
+        if graphs is not None and self.graph_manifest is not None:
+            file_paths = self._graph_files(graphs)
+        else:
+            file_paths = self._walk_quad_files()
+        graph_match = None
+        if graphs is not None:
+            graph_match = re.compile(r'(?:{0})\s*\.\s*\n$'.format('|'.join(map(re.escape, graphs)))).search
+        for file_path in self.update_manager.prefetch(file_paths):
+            lines = self.update_manager.iter_lines(file_path)
+            if graph_match is None:
+                yield from lines
+            else:
+                yield from filter(graph_match, lines)
+
+    def _graph_files(self, graphs):
+        """Returns the paths of the files of the shards that the graph manifest lists for any of the graphs"""
+        shards = set(itertools.chain.from_iterable(self.graph_manifest.shards(g) for g in graphs))
+        return list(itertools.chain.from_iterable(self.files_for_shard(os.path.join(self.root, shard))
+                                                  for shard in sorted(shards)))
+
+    def _walk_quad_files(self):
         for root, dirs, files in os.walk(self.root):
+            # Skip the local caches and indexes
+            dirs[:] = [d for d in dirs if d not in LOCAL_DIRS]
             for f in filter(lambda x: x.endswith(NQOUT), files):
-                for l in self.update_manager.iter_lines(os.path.join(root, f)):
-                    if filter_regex is None or re.search(filter_regex, l):
-                        yield l
+                yield os.path.join(root, f)
 
-    def match_quads_in_file(self, file_path, pattern):
-        lines = self.update_manager.iter_lines(file_path)
+    def match_quads_in_file(self, file_path, pattern, prefix=''):
+        lines = self.update_manager.iter_lines(file_path, prefix)
         return filter(lambda x: re.match(pattern, x), lines)
 
+    def match(self, s, p, o, g='*'):
+        """
+        Returns an iterator over the NQuads lines of the store that match a quad pattern. The lines are read by
+        the cheapest access path that the pattern and the store allow:
+
+        * if the subject is given, the shard of the subject
+        * if the predicate or object is given and the store has indexes, the pos or osp index
+        * if the graph is given, the shards listed for it by the graph manifest (see :meth:`all_quads`)
+        * otherwise every shard, with the files loaded ahead by the reader threads of the cache
+
+        :param s: The subject, or '*' to match all subjects
+        :param p: The predicate, or '*' to match all predicates
+        :param o: The object, or '*' to match all objects
+        :param g: The graph, or '*' to match all graphs
+        """
+        terms = [t if t == '*' else self.make_n3(t) for t in (s, p, o, g)]
+        if s != '*':
+            prefix = self._line_prefix(s, p, o)
+            lines = itertools.chain.from_iterable(self.update_manager.iter_lines(file_path, prefix)
+                                                  for file_path in self._files_for_pattern(s, p, o))
+        elif self.indexes is not None and p != '*':
+            lines = self.indexes[INDEX_POS].lines(*terms[1:2 if o == '*' else 3])
+        elif self.indexes is not None and o != '*':
+            lines = self.indexes[INDEX_OSP].lines(terms[2])
+        else:
+            lines = self.all_quads(None if g == '*' else [terms[3]])
+        checks = [(i, t) for i, t in enumerate(terms) if t != '*']
+
+        def matches(line):
+            quad = split_terms(line)
+            return len(quad) == 4 and all(quad[i] == t for i, t in checks)
+        return filter(matches, lines)
+
+    @staticmethod
+    def make_n3(node):
+        """Returns an RDFLib node in the NQuads syntax used in the lines of the store"""
+        if isinstance(node, rdflib.Literal):
+            return _xmlcharref_encode(_quote_literal(node))
+        return node.n3()
+
     @staticmethod
     def make_nquad(s, p, o, g):
-        if isinstance(o, rdflib.Literal):
-            return "{0} {1} {2} {3} .\n".format(s.n3(), p.n3(), _xmlcharref_encode(_quote_literal(o)), g.n3())
-        else:
-            return "{0} {1} {2} {3} .\n".format(s.n3(), p.n3(), o.n3(), g.n3())
+        return "{0} {1} {2} {3} .\n".format(s.n3(), p.n3(), QuinceStore.make_n3(o), g.n3())
 
     @staticmethod
     def make_nquad_pattern(s, p, o, g):
@@ -326,6 +834,33 @@ class QuinceStore:
         return s, p, o
 
 
+_NORMALIZED_DATATYPES = frozenset(str(dt) for dt in rdflib.term.XSDToPython if dt is not None)
+
+
+def canonical_literal(lexical, language=None, datatype=None):
+    """
+    Returns the NQuads form of a literal given the (still escaped) lexical form, language and datatype parsed
+    from an NQuads document. The result is identical to the form that make_nquad generates for the
+    equivalent rdflib Literal.
+    """
+    if datatype in _NORMALIZED_DATATYPES:
+        # rdflib normalizes the lexical form of these datatypes
+        return _xmlcharref_encode(_quote_literal(rdflib.Literal(unquote(lexical), datatype=datatype)))
+    if '\\' in lexical:
+        quoted = _quote_encode(unquote(lexical))
+    else:
+        quoted = '"' + lexical + '"'
+    if language:
+        quoted += '@' + language
+    elif datatype:
+        quoted += '^^<' + datatype + '>'
+    try:
+        quoted.encode('ascii')
+        return quoted
+    except UnicodeError:
+        return _xmlcharref_encode(quoted)
+
+
 def _quote_literal(l):
     """
     Handles proper NQuads escaping of an rdflib Literal.
@@ -369,86 +904,624 @@ def _xmlcharref_encode(unicode_data, encoding="ascii"):
 
 
 class SortedSet:
+    """
+    A sorted collection of unique items, stored as a list of sorted blocks of at most 2 * LOAD items
+    together with the last item of each block. Locating an item is a binary search over the blocks
+    followed by a binary search within one block, and inserting or removing an item only shifts the items
+    of a single block, so the cost of each update does not grow with the size of the collection.
+    """
+    LOAD = 1000
+    __slots__ = ('_blocks', '_maxes', '_len')
+
     def __init__(self, iterable=None):
-        self.list = list(iterable) if iterable else []
-        self.list.sort()
+        self._build([k for k, _ in itertools.groupby(sorted(iterable))] if iterable else [])
+
+    def _build(self, values):
+        self._blocks = [values[i:i + self.LOAD] for i in range(0, len(values), self.LOAD)]
+        self._maxes = [b[-1] for b in self._blocks]
+        self._len = len(values)
 
     def __len__(self):
-        return len(self.list)
+        return self._len
 
     def __iter__(self):
-        return iter(self.list)
+        return itertools.chain.from_iterable(self._blocks)
 
     def __contains__(self, item):
-        i = bisect.bisect_left(self.list, item)
-        j = bisect.bisect_right(self.list, item)
-        return i != j
+        pos, i = self._locate(item)
+        return pos is not None and self._blocks[pos][i] == item
+
+    def with_prefix(self, prefix):
+        """Returns an iterator over the items that start with prefix"""
+        pos, i = self._locate(prefix)
+        if pos is None:
+            return iter(())
+        items = itertools.chain(itertools.islice(self._blocks[pos], i, None),
+                                itertools.chain.from_iterable(self._blocks[pos + 1:]))
+        return itertools.takewhile(lambda x: x.startswith(prefix), items)
+
+    def _locate(self, item):
+        """Returns the index of the block that item belongs in and the position of item within that block"""
+        pos = bisect.bisect_left(self._maxes, item)
+        if pos == len(self._maxes):
+            return None, None
+        return pos, bisect.bisect_left(self._blocks[pos], item)
+
+    def _mutable_block(self, pos):
+        """Returns the block at pos as a list that can be modified in place"""
+        return self._blocks[pos]
 
     def insert(self, v):
-        ins = bisect.bisect(self.list, v)
-        if ins == len(self.list) and (ins == 0 or self.list[ins-1] != v):
-            # Insert location is at the end of the list.
-            # Only insert if the current last element != v
-            self.list.append(v)
-        elif (ins == 0) or (self.list[ins-1] != v):
-            # Insert location is at the start of the list
-            # Must be OK to insert
-            self.list.insert(ins, v)
+        if not self._blocks:
+            self._blocks.append([v])
+            self._maxes.append(v)
+            self._len = 1
+            return
+        pos, i = self._locate(v)
+        if pos is None:
+            # v is greater than every item, so it goes at the end of the last block
+            pos = len(self._blocks) - 1
+            self._mutable_block(pos).append(v)
+            self._maxes[pos] = v
+        else:
+            if self._blocks[pos][i] == v:
+                return
+            self._mutable_block(pos).insert(i, v)
+        self._len += 1
+        self._split(pos)
+
+    def _split(self, pos):
+        block = self._blocks[pos]
+        if len(block) > 2 * self.LOAD:
+            self._blocks[pos:pos + 1] = [block[:self.LOAD], block[self.LOAD:]]
+            self._maxes[pos:pos + 1] = [block[self.LOAD - 1], block[-1]]
 
     def index(self, item):
-        i = bisect.bisect_left(self.list, item)
-        j = bisect.bisect_right(self.list, item)
-        return self.list[i:j].index(item) + i
+        pos, i = self._locate(item)
+        if pos is None or self._blocks[pos][i] != item:
+            raise ValueError('{0!r} is not in the set'.format(item))
+        return sum(len(b) for b in self._blocks[:pos]) + i
+
+    def update(self, items):
+        """Insert all of the items in an iterable"""
+        items = list(items)
+        if len(items) * 8 < self._len:
+            for item in items:
+                self.insert(item)
+        else:
+            # Timsort merges the existing sorted items with the sorted tail in linear time
+            values = list(self)
+            values.extend(items)
+            values.sort()
+            self._build([k for k, _ in itertools.groupby(values)])
 
     def remove(self, item):
-        i = self.index(item)
-        del self.list[i]
+        pos, i = self._locate(item)
+        if pos is None or self._blocks[pos][i] != item:
+            raise ValueError('{0!r} is not in the set'.format(item))
+        block = self._mutable_block(pos)
+        del block[i]
+        self._len -= 1
+        if not block:
+            del self._blocks[pos]
+            del self._maxes[pos]
+            return
+        self._maxes[pos] = block[-1]
+        if len(block) < self.LOAD // 2 and pos + 1 < len(self._blocks):
+            # Merge small blocks with their successor to keep the number of blocks bounded
+            block.extend(self._mutable_block(pos + 1))
+            del self._blocks[pos + 1]
+            del self._maxes[pos]
+            self._split(pos)
 
     def remove_matches(self, pattern):
-        to_delete = []
+        kept = []
         deleted = []
-        for index, item in enumerate(self.list):
-            print(item)
+        for item in self:
             if pattern.match(item, ):
-                print('MATCH')
-                to_delete.append(index)
-        to_delete.reverse()
-        for index in to_delete:
-            deleted.append(self.list[index])
-            del self.list[index]
+                deleted.append(item)
+            else:
+                kept.append(item)
+        if deleted:
+            self._build(kept)
         return deleted
 
 
+def _split_line(line):
+    """
+    Splits an NQuads line into the subject and predicate with the space that follows them, the object, and the
+    space before the graph with the rest of the line. A line that does not have four terms is returned as the
+    object.
+    """
+    head = line.find(' ', line.find(' ') + 1) + 1
+    tail = line.rfind(' ', head, line.rfind(' '))
+    if head == 0 or tail < head:
+        return '', line, ''
+    return line[:head], line[head:tail], line[tail:]
+
+
+class TermTable:
+    # Estimated memory overhead of each term (a str object, a list slot and a dict entry)
+    TERM_OVERHEAD = sys.getsizeof('') + 8 + 48
+    __slots__ = ('terms', 'index', 'nbytes')
+
+    def __init__(self):
+        """The distinct strings used by the packed blocks of a :class:`FileEntry`, each stored once"""
+        self.terms = []
+        self.index = {}
+        self.nbytes = 0
+
+    def intern(self, term):
+        """Returns the position of the term in the table, adding it if it is new"""
+        n = self.index.get(term)
+        if n is None:
+            n = self.index[term] = len(self.terms)
+            self.terms.append(term)
+            self.nbytes += len(term) + TermTable.TERM_OVERHEAD
+        return n
+
+
+# The header of the binary form of a FileEntry: a tag, the item size of the arrays, the number of terms, the
+# number of blocks and the number of characters in the lines
+_ENTRY_HEADER = struct.Struct('<4sBIIQ')
+_ENTRY_TAG = b'QPK1'
+# The header of the binary form of a block: the number of lines and the length of the encoded objects
+_BLOCK_HEADER = struct.Struct('<II')
+
+
+class PackedLines:
+    __slots__ = ('table', 'heads', 'objects', 'offsets', 'tails', 'nbytes')
+
+    def __init__(self, lines, table):
+        """
+        An immutable sorted block of NQuads lines in a compact form. The subject and predicate at the start of
+        each line and the graph at the end are interned in a :class:`TermTable`, so only two term numbers are
+        kept for them. The objects of the lines are concatenated into a single string with an array of their
+        offsets. Indexing and iterating the block rebuild the original lines.
+
+        :param lines: The sorted lines
+        :param table: The :class:`TermTable` of the entry that holds the block
+        """
+        self.table = table
+        self.heads = array.array('I')
+        self.tails = array.array('I')
+        self.offsets = array.array('I', [0])
+        objects = []
+        offset = 0
+        for line in lines:
+            head, obj, tail = _split_line(line)
+            self.heads.append(table.intern(head))
+            self.tails.append(table.intern(tail))
+            objects.append(obj)
+            offset += len(obj)
+            self.offsets.append(offset)
+        self.objects = ''.join(objects)
+        self._measure()
+
+    @classmethod
+    def restore(cls, table, heads, tails, offsets, objects):
+        """Returns a block made from the arrays and objects string of a block in the form written by :meth:`dump`"""
+        block = cls.__new__(cls)
+        block.table = table
+        block.heads = heads
+        block.tails = tails
+        block.offsets = offsets
+        block.objects = objects
+        block._measure()
+        return block
+
+    def _measure(self):
+        self.nbytes = sys.getsizeof(self) + sys.getsizeof(self.objects) + sys.getsizeof(self.heads) + \
+            sys.getsizeof(self.tails) + sys.getsizeof(self.offsets)
+
+    def dump(self):
+        """Returns the block in binary form: a header followed by the head, tail and offset arrays and the objects"""
+        objects = self.objects.encode('utf-8')
+        return b''.join((_BLOCK_HEADER.pack(len(self.heads), len(objects)), self.heads.tobytes(),
+                         self.tails.tobytes(), self.offsets.tobytes(), objects))
+
+    def __len__(self):
+        return len(self.heads)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.heads)
+        terms = self.table.terms
+        offsets = self.offsets
+        return terms[self.heads[i]] + self.objects[offsets[i]:offsets[i + 1]] + terms[self.tails[i]]
+
+    def __iter__(self):
+        terms = self.table.terms
+        objects = self.objects
+        offsets = self.offsets
+        for i, (head, tail) in enumerate(zip(self.heads, self.tails)):
+            yield terms[head] + objects[offsets[i]:offsets[i + 1]] + terms[tail]
+
+
+def _read_array(data, offset, count):
+    """Returns an array of count unsigned ints read from data at offset, and the offset following the array"""
+    a = array.array('I')
+    end = offset + count * a.itemsize
+    if end > len(data):
+        raise ValueError('The array extends past the end of the data')
+    a.frombytes(data[offset:end])
+    return a, end
+
+
 class FileEntry(SortedSet):
-    def __init__(self, file_path):
+    # Estimated memory overheads of an entry and of each line of an unpacked block (a str object and a list slot)
+    ENTRY_OVERHEAD = 1024
+    LINE_OVERHEAD = sys.getsizeof('') + 8
+    __slots__ = ('path', 'dirty', 'exists', 'loaded_bytes', 'chars', 'shard_cache', '_map', '_stat', '_table',
+                 '_packed_bytes', '_unpacked_bytes')
+
+    def __init__(self, file_path, exists=None, shard_cache=None):
+        """
+        The sorted lines of a file. The file is memory-mapped rather than read when the entry is created.
+        Membership tests and prefix lookups binary search the sorted lines of the mapped file in place, and
+        iteration decodes the lines as it goes. The lines are only parsed into memory by :meth:`load`, which
+        is called when the entry is first modified or its length is needed.
+
+        The entry tracks whether its lines differ from the content of the file on disk and is only written
+        back by :meth:`flush` if they do. A file whose lines are not in sorted order or are not unique is
+        treated as modified as soon as it is loaded. Lookups on a mapped file that is not sorted may miss
+        lines: use `quince sort` to restore the order of files that have been edited outside quince.
+
+        Loaded lines are held as :class:`PackedLines` blocks, which take a fraction of the memory of a list of
+        strings. A block is unpacked into a list when it is modified and packed again when the entry is written
+        back to its file. If a :class:`ShardCache` is specified, the packed blocks are added to the cache
+        when the entry is written and are loaded from the cache rather than parsed from the file while the
+        file is unchanged.
+
+        :param file_path: The path to the file
+        :param exists: False if the file is already known not to exist, to create an empty entry without
+            checking the file system
+        :param shard_cache: The :class:`ShardCache` to load and save the packed blocks with
+        """
+        SortedSet.__init__(self, None)
         self.path = file_path
-        if os.path.exists(file_path):
-            with open(file_path, encoding='utf-8', mode='r') as f:
-                SortedSet.__init__(self, f.readlines())
+        self.dirty = False
+        self.exists = False
+        self.loaded_bytes = 0
+        self.chars = 0
+        self.shard_cache = shard_cache
+        self._map = None
+        self._stat = None
+        if exists is not False:
+            try:
+                with open(file_path, mode='rb') as f:
+                    self.exists = True
+                    self._stat = os.fstat(f.fileno())
+                    self._map = self._map_file(f)
+                    self.loaded_bytes = len(self._map)
+            except FileNotFoundError:
+                pass
+            except ValueError:
+                # An empty file cannot be mapped
+                pass
+
+    @staticmethod
+    def _map_file(f):
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except OSError:
+            # The process may have run out of mappings. The bytes of the file support the same lookups.
+            return f.read() or None
+
+    @property
+    def loaded(self):
+        return self._map is None
+
+    def load(self):
+        """Parse the lines of the mapped file into memory"""
+        if self._map is None:
+            return
+        if self.shard_cache is not None and self._restore(self.shard_cache.get(self.path, self._stat)):
+            self._map = None
+            return
+        text = self._map[:].decode('utf-8')
+        # The mapping is closed when it is garbage collected, once any iterators over its lines are finished
+        self._map = None
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        lines = text.split('\n')
+        if lines[-1]:
+            # The last line has no line ending
+            self.dirty = True
         else:
-            SortedSet.__init__(self, None)
+            lines.pop()
+        lines = [line + '\n' for line in lines]
+        if not all(map(operator.lt, lines, itertools.islice(lines, 1, None))):
+            self.dirty = True
+            lines = [k for k, _ in itertools.groupby(sorted(lines))]
+        self._build(lines)
+        self.chars = sum(map(len, lines))
+
+    def dump(self):
+        """Returns the packed lines of the entry in binary form. Any modified blocks are packed first."""
+        self.pack()
+        terms = [t.encode('utf-8') for t in self._table.terms]
+        lengths = array.array('I', map(len, terms))
+        header = _ENTRY_HEADER.pack(_ENTRY_TAG, lengths.itemsize, len(terms), len(self._blocks), self.chars)
+        return b''.join(itertools.chain((header, lengths.tobytes()), terms, (b.dump() for b in self._blocks)))
+
+    def _restore(self, data):
+        """
+        Replace the lines of the entry with lines in the binary form written by :meth:`dump`
+
+        :return: False if data is None or is not in the expected form
+        """
+        if data is None:
+            return False
+        data = memoryview(data)
+        try:
+            tag, itemsize, term_count, block_count, chars = _ENTRY_HEADER.unpack_from(data)
+            if tag != _ENTRY_TAG or itemsize != array.array('I').itemsize:
+                return False
+            offset = _ENTRY_HEADER.size
+            lengths, offset = _read_array(data, offset, term_count)
+            table = TermTable()
+            for length in lengths:
+                table.intern(str(data[offset:offset + length], 'utf-8'))
+                offset += length
+            blocks = []
+            for _ in range(block_count):
+                count, size = _BLOCK_HEADER.unpack_from(data, offset)
+                heads, offset = _read_array(data, offset + _BLOCK_HEADER.size, count)
+                tails, offset = _read_array(data, offset, count)
+                offsets, offset = _read_array(data, offset, count + 1)
+                objects = str(data[offset:offset + size], 'utf-8')
+                offset += size
+                blocks.append(PackedLines.restore(table, heads, tails, offsets, objects))
+            if offset != len(data) or len(table.terms) != term_count:
+                return False
+        except (ValueError, struct.error):
+            return False
+        self._table = table
+        self._blocks = blocks
+        self._maxes = [b[-1] for b in blocks]
+        self._len = sum(map(len, blocks))
+        self._packed_bytes = sum(b.nbytes for b in blocks)
+        self._unpacked_bytes = 0
+        self.chars = chars
+        return True
+
+    def will_need(self):
+        """Advise the operating system that the mapped file will be read soon. Not supported on all platforms."""
+        if self._map is not None and hasattr(self._map, 'madvise'):
+            self._map.madvise(mmap.MADV_WILLNEED)
+
+    def __len__(self):
+        self.load()
+        return SortedSet.__len__(self)
+
+    def __iter__(self):
+        if self._map is None:
+            return SortedSet.__iter__(self)
+        return self._mapped_lines(0)
+
+    def __contains__(self, item):
+        if self._map is None:
+            return SortedSet.__contains__(self, item)
+        key = item.encode('utf-8')
+        pos = self._seek(key)
+        if self._map[pos:pos + len(key)] == key:
+            return True
+        # The last line of the file may have no line ending
+        return key.endswith(b'\n') and self._map[pos:] == key[:-1]
+
+    def with_prefix(self, prefix):
+        if self._map is None:
+            return SortedSet.with_prefix(self, prefix)
+        lines = self._mapped_lines(self._seek(prefix.encode('utf-8')))
+        return itertools.takewhile(lambda x: x.startswith(prefix), lines)
+
+    def _seek(self, key):
+        """Returns the offset of the first line of the mapped file that is not less than key"""
+        m = self._map
+        lo, hi = 0, len(m)
+        # lo and hi are always the offsets of the start of a line (or the end of the file). The lines before lo
+        # are less than key and the lines from hi onwards are not.
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = m.rfind(b'\n', lo, mid) + 1 or lo
+            end = m.find(b'\n', start, hi)
+            end = hi if end < 0 else end + 1
+            line = m[start:end]
+            if (line if line.endswith(b'\n') else line + b'\n') < key:
+                lo = end
+            else:
+                hi = start
+        return lo
+
+    def _mapped_lines(self, offset):
+        return self._iter_mapped_lines(self._map, offset)
+
+    @staticmethod
+    def _iter_mapped_lines(m, offset):
+        # The mapping is passed in as the entry may be loaded while the lines are iterated
+        while offset < len(m):
+            end = m.find(b'\n', offset)
+            end = len(m) if end < 0 else end + 1
+            line = m[offset:end].decode('utf-8')
+            yield line if line.endswith('\n') else line + '\n'
+            offset = end
+
+    def _build(self, values):
+        # Start a new term table, so that the terms of lines that have been removed are dropped
+        self._table = TermTable()
+        SortedSet._build(self, values)
+        self._blocks = [PackedLines(block, self._table) for block in self._blocks]
+        self._packed_bytes = sum(block.nbytes for block in self._blocks)
+        self._unpacked_bytes = 0
+
+    def _mutable_block(self, pos):
+        block = self._blocks[pos]
+        if isinstance(block, PackedLines):
+            self._packed_bytes -= block.nbytes
+            block = self._blocks[pos] = list(block)
+            self._unpacked_bytes += sum(map(len, block)) + len(block) * FileEntry.LINE_OVERHEAD
+        return block
+
+    def pack(self):
+        """Pack the blocks that have been unpacked by modifications"""
+        for pos, block in enumerate(self._blocks):
+            if isinstance(block, list):
+                block = self._blocks[pos] = PackedLines(block, self._table)
+                self._packed_bytes += block.nbytes
+        self._unpacked_bytes = 0
+
+    def index(self, item):
+        self.load()
+        return SortedSet.index(self, item)
+
+    def insert(self, v):
+        self.load()
+        size = len(self)
+        SortedSet.insert(self, v)
+        if len(self) != size:
+            self.dirty = True
+            self.chars += len(v)
+            self._unpacked_bytes += len(v) + FileEntry.LINE_OVERHEAD
+
+    def update(self, items):
+        self.load()
+        size = len(self)
+        SortedSet.update(self, items)
+        if len(self) != size:
+            self.dirty = True
+            self.chars = sum(map(len, self))
+
+    def remove(self, item):
+        self.load()
+        SortedSet.remove(self, item)
+        self.dirty = True
+        self.chars -= len(item)
+        self._unpacked_bytes -= len(item) + FileEntry.LINE_OVERHEAD
+
+    def remove_matches(self, pattern):
+        self.load()
+        deleted = SortedSet.remove_matches(self, pattern)
+        if deleted:
+            self.dirty = True
+            self.chars -= sum(map(len, deleted))
+        return deleted
+
+    def size_estimate(self):
+        """
+        Returns an estimate of the memory used by the entry in bytes. A mapped file uses no heap memory, but the
+        bytes of a file that could not be mapped do.
+        """
+        if isinstance(self._map, bytes):
+            return FileEntry.ENTRY_OVERHEAD + len(self._map)
+        if self._map is not None:
+            return FileEntry.ENTRY_OVERHEAD
+        return FileEntry.ENTRY_OVERHEAD + self._table.nbytes + self._packed_bytes + self._unpacked_bytes
 
     def flush(self):
+        """
+        Write the lines back to the file if they have been modified. A file left with no lines is deleted.
+        The lines are written to a temporary file which then replaces the original, so the file is never left
+        partially written.
+        """
+        if self.dirty:
+            _write_back([self])
+
+    def write_temp(self, sync=False):
+        """
+        Write the lines to the temporary file that will replace the file in :meth:`commit`.
+        Nothing is written if there are no lines.
+
+        :param sync: If True, ensure the temporary file is on disk before returning
+        :return: The number of bytes written
+        """
+        if len(self) == 0:
+            return 0
         self._ensure_directory(os.path.dirname(self.path))
-        with open(self.path, encoding='utf-8', mode='w') as f:
-            f.writelines(self.list)
+        with open(self.path + TMP, encoding='utf-8', mode='w') as f:
+            f.writelines(self)
+            f.flush()
+            if sync:
+                os.fsync(f.fileno())
+            return f.buffer.tell()
+
+    def commit(self):
+        """Replace the file with the temporary file written by :meth:`write_temp`, or delete it if there are no lines"""
+        if len(self) == 0:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        else:
+            os.replace(self.path + TMP, self.path)
+        self.dirty = False
+        self.exists = len(self) > 0
+        self.pack()
+        if self.shard_cache is not None:
+            if self._stat is not None:
+                self.shard_cache.discard(self.path, self._stat)
+            self._stat = os.stat(self.path) if self.exists else None
+            if self.exists:
+                self.shard_cache.put(self.path, self._stat, self.dump())
 
     @staticmethod
     def _ensure_directory(dir_name):
         if not os.path.exists(dir_name):
-            os.makedirs(dir_name)
+            # Entries in the same directory may be written concurrently
+            os.makedirs(dir_name, exist_ok=True)
 
 
 class CachingFileManager:
-    def __init__(self, cache_capacity):
+    # The number of modified entries evicted from the cache that are written back together
+    EVICTION_BATCH_SIZE = 256
+    # The share of the cache byte budget that modified entries evicted from the cache may use
+    # while they wait to be written back
+    EVICTION_BATCH_RATIO = 0.25
+
+    def __init__(self, cache_capacity, journal_path=None, max_bytes=None, policy=POLICY_LRU, stats=None, writers=0,
+                 readers=0, prefetch_depth=DEFAULT_PREFETCH_DEPTH, max_missing=DEFAULT_MISSING_ENTRIES,
+                 read_only=False, shard_cache=None):
         """
         The CachingFileManager provides a basic interface for reading and modifying text file content
-        while using an LRU cache to minimize disk access. Operations on files are line-based and
+        while using a cache to minimize disk access. Operations on files are line-based and
         use the :class:`FileEntry` interface. File updates are persisted to disk only when the
          flush() method is called or when a file entry is evicted from the cache.
+        Modified files are written back in batches. Each file is written to a temporary file which then
+        replaces the original. If a journal path is specified, the set of files being replaced is recorded
+        in a journal so that an interrupted write-back can be completed or undone by
+        :meth:`FlushJournal.recover`. If writers is greater than zero, batches of evicted entries are written
+        back in the background by a :class:`WriteBackQueue` and flush() writes files in parallel.
+        If readers is greater than zero, :meth:`prefetch` loads files on a pool of reader threads.
+
+        Reading a file that does not exist does not add an entry to the cache. Instead the path is remembered
+        in a bounded cache of missing files, so that further reads of the file do not touch the file system.
+        The manager assumes that no other process creates files while it is in use.
+
         :param cache_capacity: The maximum number of cached file entries
+        :param journal_path: The path of the write-back journal file
+        :param max_bytes: The maximum estimated memory used by the cached file entries, or None for no limit
+        :param policy: The cache eviction policy: 'lru', 'clock' or '2q' (see :mod:`quince.core.cache`)
+        :param stats: The :class:`QuinceStats` to record cache and file activity in
+        :param writers: The number of threads used to write files back, or 0 to write them synchronously
+        :param readers: The number of threads used to prefetch files, or 0 to disable prefetching
+        :param prefetch_depth: The maximum number of files that :meth:`prefetch` loads ahead of its consumer
+        :param max_missing: The maximum number of paths remembered as missing
+        :param read_only: If True, methods that modify files raise a QuinceReadOnlyException
+        :param shard_cache: The :class:`ShardCache` that file entries are loaded from and saved to, or None
         """
-        self.cache = LRUCache(cache_capacity, eviction_callback=lambda x, y: y.flush())
+        self.stats = stats or QuinceStats()
+        self.journal_path = journal_path
+        self.writer = WriteBackQueue(writers, journal_path, self.stats) if writers > 0 else None
+        self.readers = ThreadPoolExecutor(readers) if readers > 0 else None
+        self.prefetch_depth = prefetch_depth
+        # Entries being loaded by the reader threads, keyed by file path
+        self.loading = {}
+        self.missing = LRUCache(max_missing)
+        self.read_only = read_only
+        self.shard_cache = shard_cache
+        self.evicted = collections.OrderedDict()
+        self.evicted_bytes = 0
+        self.max_evicted_bytes = max_bytes * self.EVICTION_BATCH_RATIO if max_bytes else None
+        self.cache = make_cache(policy, cache_capacity, eviction_callback=self._evict, max_bytes=max_bytes,
+                                sizeof=FileEntry.size_estimate)
 
     def add_line_to_file(self, file_path, line):
         """
@@ -462,8 +1535,24 @@ class CachingFileManager:
         :param line: The line to be inserted into the file
         :return: None
         """
-        file = self._assert_file(file_path)
+        file = self._assert_file(file_path, create=True)
         file.insert(line)
+        self.cache.resize(file_path)
+
+    def add_lines_to_file(self, file_path, lines):
+        """
+        Inserts all of the specified lines into the file at the specified file path,
+        maintaining the sort order of lines in the file.
+
+        Updates are applied only to the cached file representation (see :meth:`add_line_to_file`).
+
+        :param file_path: The path to the file to be updated
+        :param lines: The lines to be inserted into the file
+        :return: None
+        """
+        file = self._assert_file(file_path, create=True)
+        file.update(lines)
+        self.cache.resize(file_path)
 
     def remove_line_from_file(self, file_path, line):
         """
@@ -478,23 +1567,45 @@ class CachingFileManager:
         :param line: The line to be removed from the file
         :return: None
         """
+        self._check_writable()
         file = self._assert_file(file_path)
-        file.remove(line)
+        if file is not None and line in file:
+            file.remove(line)
+            self.cache.resize(file_path)
+
+    def remove_lines_from_file(self, file_path, pattern, prefix=''):
+        """
+        Removes all of the lines that match a regular expression from the specified file.
 
-    def remove_lines_from_file(self, file_path, pattern):
+        :param file_path: The path to the file to be updated
+        :param pattern: The regular expression to match lines against
+        :param prefix: A prefix of every line that pattern matches. If specified, a file that has not yet been
+            loaded is only loaded if a line with the prefix matches.
+        :return: The removed lines
+        """
+        self._check_writable()
         file = self._assert_file(file_path)
+        if file is None:
+            return []
         compiled_pattern = re.compile(pattern)
-        return file.remove_matches(compiled_pattern)
+        if prefix and not file.loaded and not any(map(compiled_pattern.match, file.with_prefix(prefix))):
+            return []
+        removed = file.remove_matches(compiled_pattern)
+        self.cache.resize(file_path)
+        return removed
 
-    def iter_lines(self, file_path):
+    def iter_lines(self, file_path, prefix=''):
         """
         Returns an iterator over the lines in the file at file_path
         :param file_path: The path to the file to be read
+        :param prefix: If specified, only the lines starting with prefix are returned, in sorted order
         :return: An iterator over the lines in the specified file. If
         the file does not exist, an empty iterator is returned.
         """
         file = self._assert_file(file_path)
-        return iter(file)
+        if file is None:
+            return iter(())
+        return file.with_prefix(prefix) if prefix else iter(file)
 
     def touch(self, file_path):
         """
@@ -502,60 +1613,335 @@ class CachingFileManager:
         :param file_path:
         :return:
         """
-        self._assert_file(file_path)
+        file = self._assert_file(file_path)
+        if file is not None:
+            file.load()
+            self.cache.resize(file_path)
+
+    def prefetch(self, file_paths):
+        """
+        Returns an iterator over file_paths that loads the files on the reader threads ahead of the
+        consumer. Up to prefetch_depth files are loaded ahead, so a scan over many files overlaps the
+        latency of opening and reading each file with processing the files already loaded. Files that
+        are already cached are not loaded again. Any file that is read or modified through the manager
+        before the iterator reaches it is loaded by the reader thread rather than being read twice.
+
+        :param file_paths: An iterable over the paths of the files that will be read, in the order they
+            will be read
+        :return: An iterator over the same paths
+        """
+        if self.readers is None:
+            yield from file_paths
+            return
+        queued = collections.deque()
+        file_paths = iter(file_paths)
+        try:
+            while True:
+                for file_path in itertools.islice(file_paths, self.prefetch_depth - len(queued)):
+                    queued.append(file_path)
+                    self._start_load(file_path)
+                if not queued:
+                    return
+                yield queued[0]
+                # Discard the loaded entry if the consumer did not read the file, as it may go out of date
+                self.loading.pop(queued.popleft(), None)
+        finally:
+            for file_path in queued:
+                future = self.loading.pop(file_path, None)
+                if future:
+                    future.cancel()
+
+    def _start_load(self, file_path):
+        if file_path in self.cache or file_path in self.evicted or file_path in self.loading or \
+                file_path in self.missing:
+            return
+        if self.writer and file_path in self.writer.pending:
+            return
+        self.loading[file_path] = self.readers.submit(_prefetch_entry, file_path, self.shard_cache)
 
-    def _assert_file(self, file_path):
+    def _assert_file(self, file_path, create=False):
+        """
+        Returns the entry for a file, loading the file into the cache if necessary.
+
+        :param file_path: The path to the file
+        :param create: If True, create an empty entry if the file does not exist
+        :return: The :class:`FileEntry` for the file, or None if the file does not exist and create is False
+        """
+        if create:
+            self._check_writable()
         file = self.cache.get(file_path)
-        if file is None:
-            file = FileEntry(file_path)
-            self.cache.set(file_path, file)
+        if file is not None:
+            self.stats.cache_hits += 1
+            return file
+        if self.missing.get(file_path):
+            self.stats.missing_hits += 1
+            if not create:
+                return None
+            self.missing.drop(file_path)
+            file = FileEntry(file_path, exists=False, shard_cache=self.shard_cache)
+        else:
+            # An evicted entry that has not yet been written back holds the current content of the file
+            file = self.evicted.pop(file_path, None)
+            if file is not None:
+                self.evicted_bytes -= file.size_estimate()
+            elif self.writer:
+                # An entry that is queued to be written back can be reused once its write completes
+                file = self.writer.wait_for(file_path)
+            if file is None:
+                future = self.loading.pop(file_path, None)
+                file = future.result() if future else FileEntry(file_path, shard_cache=self.shard_cache)
+                self.stats.cache_misses += 1
+                if file.exists:
+                    self.stats.files_read += 1
+                    self.stats.bytes_read += file.loaded_bytes
+                elif not create:
+                    self.missing.set(file_path, True)
+                    return None
+            else:
+                self.stats.cache_hits += 1
+        self.cache.set(file_path, file)
         return file
 
+    def _check_writable(self):
+        if self.read_only:
+            raise QuinceReadOnlyException()
+
+    def _evict(self, file_path, file):
+        self.stats.cache_evictions += 1
+        # Files that are loaded read-only may be sorted in memory but are never written back
+        if file.dirty and not self.read_only:
+            self.evicted[file_path] = file
+            self.evicted_bytes += file.size_estimate()
+            if len(self.evicted) >= self.EVICTION_BATCH_SIZE or \
+                    (self.max_evicted_bytes and self.evicted_bytes > self.max_evicted_bytes):
+                self._write_evicted()
+
+    def _write_evicted(self):
+        evicted = list(self.evicted.values())
+        if self.writer:
+            self.writer.submit(evicted)
+        else:
+            _write_back(evicted, self.journal_path, self.stats)
+        self.evicted.clear()
+        self.evicted_bytes = 0
+
     def flush(self):
         """
-        Writes pending changes to disk.
+        Writes pending changes to disk. Only the files that have been modified are written.
+        Waits for any background writes to complete first. Does nothing if the manager is read-only.
         :return: None
         """
-        for f in self.cache.items():
-            f.flush()
+        if self.read_only:
+            return
+        if self.writer:
+            self.writer.wait()
+        _write_back(list(self.evicted.values()) + [f for f in self.cache.items() if f.dirty], self.journal_path,
+                    self.stats, self.writer.pool if self.writer else None)
+        self.evicted.clear()
+        self.evicted_bytes = 0
+        if self.shard_cache is not None:
+            self.shard_cache.trim()
 
 
-class LRUCache:
-    def __init__(self, capacity, eviction_callback=None):
-        self.capacity = capacity
-        self.cache = collections.OrderedDict()
-        self.eviction_callback = eviction_callback
+def _prefetch_entry(file_path, shard_cache=None):
+    entry = FileEntry(file_path, shard_cache=shard_cache)
+    entry.will_need()
+    return entry
 
-    def __contains__(self, key):
-        return key in self.cache
 
-    def get(self, key, default=None):
-        try:
-            value = self.cache.pop(key)
-            self.cache[key] = value
-            return value
-        except KeyError:
-            return default
+class WriteBackQueue:
+    # The maximum number of batches waiting to be written before submit() blocks
+    MAX_QUEUED_BATCHES = 2
 
-    def set(self, key, value):
-        try:
-            self.cache.pop(key)
-        except KeyError:
-            if len(self.cache) >= self.capacity:
-                key, evicted = self.cache.popitem(last=False)
-                if self.eviction_callback:
-                    self.eviction_callback(key, evicted)
-        self.cache[key] = value
+    def __init__(self, threads, journal_path=None, stats=None):
+        """
+        Writes batches of modified file entries back to disk on a background thread so that evicting entries
+        from the cache does not wait for the disk. Batches are written one at a time, as they share the
+        write-back journal, but the files within a batch are written in parallel on a pool of threads.
+        Entries must not be modified while they are queued: use :meth:`wait_for` to reclaim an entry.
+
+        :param threads: The number of threads used to write the files in a batch
+        :param journal_path: The path of the write-back journal file
+        :param stats: The :class:`QuinceStats` to record the writes in
+        """
+        self.journal_path = journal_path
+        self.stats = stats
+        self.pool = ThreadPoolExecutor(threads)
+        self.batches = ThreadPoolExecutor(1)
+        self.slots = threading.BoundedSemaphore(self.MAX_QUEUED_BATCHES)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.futures = []
+
+    def submit(self, entries):
+        """Queue a batch of entries to be written, blocking while the queue is full"""
+        self.slots.acquire()
+        with self.lock:
+            try:
+                future = self.batches.submit(self._write, entries)
+            except:
+                self.slots.release()
+                raise
+            for e in entries:
+                self.pending[e.path] = (e, future)
+            # Keep failed batches so that wait() reports them
+            self.futures = [f for f in self.futures if not f.done() or f.exception()]
+            self.futures.append(future)
+
+    def wait_for(self, file_path):
+        """
+        If the entry for file_path is queued, wait for it to be written and return it, otherwise return None
+
+        :raises: The exception raised when writing the entry's batch, if any
+        """
+        with self.lock:
+            entry, future = self.pending.get(file_path, (None, None))
+        if future is None:
+            return None
+        future.result()
+        return entry
+
+    def wait(self):
+        """
+        Wait for all of the queued batches to be written
 
-    def drop(self, key):
+        :raises: The first exception raised when writing a batch, if any
+        """
+        with self.lock:
+            futures, self.futures = self.futures, []
+        for future in futures:
+            future.result()
+
+    def _write(self, entries):
         try:
-            self.cache.pop(key)
-        except KeyError:
-            # Swallow the error
-            pass
+            _write_back(entries, self.journal_path, self.stats, self.pool)
+        finally:
+            with self.lock:
+                for e in entries:
+                    self.pending.pop(e.path, None)
+            self.slots.release()
+
+
+def _write_back(entries, journal_path=None, stats=None, pool=None):
+    """
+    Write a batch of modified file entries back to disk.
+
+    All of the new file contents are first written to temporary files, each of which is synced to disk. The
+    temporary files then replace the original files, and each affected directory is synced once. When a journal path
+    is specified, the batch is recorded in a :class:`FlushJournal` which is committed once the temporary
+    files are safely on disk and removed once all of the files have been replaced.
+
+    :param entries: The :class:`FileEntry` instances to write
+    :param journal_path: The path of the journal file, or None to write the batch without a journal
+    :param stats: The :class:`QuinceStats` to record the writes in
+    :param pool: An executor used to write the files in parallel, or None to write them one at a time
+    """
+    entries = [e for e in entries if e.dirty]
+    if not entries:
+        return
+    journal = None
+    if journal_path and len(entries) > 1:
+        # Replacing a single file is atomic, so only batches need a journal
+        journal = FlushJournal(journal_path,
+                               [e.path for e in entries if len(e)],
+                               [e.path for e in entries if not len(e)])
+    parallel_map = pool.map if pool and len(entries) > 1 else map
+    # Each temporary file is synced by the thread that writes it, so the writer pool overlaps the syncs
+    written = sum(parallel_map(lambda e: e.write_temp(True), entries))
+    if journal:
+        journal.commit()
+    if stats:
+        stats.bytes_written += written
+        for e in entries:
+            if len(e) == 0:
+                stats.files_deleted += e.exists
+            else:
+                stats.files_written += 1
+                stats.files_created += not e.exists
+    list(parallel_map(FileEntry.commit, entries))
+    list(parallel_map(_fsync_directory, set(os.path.dirname(e.path) for e in entries)))
+    if journal:
+        journal.close()
+
+
+def _fsync_directory(dir_name):
+    """Sync a directory so that renames and deletions within it are on disk. Not supported on all platforms."""
+    try:
+        fd = os.open(dir_name, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
 
-    def items(self):
-        return self.cache.values()
+class FlushJournal:
+    """
+    The intent journal for a batch of file write-backs.
+
+    The journal lists the files that are to be replaced by temporary files and the files that are to be deleted.
+    It is written before any temporary file, and a commit line is appended once all of the temporary files
+    are on disk. If the process is interrupted, :meth:`recover` completes the batch if the journal was
+    committed, or removes the temporary files if it was not.
+    """
+    HEADER = 'quince flush journal 1\n'
+    COMMIT = 'commit\n'
+
+    def __init__(self, path, replaced, deleted):
+        self.path = path
+        base = os.path.dirname(path)
+        with open(path, encoding='utf-8', mode='w') as f:
+            f.write(self.HEADER)
+            f.writelines('W {0}\n'.format(os.path.relpath(p, base)) for p in replaced)
+            f.writelines('D {0}\n'.format(os.path.relpath(p, base)) for p in deleted)
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_directory(base)
+
+    def commit(self):
+        with open(self.path, encoding='utf-8', mode='a') as f:
+            f.write(self.COMMIT)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        os.remove(self.path)
+        _fsync_directory(os.path.dirname(self.path))
+
+    @staticmethod
+    def recover(path):
+        """
+        Complete or undo the batch recorded in the journal at path, if there is one.
+
+        :return: True if the batch was completed, False if it was undone, None if there was no journal
+        """
+        try:
+            with open(path, encoding='utf-8', mode='r') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+        log = logging.getLogger('quince')
+        base = os.path.dirname(path)
+        committed = len(lines) > 1 and lines[0] == FlushJournal.HEADER and lines[-1] == FlushJournal.COMMIT
+        for line in lines[1:]:
+            op, _, rel_path = line.rstrip('\n').partition(' ')
+            file_path = os.path.join(base, rel_path)
+            if op == 'W' and os.path.exists(file_path + TMP):
+                if committed:
+                    os.replace(file_path + TMP, file_path)
+                else:
+                    os.remove(file_path + TMP)
+            elif op == 'D' and committed and os.path.exists(file_path):
+                os.remove(file_path)
+        if committed:
+            log.warning('Completed an interrupted write of {0} files to the repository'.format(len(lines) - 2))
+        else:
+            log.warning('Discarded an interrupted write to the repository')
+        os.remove(path)
+        return committed
 
 
 def git_add_files():
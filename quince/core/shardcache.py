@@ -0,0 +1,178 @@
+__author__ = 'Kal Ahmed'
+
+"""
+A persistent cache of loaded shard files.
+
+Loading a shard file for update means decoding and splitting its text, checking its sort order and packing its
+lines (see :class:`quince.core.repo.FileEntry`). The shard cache keeps the packed form of the shard files that
+quince has written in a binary file under .quince/.cache, so a later command that loads the same unchanged shard
+reads the packed form instead of parsing the text. Each cached shard is keyed by the path, modification time,
+size and inode of the shard file, so a shard file that is changed by any other means (such as a git checkout or
+merge) is simply not found in the cache. The cache is bounded in size and the least recently used files are
+removed when it grows too large. The total size of the cached files is kept in a size file in the cache
+directory, so the cache directory is only walked when the total is over budget.
+
+The cache is disabled by default. Enable it with the shard_cache option of the [Cache] section of the repository
+config, which is the maximum size of the cache (e.g. 1G).
+"""
+
+import hashlib
+import logging
+import os
+import threading
+
+from quince.core.stats import QuinceStats
+
+# The directory of the cache in the .quince directory
+CACHE_DIR = '.cache'
+CACHE_SUFFIX = '.bin'
+# The file in the cache directory that records the total size of the cached files
+SIZE_FILE = 'size'
+
+
+class ShardCache:
+    def __init__(self, path, root, max_bytes, stats=None):
+        """
+        :param path: The path to the cache directory
+        :param root: The path to the store root. Cached shards are keyed by their path relative to the root.
+        :param max_bytes: The maximum total size of the cached files
+        :param stats: The :class:`QuinceStats` to record cache hits and misses in
+        """
+        self.path = path
+        self.root = root
+        self.max_bytes = max_bytes
+        self.stats = stats or QuinceStats()
+        self.lock = threading.Lock()
+        # The change in the total size of the cached files since the cache was last trimmed
+        self.delta = 0
+        self.changed = False
+
+    def _cache_path(self, file_path, stat):
+        key = '{0}\0{1}\0{2}\0{3}'.format(os.path.relpath(file_path, self.root), stat.st_mtime_ns, stat.st_size,
+                                          stat.st_ino)
+        h = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, h[:2], h + CACHE_SUFFIX)
+
+    def get(self, file_path, stat):
+        """
+        Returns the cached form of a shard file, or None if the file is not in the cache
+
+        :param file_path: The path to the shard file
+        :param stat: The os.stat_result of the shard file
+        """
+        cache_path = self._cache_path(file_path, stat)
+        try:
+            with open(cache_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.stats.shard_cache_misses += 1
+            return None
+        self.stats.shard_cache_hits += 1
+        try:
+            # The modification time of a cached file records when it was last used
+            os.utime(cache_path)
+        except OSError:
+            pass
+        return data
+
+    def put(self, file_path, stat, data):
+        """
+        Add the cached form of a shard file to the cache. Errors writing the cache are logged and ignored.
+
+        :param file_path: The path to the shard file
+        :param stat: The os.stat_result of the shard file
+        :param data: The bytes to cache
+        """
+        if len(data) > self.max_bytes:
+            return
+        cache_path = self._cache_path(file_path, stat)
+        tmp_path = '{0}.{1}.tmp'.format(cache_path, threading.get_ident())
+        replaced = _file_size(cache_path)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            logging.getLogger('quince').debug('Could not cache {0}: {1}'.format(file_path, e))
+            return
+        self._record(len(data) - replaced)
+
+    def discard(self, file_path, stat):
+        """Remove the cached form of a shard file if there is one"""
+        cache_path = self._cache_path(file_path, stat)
+        size = _file_size(cache_path)
+        try:
+            os.remove(cache_path)
+        except OSError:
+            return
+        self._record(-size)
+
+    def _record(self, delta):
+        with self.lock:
+            self.delta += delta
+            self.changed = True
+
+    def trim(self):
+        """
+        Remove the least recently used files from the cache until its total size is within max_bytes.
+        Does nothing if the cache has not changed since it was last trimmed. The cache directory is only walked
+        if the recorded total size is over budget or is not known, and the exact total is then recorded.
+        """
+        with self.lock:
+            if not self.changed:
+                return
+            delta, self.delta, self.changed = self.delta, 0, False
+        total = self._read_size()
+        if total is not None and total + delta <= self.max_bytes:
+            self._write_size(max(total + delta, 0))
+            return
+        self._write_size(self._evict())
+
+    def _evict(self):
+        """Walk the cache directory, removing the least recently used files, and return the remaining total size"""
+        entries = []
+        total = 0
+        for dir_path, dirs, files in os.walk(self.path):
+            for f in filter(lambda x: x.endswith(CACHE_SUFFIX), files):
+                cache_path = os.path.join(dir_path, f)
+                try:
+                    st = os.stat(cache_path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, cache_path))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return total
+        entries.sort()
+        for _, size, cache_path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(cache_path)
+            except OSError:
+                continue
+            total -= size
+        return total
+
+    def _read_size(self):
+        try:
+            with open(os.path.join(self.path, SIZE_FILE)) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write_size(self, total):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(os.path.join(self.path, SIZE_FILE), 'w') as f:
+                f.write('{0}\n'.format(total))
+        except OSError as e:
+            logging.getLogger('quince').debug('Could not record the size of the shard cache: {0}'.format(e))
+
+
+def _file_size(path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
@@ -0,0 +1,157 @@
+__author__ = 'Kal Ahmed'
+
+"""
+Deterministic skolemization of blank nodes.
+
+rdflib's BNode.skolemize() generates a new random IRI each time a document is parsed, so every re-import of
+an unchanged document rewrites every file that references a blank node. The :class:`SkolemizingSink`
+instead derives the skolem IRI of each blank node from a hash of its neighbourhood in the source document,
+so importing the same data again generates the same IRIs.
+"""
+
+import collections
+import hashlib
+
+from rdflib import BNode, URIRef
+
+SKOLEM_BASE = 'http://networkedplanet.com/quince/.well-known/genid/'
+
+
+class SkolemizingSink:
+    def __init__(self, sink):
+        """
+        A parser sink that replaces blank nodes with deterministic skolem IRIs before passing quads on to
+        another sink. Quads without blank nodes are passed straight through. Quads with blank nodes are
+        held in memory until :meth:`close` is called, as the IRI of a blank node depends on all of the
+        quads that reference it.
+
+        :param sink: The sink to pass the skolemized quads on to
+        """
+        self.sink = sink
+        self.quads = []
+
+    def quad(self, s, p, o, g):
+        if isinstance(s, BNode) or isinstance(p, BNode) or isinstance(o, BNode) or isinstance(g, BNode):
+            self.quads.append((s, p, o, g))
+        else:
+            self.sink.quad(s, p, o, g)
+
+    def triple(self, s, p, o):
+        self.quad(s, p, o, None)
+
+    def raw_quad(self, s, p, o, g):
+        # Raw quads never contain blank nodes
+        self.sink.raw_quad(s, p, o, g)
+
+    def flush(self):
+        """Skolemize the held quads and pass them on to the wrapped sink without closing it"""
+        skolem_iris = {b: URIRef(SKOLEM_BASE + label) for b, label in canonical_labels(self.quads).items()}
+        for q in self.quads:
+            self.sink.quad(*[skolem_iris.get(t, t) for t in q])
+        self.quads = []
+
+    def close(self):
+        self.flush()
+        self.sink.close()
+
+
+def canonical_labels(quads):
+    """
+    Compute a distinct label for each blank node in quads that depends only on the structure of the data and
+    not on the blank node identifiers assigned by the parser.
+
+    Each blank node is first labelled with a hash of the quads it appears in, with all blank nodes replaced
+    by placeholders. The labels are then refined: a blank node that shares its label with another blank node
+    and that appears in a quad with a blank node whose label has just changed is re-labelled with a hash of its
+    label and its quads using the labels of the neighbouring blank nodes. Refinement stops when a round does not
+    split the blank nodes sharing any label.
+
+    Blank nodes that cannot be told apart by their neighbourhoods, such as the two nodes of a cycle or two
+    identical structures, are then distinguished by the order in which they first appear in quads: the first
+    node with the smallest shared label is given the label with the number of the tie break appended, and
+    refinement continues from that node until every blank node has its own label.
+
+    :param quads: A list of (s, p, o, g) tuples. g may be None for the default graph.
+    :return: A dictionary mapping each blank node to its label
+    """
+    by_node = collections.OrderedDict()
+    neighbours = collections.defaultdict(set)
+    for q in quads:
+        nodes = [t for t in q if isinstance(t, BNode)]
+        for b in nodes:
+            by_node.setdefault(b, []).append(q)
+            neighbours[b].update(nodes)
+    first_seen = {b: i for i, b in enumerate(by_node)}
+    labels = {b: _hash(_signature(q, b, None) for q in node_quads) for b, node_quads in by_node.items()}
+    classes = collections.defaultdict(set)
+    for b, label in labels.items():
+        classes[label].add(b)
+    changed = set(by_node)
+    tie_breaks = 0
+    while True:
+        candidates = set(n for c in changed for n in neighbours[c] if len(classes[labels[n]]) > 1)
+        changed = _refine(candidates, by_node, labels, classes)
+        if changed:
+            continue
+        tied = [label for label, members in classes.items() if len(members) > 1]
+        if not tied:
+            return labels
+        label = min(tied)
+        b = min(classes[label], key=first_seen.get)
+        tie_breaks += 1
+        _relabel(b, '{0}-{1}'.format(label, tie_breaks), labels, classes)
+        changed = {b}
+
+
+def _refine(candidates, by_node, labels, classes):
+    """
+    Re-label the candidate blank nodes from the labels of their neighbours and return the blank nodes whose
+    label changed. The label of a blank node is only changed if that splits the blank nodes that share it, and
+    the largest group of a split keeps the shared label.
+    """
+    by_label = collections.defaultdict(list)
+    for b in candidates:
+        by_label[labels[b]].append(b)
+    refined = {}
+    for label, members in by_label.items():
+        new_labels = {b: _hash([label] + [_signature(q, b, labels) for q in by_node[b]]) for b in members}
+        groups = collections.Counter(new_labels.values())
+        kept = len(classes[label]) - len(members)
+        if len(groups) + (1 if kept else 0) < 2:
+            continue
+        if not kept:
+            # The largest group keeps the shared label, so that only the blank nodes split from it have changed
+            largest = min(groups, key=lambda l: (-groups[l], l))
+            new_labels = {b: l for b, l in new_labels.items() if l != largest}
+        refined.update(new_labels)
+    # Labels are only updated once every candidate has been hashed with the labels of the previous round
+    for b, label in refined.items():
+        _relabel(b, label, labels, classes)
+    return set(refined)
+
+
+def _relabel(b, label, labels, classes):
+    old = classes[labels[b]]
+    old.discard(b)
+    if not old:
+        del classes[labels[b]]
+    labels[b] = label
+    classes[label].add(b)
+
+
+def _signature(q, node, labels):
+    return ' '.join(_term(t, node, labels) for t in q)
+
+
+def _term(t, node, labels):
+    if t is None:
+        return ''
+    if t == node:
+        return '_:self'
+    if isinstance(t, BNode):
+        return '_:' + labels[t] if labels else '_:other'
+    return t.n3()
+
+
+def _hash(signatures):
+    return hashlib.sha1('\n'.join(sorted(signatures)).encode('utf-8')).hexdigest()
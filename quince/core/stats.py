@@ -0,0 +1,46 @@
+__author__ = 'Kal Ahmed'
+
+import collections
+import json
+
+
+class QuinceStats:
+    """
+    Counters for the cache and file activity of a :class:`QuinceStore`.
+
+    * cache_hits - requests for a file that were served from the cache
+    * cache_misses - requests for a file that had to be loaded from disk
+    * cache_evictions - entries evicted from the cache to stay within its bounds
+    * missing_hits - requests for a file that is already known not to exist
+    * files_read - files loaded from disk
+    * bytes_read - bytes loaded from disk
+    * files_written - modified files written back to disk
+    * bytes_written - bytes written back to disk
+    * files_created - files written back that did not previously exist
+    * files_deleted - files deleted because all of their lines were removed
+    * shard_cache_hits - files loaded from the persistent shard cache instead of being parsed
+    * shard_cache_misses - files that were parsed because they were not in the persistent shard cache
+    """
+    COUNTERS = ['cache_hits', 'cache_misses', 'cache_evictions', 'missing_hits', 'files_read', 'bytes_read',
+                'files_written', 'bytes_written', 'files_created', 'files_deleted', 'shard_cache_hits',
+                'shard_cache_misses']
+
+    def __init__(self):
+        for counter in self.COUNTERS:
+            setattr(self, counter, 0)
+
+    def add(self, other):
+        """Add the counters of another QuinceStats, such as one recorded by a worker process, to this one"""
+        for counter in self.COUNTERS:
+            setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+
+    def as_dict(self):
+        """Returns the counters as an ordered dictionary"""
+        return collections.OrderedDict((counter, getattr(self, counter)) for counter in self.COUNTERS)
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def __str__(self):
+        width = max(len(c) for c in self.COUNTERS)
+        return '\n'.join('{0:<{1}} {2}'.format(counter, width, value) for counter, value in self.as_dict().items())
@@ -0,0 +1,388 @@
+__author__ = 'Kal Ahmed'
+
+"""
+Streaming parsers for Turtle and TriG.
+
+The parsers read their input in fixed size chunks and emit each triple to the sink as soon as it has been
+parsed, so memory use does not grow with the size of the document. Only the prefix mappings and the blank
+node label mappings of the document are retained.
+"""
+
+import codecs
+import re
+from urllib.parse import urljoin
+
+from rdflib import URIRef, BNode, Literal, RDF, XSD
+from rdflib.plugins.parsers.ntriples import ParseError
+
+CHUNK_SIZE = 1 << 16
+
+# The number of characters that must follow a token in the buffer before the token is accepted. Some tokens
+# are prefixes of longer tokens (e.g. "1" of "1e5", "ex:a" of "ex:a.b", '""' of '"""..."""') so a token
+# that ends close to the end of the buffer may continue in the next chunk of input.
+LOOKAHEAD = 8
+
+_PN_CHARS_BASE = ('A-Za-z\u00C0-\u00D6\u00D8-\u00F6\u00F8-\u02FF\u0370-\u037D\u037F-\u1FFF\u200C-\u200D'
+                  '\u2070-\u218F\u2C00-\u2FEF\u3001-\uD7FF\uF900-\uFDCF\uFDF0-\uFFFD\U00010000-\U000EFFFF')
+_PN_CHARS_U = _PN_CHARS_BASE + '_'
+_PN_CHARS = _PN_CHARS_U + '\\-0-9\u00B7\u0300-\u036F\u203F-\u2040'
+_PN_PREFIX = '[{0}](?:[{1}.]*[{1}])?'.format(_PN_CHARS_BASE, _PN_CHARS)
+_PLX = r"%[0-9A-Fa-f]{2}|\\[_~.\-!$&'()*+,;=/?#@%]"
+_PN_LOCAL = '(?:[{0}:0-9]|{2})(?:(?:[{1}.:]|{2})*(?:[{1}:]|{2}))?'.format(_PN_CHARS_U, _PN_CHARS, _PLX)
+_UCHAR = r'\\u[0-9A-Fa-f]{4}|\\U[0-9A-Fa-f]{8}'
+
+_TOKEN = re.compile('|'.join([
+    r'(?P<ws>(?:\s|#[^\n\r]*)+)',
+    r'(?P<iri><(?:[^\x00-\x20<>"{{}}|^`\\]|{0})*>)'.format(_UCHAR),
+    '(?P<bnode>_:[{0}0-9](?:[{1}.]*[{1}])?)'.format(_PN_CHARS_U, _PN_CHARS),
+    '(?P<pname>(?:{0})?:(?:{1})?)'.format(_PN_PREFIX, _PN_LOCAL),
+    r'(?P<lstring>"""(?:(?:"|"")?(?:[^"\\]|\\.))*"""|' + r"'''(?:(?:'|'')?(?:[^'\\]|\\.))*''')",
+    r'(?P<string>"(?:[^"\\\n\r]|\\.)*"|' + r"'(?:[^'\\\n\r]|\\.)*')",
+    r'(?P<double>[+-]?(?:[0-9]+\.[0-9]*[eE][+-]?[0-9]+|\.[0-9]+[eE][+-]?[0-9]+|[0-9]+[eE][+-]?[0-9]+))',
+    r'(?P<decimal>[+-]?[0-9]*\.[0-9]+)',
+    r'(?P<integer>[+-]?[0-9]+)',
+    r'(?P<dtype>\^\^)',
+    r'(?P<lang>@[a-zA-Z]+(?:-[a-zA-Z0-9]+)*)',
+    r'(?P<punct>[\[\](){};,.])',
+    r'(?P<keyword>[A-Za-z]+)'
+]))
+
+# The unterminated starts of the tokens that can be longer than LOOKAHEAD before they match: IRIs, strings and
+# prefixed names with a prefix that does not start with an ASCII letter
+_PARTIAL_TOKEN = re.compile('|'.join([
+    r'<[^\x00-\x20<>"{}|^`]*\Z',
+    r'"""|' + r"'''",
+    r'"(?:[^"\\\n\r]|\\.)*\\?\Z|' + r"'(?:[^'\\\n\r]|\\.)*\\?\Z",
+    '[{0}][{1}.]*\\Z'.format(_PN_CHARS_BASE, _PN_CHARS)
+]), re.DOTALL)
+
+_ESCAPE = re.compile(r'\\(?:u([0-9A-Fa-f]{4})|U([0-9A-Fa-f]{8})|(.))', re.DOTALL)
+_ECHARS = {'t': '\t', 'b': '\b', 'n': '\n', 'r': '\r', 'f': '\f', '"': '"', "'": "'", '\\': '\\'}
+_SCHEME = re.compile(r'[A-Za-z][A-Za-z0-9+.\-]*:')
+_PN_LOCAL_ESCAPE = re.compile(r'\\(.)')
+
+
+def _unescape(s):
+    def replace(m):
+        if m.group(3) is not None:
+            try:
+                return _ECHARS[m.group(3)]
+            except KeyError:
+                raise ParseError('Invalid escape sequence \\{0}'.format(m.group(3)))
+        return chr(int(m.group(1) or m.group(2), 16))
+    return _ESCAPE.sub(replace, s) if '\\' in s else s
+
+
+class _Lexer:
+    """
+    Splits a binary stream of UTF-8 encoded text into Turtle tokens, reading more of the stream
+    whenever a token may continue past the end of the current buffer.
+    """
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def next(self):
+        """
+        :return: A tuple of (token kind, token text) or None at the end of the stream
+        """
+        while True:
+            m = _TOKEN.match(self.buf, self.pos)
+            if not self.eof and self._incomplete(m):
+                self._fill()
+                continue
+            if m is None:
+                if self.pos >= len(self.buf):
+                    return None
+                raise ParseError('Unexpected input: {0!r}'.format(self.buf[self.pos:self.pos + 40]))
+            self.pos = m.end()
+            if m.lastgroup != 'ws':
+                return m.lastgroup, m.group(m.lastgroup)
+
+    def _incomplete(self, m):
+        """Returns True if reading more of the stream may change the token matched at the current position"""
+        if m is None:
+            # Input that is not the start of a token is rejected without reading the rest of the stream
+            return len(self.buf) - self.pos < LOOKAHEAD or _PARTIAL_TOKEN.match(self.buf, self.pos) is not None
+        return len(self.buf) - m.end() < LOOKAHEAD or self._partial_long_string(m)
+
+    def _partial_long_string(self, m):
+        # An empty string followed by another quote is the start of a long string that has not been fully read
+        return m.lastgroup == 'string' and len(m.group()) == 2 and self.buf[m.end()] == m.group()[0]
+
+    def _fill(self):
+        data = self.stream.read(self.chunk_size)
+        if not data:
+            self.eof = True
+        text = self.decoder.decode(data, final=self.eof)
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+
+
+class TurtleParser:
+    """
+    A streaming parser for Turtle documents. Triples are passed to the quad method of the sink with
+    a graph of None as soon as they are parsed.
+    """
+
+    def __init__(self, sink, base=None, chunk_size=CHUNK_SIZE):
+        self.sink = sink
+        self.base = base
+        self.chunk_size = chunk_size
+        self.prefixes = {}
+        self.bnodes = {}
+        self.graph = None
+        self.lexer = None
+        self.tok = None
+
+    def parse(self, source):
+        """Parse the file-like object source as a Turtle (or TriG) document"""
+        if not hasattr(source, 'read'):
+            raise ParseError("Item to parse must be a file-like object.")
+        self.lexer = _Lexer(source, self.chunk_size)
+        self.advance()
+        while self.tok is not None:
+            self.statement()
+        return self.sink
+
+    def advance(self):
+        self.tok = self.lexer.next()
+
+    def expect(self, punct):
+        if self.tok != ('punct', punct):
+            raise ParseError('Expected "{0}" but found {1!r}'.format(punct, self.tok and self.tok[1]))
+        self.advance()
+
+    def at(self, punct):
+        return self.tok == ('punct', punct)
+
+    def at_keyword(self, keyword):
+        return self.tok is not None and self.tok[0] == 'keyword' and self.tok[1].upper() == keyword
+
+    def statement(self):
+        if self.directive():
+            return
+        self.triples()
+        self.expect('.')
+
+    def directive(self):
+        kind, value = self.tok
+        if kind == 'lang' and value in ('@prefix', '@base'):
+            self.advance()
+            self.prefix_or_base(value[1:].upper())
+            self.expect('.')
+            return True
+        if kind == 'keyword' and value.upper() in ('PREFIX', 'BASE'):
+            self.advance()
+            self.prefix_or_base(value.upper())
+            return True
+        return False
+
+    def prefix_or_base(self, directive):
+        if directive == 'PREFIX':
+            if self.tok is None or self.tok[0] != 'pname' or not self.tok[1].endswith(':'):
+                raise ParseError('Expected a prefix declaration')
+            prefix = self.tok[1][:-1]
+            self.advance()
+            self.prefixes[prefix] = self.iri()
+        else:
+            self.base = self.iri()
+
+    def triples(self, subject=None):
+        if subject is None:
+            if self.at('['):
+                subject = self.blank_node_property_list()
+                if self.at('.') or self.at('}'):
+                    return
+            else:
+                subject = self.subject()
+        self.predicate_object_list(subject)
+
+    def subject(self):
+        if self.at('('):
+            return self.collection()
+        if self.at('['):
+            return self.blank_node_property_list()
+        kind = self.tok and self.tok[0]
+        if kind in ('iri', 'pname'):
+            return self.iri()
+        if kind == 'bnode':
+            return self.blank_node()
+        raise ParseError('Expected a subject but found {0!r}'.format(self.tok and self.tok[1]))
+
+    def predicate_object_list(self, subject):
+        while True:
+            predicate = self.verb()
+            self.object_list(subject, predicate)
+            if not self.at(';'):
+                return
+            while self.at(';'):
+                self.advance()
+            if self.tok is None or self.tok[0] == 'punct':
+                return
+
+    def verb(self):
+        if self.tok == ('keyword', 'a'):
+            self.advance()
+            return RDF.type
+        return self.iri()
+
+    def object_list(self, subject, predicate):
+        self.emit(subject, predicate, self.object())
+        while self.at(','):
+            self.advance()
+            self.emit(subject, predicate, self.object())
+
+    def object(self):
+        if self.tok is None:
+            raise ParseError('Unexpected end of input')
+        kind, value = self.tok
+        if kind in ('iri', 'pname'):
+            return self.iri()
+        if kind == 'bnode':
+            return self.blank_node()
+        if kind == 'punct' and value == '[':
+            return self.blank_node_property_list()
+        if kind == 'punct' and value == '(':
+            return self.collection()
+        if kind in ('string', 'lstring'):
+            return self.literal()
+        if kind in ('integer', 'decimal', 'double'):
+            self.advance()
+            return Literal(value, datatype=getattr(XSD, kind))
+        if kind == 'keyword' and value in ('true', 'false'):
+            self.advance()
+            return Literal(value, datatype=XSD.boolean)
+        raise ParseError('Expected an object but found {0!r}'.format(value))
+
+    def literal(self):
+        kind, value = self.tok
+        quote_len = 3 if kind == 'lstring' else 1
+        lexical = _unescape(value[quote_len:-quote_len])
+        self.advance()
+        if self.tok is not None and self.tok[0] == 'lang':
+            language = self.tok[1][1:]
+            self.advance()
+            return Literal(lexical, lang=language)
+        if self.tok == ('dtype', '^^'):
+            self.advance()
+            return Literal(lexical, datatype=self.iri())
+        return Literal(lexical)
+
+    def iri(self):
+        if self.tok is None:
+            raise ParseError('Unexpected end of input')
+        kind, value = self.tok
+        if kind == 'iri':
+            self.advance()
+            iri = _unescape(value[1:-1])
+            if self.base and not _SCHEME.match(iri):
+                iri = urljoin(self.base, iri)
+            return URIRef(iri)
+        if kind == 'pname':
+            self.advance()
+            prefix, _, local = value.partition(':')
+            try:
+                namespace = self.prefixes[prefix]
+            except KeyError:
+                raise ParseError('Undefined namespace prefix "{0}"'.format(prefix))
+            return URIRef(namespace + _PN_LOCAL_ESCAPE.sub(r'\1', local))
+        raise ParseError('Expected an IRI but found {0!r}'.format(value))
+
+    def blank_node(self):
+        label = self.tok[1][2:]
+        self.advance()
+        try:
+            return self.bnodes[label]
+        except KeyError:
+            b = self.bnodes[label] = BNode()
+            return b
+
+    def blank_node_property_list(self):
+        self.expect('[')
+        b = BNode()
+        if not self.at(']'):
+            self.predicate_object_list(b)
+        self.expect(']')
+        return b
+
+    def collection(self):
+        self.expect('(')
+        if self.at(')'):
+            self.advance()
+            return RDF.nil
+        head = node = BNode()
+        while True:
+            self.emit(node, RDF.first, self.object())
+            if self.at(')'):
+                self.advance()
+                self.emit(node, RDF.rest, RDF.nil)
+                return head
+            rest = BNode()
+            self.emit(node, RDF.rest, rest)
+            node = rest
+
+    def emit(self, s, p, o):
+        self.sink.quad(s, p, o, self.graph)
+
+
+class TriGParser(TurtleParser):
+    """
+    A streaming parser for TriG documents. Quads are passed to the quad method of the sink as soon as they
+    are parsed. Triples in the default graph are passed with a graph of None.
+    """
+
+    def statement(self):
+        if self.directive():
+            return
+        if self.at_keyword('GRAPH'):
+            self.advance()
+            self.wrapped_graph(self.graph_label())
+        elif self.at('{'):
+            self.wrapped_graph(None)
+        elif self.at('['):
+            subject = self.blank_node_property_list()
+            if self.at('{'):
+                self.wrapped_graph(subject)
+                return
+            if not self.at('.'):
+                self.predicate_object_list(subject)
+            self.expect('.')
+        else:
+            subject = self.subject()
+            if self.at('{'):
+                if isinstance(subject, (URIRef, BNode)) and subject != RDF.nil:
+                    self.wrapped_graph(subject)
+                    return
+                raise ParseError('A collection cannot be used as a graph label')
+            self.predicate_object_list(subject)
+            self.expect('.')
+
+    def graph_label(self):
+        if self.at('['):
+            self.advance()
+            self.expect(']')
+            return BNode()
+        kind = self.tok and self.tok[0]
+        if kind == 'bnode':
+            return self.blank_node()
+        return self.iri()
+
+    def wrapped_graph(self, label):
+        self.expect('{')
+        self.graph = label
+        try:
+            while not self.at('}'):
+                if self.tok is None:
+                    raise ParseError('Unexpected end of input in graph {0}'.format(label))
+                self.triples()
+                if not self.at('.'):
+                    break
+                self.advance()
+            self.expect('}')
+        finally:
+            self.graph = None
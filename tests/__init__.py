@@ -1,2 +1,3 @@
 __author__ = 'Kal Ahmed'
-__all__ = ['parsing_tests', 'qdiff_tests', 'repo_tests']
\ No newline at end of file
+__all__ = ['bulk_tests', 'cache_tests', 'index_tests', 'layout_tests', 'parsing_tests', 'qbatch_tests', 'qdiff_tests',
+           'qimport_tests', 'qmatch_tests', 'repo_tests', 'shardcache_tests', 'skolem_tests']
\ No newline at end of file
@@ -0,0 +1,220 @@
+__author__ = 'Kal Ahmed'
+
+import glob
+import os
+import tempfile
+import unittest
+
+from rdflib import Namespace, URIRef, Literal
+
+from quince.core import qindex
+from quince.core.bulk import QuinceBulkSink, merge_into_file
+from quince.core.exceptions import QuinceParseException
+from quince.core.index import INDEX_POS
+from quince.core.qimport import import_file, import_files
+from quince.core.repo import QUINCE_DEFAULT_GRAPH_IRI, QuinceStore, qdir, FLUSH_JOURNAL
+from quince.core.stats import QuinceStats
+import testutils
+
+EG = Namespace('http://example.org/')
+DEFAULT_GRAPH = URIRef(QUINCE_DEFAULT_GRAPH_IRI)
+ALICE = URIRef('http://example.org/person/alice')
+FOAF_NAME = URIRef('http://xmlns.com/foaf/0.1/name')
+
+
+class BulkSinkTests(testutils.TestBase):
+
+    @testutils.with_store("HEAD")
+    def test_bulk_load_matches_assert(self, store):
+        sink = QuinceBulkSink(store, run_size=2)
+        sink.quad(EG.s1, EG.p1, EG.o2, None)
+        sink.quad(EG.s1, EG.p1, EG.o1, None)
+        sink.quad(EG.s1, EG.p1, Literal('hello'), EG.g1)
+        sink.quad(EG.s1, EG.p1, EG.o1, None)
+        sink.quad(EG.s2, EG.p1, EG.o1, None)
+        work_dir = os.path.dirname(sink.runs[0][0])
+        self.assertEqual(2, sink.close())
+        self.assertFalse(os.path.exists(work_dir))
+        s1_path = store.make_file_path(EG.s1) + '.nqo'
+        self.assertEqual(sorted([testutils.make_nquad(EG.s1, EG.p1, EG.o1, DEFAULT_GRAPH),
+                                 testutils.make_nquad(EG.s1, EG.p1, EG.o2, DEFAULT_GRAPH),
+                                 testutils.make_nquad(EG.s1, EG.p1, Literal('hello'), EG.g1)]),
+                         testutils.get_lines(s1_path))
+
+    @testutils.with_store("HEAD")
+    def test_bulk_load_merges_with_existing_file(self, store):
+        alice_path = store.make_file_path(ALICE) + '.nqo'
+        before = testutils.get_lines(alice_path)
+        sink = QuinceBulkSink(store)
+        sink.quad(ALICE, EG.p1, EG.o1, None)
+        sink.close()
+        after = testutils.get_lines(alice_path)
+        self.assertEqual(len(before) + 1, len(after))
+        self.assertEqual(sorted(after), after)
+        self.assertIn(testutils.make_nquad(ALICE, EG.p1, EG.o1, DEFAULT_GRAPH), after)
+
+    @testutils.with_store("HEAD")
+    def test_bulk_load_of_existing_quads_does_not_rewrite_file(self, store):
+        alice_path = store.make_file_path(ALICE) + '.nqo'
+        os.utime(alice_path, (0, 0))
+        sink = QuinceBulkSink(store)
+        sink.quad(ALICE, FOAF_NAME, Literal('Alice'), None)
+        self.assertEqual(0, sink.close())
+        self.assertEqual(0, os.stat(alice_path).st_mtime)
+
+
+    @testutils.with_rw_repo("HEAD")
+    def test_failed_bulk_import_removes_runs(self, repo):
+        with open('bad.nq', 'w') as f:
+            for i in range(50):
+                f.write('<http://example.org/s{0}> <http://example.org/p> "{0}" <http://example.org/g> .\n'.format(i))
+            f.write('not nquads\n')
+        before = set(glob.glob(os.path.join(tempfile.gettempdir(), 'quince-bulk-*')))
+        self.assertRaises(QuinceParseException, import_file, 'bad.nq', bulk=True, run_size=10)
+        self.assertEqual(before, set(glob.glob(os.path.join(tempfile.gettempdir(), 'quince-bulk-*'))))
+
+
+class ReplaceGraphTests(testutils.TestBase):
+
+    @testutils.with_rw_repo("HEAD")
+    def test_replace_graph_applies_only_differences(self, repo):
+        store = QuinceStore(qdir())
+        sink = QuinceBulkSink(store)
+        sink.quad(EG.s1, EG.p, EG.o1, EG.g)
+        sink.quad(EG.s1, EG.p, EG.o1, EG.other)
+        sink.quad(EG.s2, EG.p, EG.o1, EG.g)
+        sink.quad(EG.s3, EG.p, EG.o1, EG.g)
+        sink.quad(EG.s4, EG.p, EG.o1, EG.g)
+        sink.close()
+        paths = dict((s, store.make_file_path(s) + '.nqo') for s in (EG.s1, EG.s2, EG.s3, EG.s4, EG.s5))
+        for path in paths.values():
+            if os.path.exists(path):
+                os.utime(path, (0, 0))
+        with open('g.nt', 'w') as f:
+            f.write('<http://example.org/s2> <http://example.org/p> <http://example.org/o1> .\n')
+            f.write('<http://example.org/s3> <http://example.org/p> <http://example.org/o2> .\n')
+            f.write('<http://example.org/s5> <http://example.org/p> <http://example.org/o1> .\n')
+        import_file('g.nt', replace_graph=str(EG.g))
+        # s1 keeps its quad in another graph, s2 is unchanged, s3 is updated, s4 is removed and s5 is added
+        self.assertEqual([testutils.make_nquad(EG.s1, EG.p, EG.o1, EG.other)], testutils.get_lines(paths[EG.s1]))
+        self.assertEqual(0, os.stat(paths[EG.s2]).st_mtime)
+        self.assertEqual([testutils.make_nquad(EG.s3, EG.p, EG.o2, EG.g)], testutils.get_lines(paths[EG.s3]))
+        self.assertFalse(os.path.exists(paths[EG.s4]))
+        self.assertEqual([testutils.make_nquad(EG.s5, EG.p, EG.o1, EG.g)], testutils.get_lines(paths[EG.s5]))
+
+    @testutils.with_rw_repo("HEAD")
+    def test_replace_graph_reads_only_shards_in_graph_manifest(self, repo):
+        store = QuinceStore(qdir())
+        sink = QuinceBulkSink(store)
+        sink.quad(EG.s1, EG.p, EG.o1, EG.g)
+        sink.quad(EG.s2, EG.p, EG.o1, EG.g)
+        for i in range(20):
+            sink.quad(URIRef('http://example.org/x{0}'.format(i)), EG.p, EG.o1, EG.other)
+        sink.close()
+        qindex.rebuild()
+        with open('g.nt', 'w') as f:
+            f.write('<http://example.org/s2> <http://example.org/p> <http://example.org/o2> .\n')
+        import_file('g.nt', replace_graph=str(EG.g))
+        self.assertFalse(os.path.exists(store.make_file_path(EG.s1) + '.nqo'))
+        self.assertEqual([testutils.make_nquad(EG.s2, EG.p, EG.o2, EG.g)],
+                         testutils.get_lines(store.make_file_path(EG.s2) + '.nqo'))
+        # The graph manifest now lists only the shard of s2, so no other shard is read
+        stats = QuinceStats()
+        sink = QuinceBulkSink(QuinceStore(qdir(), stats=stats), replace_graph=str(EG.g))
+        sink.quad(EG.s3, EG.p, EG.o1, EG.g)
+        sink.close()
+        self.assertEqual(1, stats.files_read)
+        self.assertFalse(os.path.exists(store.make_file_path(EG.s2) + '.nqo'))
+
+    @testutils.with_rw_repo("HEAD")
+    def test_replace_graph_is_not_applied_when_a_file_fails(self, repo):
+        store = QuinceStore(qdir())
+        sink = QuinceBulkSink(store)
+        sink.quad(EG.s1, EG.p, EG.o1, EG.g)
+        sink.close()
+        with open('a.nt', 'w') as f:
+            f.write('<http://example.org/s2> <http://example.org/p> <http://example.org/o1> .\n')
+        with open('b.nt', 'w') as f:
+            f.write('not ntriples\n')
+        results = import_files(['a.nt', 'b.nt'], replace_graph=str(EG.g))
+        self.assertIsNone(results['a.nt'])
+        self.assertIsNotNone(results['b.nt'])
+        self.assertEqual([testutils.make_nquad(EG.s1, EG.p, EG.o1, EG.g)],
+                         testutils.get_lines(store.make_file_path(EG.s1) + '.nqo'))
+        self.assertFalse(os.path.exists(store.make_file_path(EG.s2) + '.nqo'))
+
+
+class ParallelImportTests(testutils.TestBase):
+
+    @testutils.with_rw_repo("HEAD")
+    def test_import_files_with_multiple_jobs(self, repo):
+        with open('a.nt', 'w') as f:
+            for i in range(20):
+                f.write('<http://example.org/s{0}> <http://example.org/p> <http://example.org/o> .\n'.format(i))
+        with open('b.nq', 'w') as f:
+            for i in range(20):
+                f.write('<http://example.org/s{0}> <http://example.org/p> "{0}" <http://example.org/g> .\n'.format(i))
+        with open('c.nt', 'w') as f:
+            f.write('not ntriples\n')
+        stats = QuinceStats()
+        results = import_files(['a.nt', 'b.nq', 'c.nt'], jobs=2, run_size=7, stats=stats)
+        # The file activity of the worker processes is reported
+        self.assertEqual(20, stats.files_created)
+        self.assertTrue(stats.bytes_written)
+        self.assertIsNone(results['a.nt'])
+        self.assertIsNone(results['b.nq'])
+        self.assertIsNotNone(results['c.nt'])
+        store = QuinceStore(qdir())
+        for i in range(20):
+            lines = testutils.get_lines(store.make_file_path(URIRef('http://example.org/s{0}'.format(i))) + '.nqo')
+            self.assertEqual([testutils.make_nquad(URIRef('http://example.org/s{0}'.format(i)), EG.p,
+                                                   Literal(str(i)), EG.g),
+                              testutils.make_nquad(URIRef('http://example.org/s{0}'.format(i)), EG.p,
+                                                   EG.o, DEFAULT_GRAPH)], lines)
+
+    @testutils.with_rw_repo("HEAD")
+    def test_import_files_updates_indexes(self, repo):
+        qindex.rebuild()
+        with open('a.nt', 'w') as f:
+            for i in range(20):
+                f.write('<http://example.org/s{0}> <http://example.org/p> <http://example.org/o> .\n'.format(i))
+        # More lines are imported than the run size, so the indexes are rebuilt rather than updated
+        import_files(['a.nt'], jobs=2, run_size=7)
+        store = QuinceStore(qdir())
+        self.assertEqual(20, len(list(store.indexes[INDEX_POS].lines(EG.p.n3(), EG.o.n3()))))
+
+    @testutils.with_store("HEAD")
+    def test_entry_maker_does_not_recover_journal(self, store):
+        journal_path = os.path.join(qdir(), FLUSH_JOURNAL)
+        with open(journal_path, 'w') as f:
+            f.write('')
+        entry_maker = QuinceStore.entry_maker(qdir())
+        self.assertTrue(os.path.exists(journal_path))
+        self.assertEqual(store.make_quad_entry(ALICE, FOAF_NAME, Literal('Alice')),
+                         entry_maker.make_quad_entry(ALICE, FOAF_NAME, Literal('Alice')))
+
+
+class MergeIntoFileTests(unittest.TestCase):
+
+    @testutils.with_working_dir()
+    def test_merge_into_new_file(self, root_path):
+        path = os.path.join(root_path, 'a', 'b.nqo')
+        self.assertTrue(merge_into_file(path, iter([b'a\n', b'c\n'])))
+        self.assertTrue(merge_into_file(path, iter([b'b\n', b'c\n'])))
+        self.assertFalse(merge_into_file(path, iter([b'a\n'])))
+        with open(path, 'rb') as f:
+            self.assertEqual(b'a\nb\nc\n', f.read())
+
+    @testutils.with_working_dir()
+    def test_merge_replacing_lines(self, root_path):
+        path = os.path.join(root_path, 'a.nqo')
+        merge_into_file(path, iter([b'a <g> .\n', b'b <h> .\n', b'c <g> .\n']))
+        self.assertFalse(merge_into_file(path, iter([b'b <h> .\n']), b' <h> .\n'))
+        self.assertTrue(merge_into_file(path, iter([b'c <g> .\n']), b' <g> .\n'))
+        with open(path, 'rb') as f:
+            self.assertEqual(b'b <h> .\nc <g> .\n', f.read())
+        self.assertTrue(merge_into_file(path, iter(()), (b' <g> .\n', b' <h> .\n')))
+        self.assertFalse(os.path.exists(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+__author__ = 'Kal Ahmed'
+
+import unittest
+
+from quince.core.cache import Cache, LRUCache, ClockCache, TwoQueueCache, make_cache, parse_size
+from quince.core.exceptions import QuinceArgumentException
+
+
+class CacheTestMixin:
+    cache_class = None
+
+    def make(self, capacity, max_bytes=None):
+        self.evicted = []
+        return self.cache_class(capacity, eviction_callback=lambda k, v: self.evicted.append(k),
+                                max_bytes=max_bytes, sizeof=len)
+
+    def test_capacity(self):
+        cache = self.make(3)
+        for key in 'abcdef':
+            cache.set(key, key)
+        self.assertEqual(3, len(cache))
+        self.assertEqual(3, len(self.evicted))
+        self.assertIn('f', cache)
+
+    def test_byte_budget(self):
+        cache = self.make(100, max_bytes=10)
+        cache.set('a', 'xxxx')
+        cache.set('b', 'xxxx')
+        self.assertEqual([], self.evicted)
+        cache.set('c', 'xxxx')
+        self.assertEqual(1, len(self.evicted))
+        self.assertEqual(8, cache.total_bytes)
+
+    def test_resize(self):
+        value = ['x']
+        cache = self.make(100, max_bytes=3)
+        cache.set('a', 'xx')
+        cache.set('b', value)
+        value.extend('xx')
+        cache.resize('b')
+        self.assertEqual(['a'], self.evicted)
+        self.assertEqual(3, cache.total_bytes)
+
+    def test_oversized_entry_is_kept(self):
+        cache = self.make(100, max_bytes=3)
+        cache.set('a', 'xxxxxx')
+        self.assertIn('a', cache)
+        self.assertEqual([], self.evicted)
+
+    def test_drop(self):
+        cache = self.make(100, max_bytes=10)
+        cache.set('a', 'xx')
+        cache.drop('a')
+        cache.drop('b')
+        self.assertNotIn('a', cache)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, cache.total_bytes)
+        self.assertEqual([], self.evicted)
+
+    def test_counters(self):
+        cache = self.make(1)
+        cache.set('a', 'x')
+        cache.get('a')
+        cache.get('b')
+        cache.set('b', 'x')
+        self.assertEqual((1, 1, 1), (cache.hits, cache.misses, cache.evictions))
+
+
+class LRUCacheTests(CacheTestMixin, unittest.TestCase):
+    cache_class = LRUCache
+
+    def test_evicts_least_recently_used(self):
+        cache = self.make(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(['b'], self.evicted)
+
+
+class ClockCacheTests(CacheTestMixin, unittest.TestCase):
+    cache_class = ClockCache
+
+    def test_referenced_entries_get_a_second_chance(self):
+        cache = self.make(3)
+        for key in 'abc':
+            cache.set(key, key)
+        cache.get('a')
+        cache.set('d', 'd')
+        cache.set('e', 'e')
+        self.assertEqual(['b', 'c'], self.evicted)
+
+
+class TwoQueueCacheTests(CacheTestMixin, unittest.TestCase):
+    cache_class = TwoQueueCache
+
+    def test_scan_does_not_evict_frequently_used_entries(self):
+        cache = self.make(8)
+        for key in 'ab':
+            cache.set(key, key)
+        # Push a and b out of the FIFO queue, then request them again so they enter the main queue
+        for i in range(8):
+            cache.set(i, i)
+        for key in 'ab':
+            self.assertIsNone(cache.get(key))
+            cache.set(key, key)
+        for i in range(100, 200):
+            cache.set(i, i)
+        self.assertIn('a', cache)
+        self.assertIn('b', cache)
+
+
+class MakeCacheTests(unittest.TestCase):
+    def test_make_cache(self):
+        self.assertIsInstance(make_cache('2Q', 10), TwoQueueCache)
+        self.assertRaises(QuinceArgumentException, make_cache, 'mru', 10)
+
+    def test_incomplete_policy_cannot_be_created(self):
+        class IncompleteCache(Cache):
+            def __contains__(self, key):
+                return False
+        self.assertRaises(TypeError, IncompleteCache, 10)
+
+    def test_parse_size(self):
+        self.assertEqual(512, parse_size('512'))
+        self.assertEqual(64 << 20, parse_size('64M'))
+        self.assertEqual(2 << 30, parse_size('2gb'))
+        self.assertRaises(QuinceArgumentException, parse_size, 'lots')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+__author__ = 'Kal Ahmed'
+
+import os
+import unittest
+
+from rdflib import Namespace, URIRef, Literal, RDF
+
+from quince.core.bulk import QuinceBulkSink
+from quince.core.index import QuinceIndex, split_terms, line_graph, INDEX_DIR, INDEX_POS, INDEX_OSP
+from quince.core import qindex
+from quince.core.repo import QuinceStore, GITIGNORE, NQOUT, qdir, git_add_files
+import testutils
+
+EG = Namespace('http://example.org/')
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+ALICE = URIRef('http://example.org/person/alice')
+BOB = URIRef('http://example.org/person/bob')
+
+
+class IndexLineTests(unittest.TestCase):
+    def test_split_terms(self):
+        self.assertEqual(['<s>', '<p>', '"a b"', '<g>'], split_terms('<s> <p> "a b" <g> .\n'))
+        self.assertEqual(['"a b"', '<s>', '<p>', '<g>'], split_terms('"a b" <s> <p> <g> .\n', 0))
+        self.assertEqual(['<p>', '"a b"', '<s>', '<g>'], split_terms('<p> "a b" <s> <g> .\n', 1))
+
+    @testutils.with_working_dir()
+    def test_index_lines(self, root_path):
+        line = '<s> <p> "a b c" <g> .\n'
+        for name, expected in ((INDEX_POS, '<p> "a b c" <s> <g> .\n'), (INDEX_OSP, '"a b c" <s> <p> <g> .\n')):
+            index = QuinceIndex(name, QuinceStore(os.path.join(root_path, name)))
+            file_path, index_line = index.entry(line)
+            self.assertEqual(expected, index_line)
+            self.assertEqual(line, index.to_quad_line(index_line))
+            index.add(line)
+            self.assertEqual([line], list(index.lines(split_terms(expected, index.object_position)[0])))
+
+
+class IndexTests(testutils.TestBase):
+
+    @testutils.with_store("HEAD")
+    def test_rebuild_indexes(self, store):
+        quads = sorted(store.all_quads(None))
+        self.assertEqual(len(quads), qindex.rebuild())
+        store = QuinceStore(qdir())
+        self.assertEqual(sorted(quads), sorted(store.all_quads(None)))
+        with open(os.path.join(qdir(), GITIGNORE)) as f:
+            self.assertIn('/{0}/\n'.format(INDEX_DIR), f.readlines())
+        typed = [q for q in quads if q.split(' ')[1] == RDF.type.n3()]
+        self.assertEqual(typed, sorted(store.indexes[INDEX_POS].lines(RDF.type.n3())))
+        bob = [q for q in quads if ' {0} '.format(BOB.n3()) in q]
+        self.assertEqual(bob, sorted(store.indexes[INDEX_OSP].lines(BOB.n3())))
+        self.assertEqual(bob, sorted(store.indexes[INDEX_POS].lines(FOAF.knows.n3(), BOB.n3())))
+
+    @testutils.with_store("HEAD")
+    def test_changes_update_indexes(self, store):
+        qindex.rebuild()
+        store = QuinceStore(qdir())
+        store.assert_quad(EG.s, FOAF.knows, BOB)
+        store.retract_quad(ALICE, FOAF.knows, BOB)
+        store.flush()
+        store = QuinceStore(qdir())
+        self.assertEqual([EG.s.n3()], [q.split(' ')[0] for q in store.indexes[INDEX_OSP].lines(BOB.n3())
+                                       if FOAF.knows.n3() in q])
+
+    @testutils.with_store("HEAD")
+    def test_update_from_git(self, store):
+        qindex.rebuild()
+        # Make changes that bypass the indexes
+        store = QuinceStore(qdir())
+        store.indexes = None
+        store.retract_quad(ALICE, FOAF.name, Literal('Alice'))
+        store.flush()
+        sink = QuinceBulkSink(store)
+        sink.quad(EG.s, FOAF.name, Literal('Alice'), None)
+        sink.close()
+        git_add_files()
+        store = QuinceStore(qdir())
+        self.assertEqual([ALICE.n3()], [q.split(' ')[0] for q in store.indexes[INDEX_OSP].lines('"Alice"')])
+
+        self.assertEqual(2, qindex.update())
+        store = QuinceStore(qdir())
+        self.assertEqual([EG.s.n3()], [q.split(' ')[0] for q in store.indexes[INDEX_OSP].lines('"Alice"')])
+        # Applying the same changes again makes no difference
+        qindex.update(since='HEAD')
+        store = QuinceStore(qdir())
+        self.assertEqual([EG.s.n3()], [q.split(' ')[0] for q in store.indexes[INDEX_OSP].lines('"Alice"')])
+
+    @testutils.with_store("HEAD")
+    def test_update_from_unsorted_shard(self, store):
+        qindex.rebuild()
+        # Lines appended out of order, as a merge or an edit by hand may leave them
+        names = [Literal(name) for name in ('Zoe', 'Mallory', 'Ann')]
+        lines = [store.make_nquad(ALICE, FOAF.nick, name, store.default_graph) for name in names]
+        with open(store.make_file_path_for_n3(ALICE.n3()) + NQOUT, 'a') as f:
+            f.writelines(lines)
+        self.assertEqual(3, qindex.update())
+        store = QuinceStore(qdir())
+        self.assertEqual(sorted(lines), sorted(store.indexes[INDEX_POS].lines(FOAF.nick.n3())))
+        self.assertEqual(sorted(lines), sorted(store.match('*', FOAF.nick, '*')))
+        self.assertEqual(sorted(lines), sorted(store.match(ALICE, FOAF.nick, '*')))
+
+    @testutils.with_store("HEAD")
+    def test_update_rebuilds_large_change_set(self, store):
+        qindex.rebuild()
+        store = QuinceStore(qdir())
+        store.indexes = None
+        for i in range(5):
+            store.assert_quad(EG.s, FOAF.nick, Literal(str(i)))
+        store.flush()
+        git_add_files()
+        quads = list(QuinceStore(qdir()).all_quads(None))
+        # A change set larger than the run size is applied by rebuilding the indexes
+        self.assertEqual(len(quads), qindex.update(run_size=4))
+        store = QuinceStore(qdir())
+        self.assertEqual(5, len(list(store.indexes[INDEX_POS].lines(FOAF.nick.n3()))))
+        self.assertEqual(5, qindex.update(since='HEAD', run_size=5))
+
+    @testutils.with_store("HEAD")
+    def test_update_without_indexes(self, store):
+        self.assertIsNone(qindex.update())
+
+
+class GraphManifestTests(testutils.TestBase):
+
+    @staticmethod
+    def shards_by_graph(store):
+        shards = {}
+        for file_path in store._walk_quad_files():
+            for line in store.update_manager.iter_lines(file_path):
+                shards.setdefault(line_graph(line), set()).add(store.shard_key(file_path))
+        return shards
+
+    @testutils.with_store("HEAD")
+    def test_rebuild_graph_manifest(self, store):
+        quads = list(store.all_quads(None))
+        qindex.rebuild()
+        store = QuinceStore(qdir())
+        expected = self.shards_by_graph(store)
+        self.assertTrue(expected)
+        for graph, shards in expected.items():
+            self.assertEqual(shards, set(store.graph_manifest.shards(graph)))
+            self.assertEqual(sorted(q for q in quads if line_graph(q) == graph), sorted(store.all_quads([graph])))
+        self.assertEqual([], list(store.all_quads([EG.g.n3()])))
+
+    @testutils.with_store("HEAD")
+    def test_changes_update_graph_manifest(self, store):
+        qindex.rebuild()
+        store = QuinceStore(qdir())
+        store.assert_quad(EG.s, EG.p, EG.o, EG.g)
+        store.assert_quad(EG.s, EG.p, EG.o2, EG.g)
+        store.flush()
+        store = QuinceStore(qdir())
+        shard = store.shard_key(store.make_file_path(EG.s) + '.nqo')
+        self.assertEqual([shard], list(store.graph_manifest.shards(EG.g.n3())))
+        self.assertEqual(2, len(list(store.all_quads([EG.g.n3()]))))
+        # The shard still holds a quad in the graph
+        store.retract_quad(EG.s, EG.p, EG.o, EG.g)
+        store.flush()
+        store = QuinceStore(qdir())
+        self.assertEqual([shard], list(store.graph_manifest.shards(EG.g.n3())))
+        store.retract_quad(EG.s, EG.p, EG.o2, EG.g)
+        store.flush()
+        store = QuinceStore(qdir())
+        self.assertEqual([], list(store.graph_manifest.shards(EG.g.n3())))
+        self.assertEqual([], list(store.all_quads([EG.g.n3()])))
+
+    @testutils.with_store("HEAD")
+    def test_update_graph_manifest_from_git(self, store):
+        qindex.rebuild()
+        store = QuinceStore(qdir())
+        store.indexes = None
+        store.assert_quad(EG.s, EG.p, EG.o, EG.g)
+        store.flush()
+        git_add_files()
+        self.assertEqual([], list(QuinceStore(qdir()).all_quads([EG.g.n3()])))
+        qindex.update()
+        store = QuinceStore(qdir())
+        self.assertEqual(1, len(list(store.all_quads([EG.g.n3()]))))
@@ -0,0 +1,81 @@
+__author__ = 'Kal Ahmed'
+
+import configparser
+import os
+import unittest
+
+from rdflib import Namespace
+
+from quince.core.layout import ShardLayout, FlatLayout, NestedLayout, BucketLayout, make_layout, layout_from_config
+from quince.core.qreshard import reshard
+from quince.core.repo import QuinceStore, qdir
+from quince.core.exceptions import QuinceArgumentException
+import testutils
+
+EG = Namespace('http://example.org/')
+HASH = '0123456789abcdef0123456789abcdef01234567'
+
+
+class LayoutTests(unittest.TestCase):
+    def test_file_paths(self):
+        self.assertEqual(os.path.join('01', HASH), FlatLayout().file_path(HASH))
+        self.assertEqual(os.path.join('01', '0123', HASH), NestedLayout().file_path(HASH))
+        self.assertEqual(os.path.join('de', 'def'), BucketLayout().file_path(HASH))
+        self.assertEqual(os.path.join('0f', '0f'), BucketLayout(16).file_path(HASH))
+
+    def test_layout_from_config(self):
+        config = configparser.ConfigParser()
+        self.assertEqual(FlatLayout(), layout_from_config(config))
+        config.read_string('[Store]\nlayout = bucket\nbuckets = 100\n')
+        self.assertEqual(BucketLayout(100), layout_from_config(config))
+        self.assertNotEqual(BucketLayout(), layout_from_config(config))
+
+    def test_unknown_layout(self):
+        self.assertRaises(QuinceArgumentException, make_layout, 'spiral')
+
+    def test_incomplete_layout_cannot_be_created(self):
+        class IncompleteLayout(ShardLayout):
+            name = 'incomplete'
+        self.assertRaises(TypeError, IncompleteLayout)
+
+
+class ReshardTests(testutils.TestBase):
+
+    @testutils.with_store("HEAD")
+    def test_reshard(self, store):
+        quads = sorted(store.all_quads(None))
+        for layout in (NestedLayout(), BucketLayout(8), FlatLayout()):
+            reshard(layout)
+            resharded = QuinceStore(qdir())
+            self.assertEqual(layout, resharded.layout)
+            self.assertEqual(quads, sorted(resharded.all_quads(None)))
+            paths = set(os.path.join(d, f) for d, _, files in os.walk(qdir()) for f in files if f.endswith('.nqo'))
+            self.assertEqual(paths, set(resharded._iterate_quad_files()))
+            if isinstance(layout, BucketLayout):
+                self.assertLessEqual(len(paths), 8)
+
+    @testutils.with_store("HEAD")
+    def test_reshard_keeps_other_store_options(self, store):
+        with open(os.path.join(qdir(), 'config'), 'a') as f:
+            f.write('\n[Store]\nsplit_size = 1K\n')
+        reshard(BucketLayout(8))
+        reshard(FlatLayout())
+        store = QuinceStore(qdir())
+        self.assertEqual(FlatLayout(), store.layout)
+        self.assertEqual(1024, store.split_size)
+        self.assertNotIn('buckets', store.config['Store'])
+
+    @testutils.with_store("HEAD")
+    def test_store_uses_configured_layout(self, store):
+        store.set_layout(NestedLayout())
+        store = QuinceStore(qdir())
+        store.assert_quad(EG.s, EG.p, EG.o)
+        store.flush()
+        path = os.path.relpath(store.make_file_path(EG.s), store.root)
+        self.assertEqual(3, len(path.split(os.sep)))
+        self.assertTrue(os.path.exists(os.path.join(store.root, path + '.nqo')))
+        self.assertTrue(list(QuinceStore(qdir()).exists(EG.s, EG.p, EG.o)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,22 @@
 __author__ = 'Kal Ahmed'
 
+import bz2
+import gzip
 import hashlib
+import io
+import lzma
 import unittest
 from unittest.mock import Mock, MagicMock
 import os
 import os.path
 
 from rdflib.plugins.parsers.ntriples import NTriplesParser
-from quince.core.parsers import NQuadsParser, get_parser
-from rdflib import Namespace, URIRef, Literal
-from quince.core.repo import QUINCE_DEFAULT_GRAPH_IRI, QuinceTripleSink, RdflibGraphAdapter
+from quince.core.parsers import NQuadsParser, RawNQuadsParser, get_parser, decompressing_reader
+from rdflib import Namespace, URIRef, Literal, BNode, RDF, XSD
+from rdflib.plugins.parsers.ntriples import ParseError
+from quince.core.qimport import import_file
+from quince.core.repo import QUINCE_DEFAULT_GRAPH_IRI, QuinceTripleSink, RdflibGraphAdapter, QuinceStore, qdir
+from quince.core.turtle import TurtleParser, TriGParser
 
 import testutils
 
@@ -50,5 +57,190 @@ class QuinceParserTests(unittest.TestCase):
         self.assertIsNotNone(p)
         self.assertIsInstance(p, NTriplesParser)
 
+    def test_guess_format_raw(self):
+        sink = Mock()
+        self.assertIsInstance(get_parser('test.nq', sink, raw=True), RawNQuadsParser)
+        self.assertIsInstance(get_parser('test.nt', sink, raw=True), RawNQuadsParser)
+
+    def test_guess_format_ignores_compression_extension(self):
+        sink = Mock()
+        self.assertIsInstance(get_parser('test.nq.gz', sink), NQuadsParser)
+        self.assertIsInstance(get_parser('test.nt.bz2', sink), NTriplesParser)
+        self.assertIsInstance(get_parser('test.nq.XZ', sink), NQuadsParser)
+
+    def test_explicit_format(self):
+        sink = Mock()
+        self.assertIsInstance(get_parser('-', sink, fmt='nquads'), NQuadsParser)
+        self.assertIsInstance(get_parser('test.nq', sink, fmt='ntriples'), NTriplesParser)
+        self.assertIsNone(get_parser('-', sink))
+
+    def test_guess_turtle_and_trig_format(self):
+        sink = Mock()
+        self.assertIsInstance(get_parser('test.ttl', sink), TurtleParser)
+        self.assertIsInstance(get_parser('test.trig.gz', sink), TriGParser)
+
+
+class QuadRecordingSink:
+    def __init__(self):
+        self.quads = []
+
+    def quad(self, s, p, o, g):
+        self.quads.append((s, p, o, g))
+
+
+class TurtleParserTests(unittest.TestCase):
+    TURTLE = '''@prefix ex: <http://example.org/> .
+@base <http://example.org/base/> .
+PREFIX foaf: <http://xmlns.com/foaf/0.1/>
+ex:s a foaf:Person ; foaf:name "Alice"@en, 'Al' ;
+    foaf:knows [ foaf:name \"\"\"Bob
+"the" builder\"\"\" ; ex:age 42 ], <carol> ;
+    ex:list ( 1 2.5 true ) ;
+    ex:esc "a\\tb\\u00e9" ; ex:dt "x"^^ex:type ; .
+_:b1 ex:p _:b1 .
+'''
+
+    def parse(self, parser_class, data, chunk_size):
+        sink = QuadRecordingSink()
+        parser_class(sink, chunk_size=chunk_size).parse(io.BytesIO(data.encode('utf-8')))
+        return sink.quads
+
+    def test_parse_turtle(self):
+        quads = self.parse(TurtleParser, self.TURTLE, 1024)
+        self.assertEqual(17, len(quads))
+        self.assertIn((NS.s, RDF.type, URIRef('http://xmlns.com/foaf/0.1/Person'), None), quads)
+        self.assertIn((NS.s, URIRef('http://xmlns.com/foaf/0.1/name'), Literal('Alice', lang='en'), None), quads)
+        self.assertIn((NS.s, URIRef('http://xmlns.com/foaf/0.1/knows'), URIRef('http://example.org/base/carol'),
+                       None), quads)
+        self.assertIn((NS.s, NS.esc, Literal('a\tb\u00e9'), None), quads)
+        self.assertIn((NS.s, NS.dt, Literal('x', datatype=NS.type), None), quads)
+        bob = [q for q in quads if q[2] == Literal('Bob\n"the" builder')]
+        self.assertEqual(1, len(bob))
+        self.assertIsInstance(bob[0][0], BNode)
+        self.assertIn((bob[0][0], NS.age, Literal('42', datatype=XSD.integer), None), quads)
+        self.assertEqual(3, len([q for q in quads if q[1] == RDF.first]))
+        self.assertIn((quads[-1][0], NS.p, quads[-1][0], None), quads)
+
+    def test_parse_turtle_across_chunk_boundaries(self):
+        expected = self.parse(TurtleParser, self.TURTLE, 1024)
+        for chunk_size in (1, 3, 7):
+            quads = self.parse(TurtleParser, self.TURTLE, chunk_size)
+            self.assertEqual(self.without_bnodes(expected), self.without_bnodes(quads))
+
+    @staticmethod
+    def without_bnodes(quads):
+        return [tuple(None if isinstance(t, BNode) else t for t in q) for q in quads]
+
+    def test_undefined_prefix(self):
+        with self.assertRaises(ParseError):
+            self.parse(TurtleParser, 'ex:s ex:p ex:o .', 1024)
+
+    def test_invalid_input_is_rejected_without_reading_to_the_end(self):
+        data = io.BytesIO(('@prefix ex: <http://example.org/> .\n\x01 ex:s ex:p ex:o .\n' +
+                           'ex:s ex:p ex:o .\n' * 10000).encode('utf-8'))
+        with self.assertRaises(ParseError):
+            TurtleParser(QuadRecordingSink(), chunk_size=64).parse(data)
+        self.assertLess(data.tell(), 1024)
+
+    def test_long_tokens_across_chunk_boundaries(self):
+        long_iri = 'http://example.org/' + 'x' * 200
+        quads = self.parse(TurtleParser, '@prefix \u00e9' + 'e' * 20 + ': <http://example.org/> .\n' +
+                           '<{0}> \u00e9{1}:p "{2}" .\n'.format(long_iri, 'e' * 20, 'y' * 200), 4)
+        self.assertEqual([(URIRef(long_iri), NS.p, Literal('y' * 200), None)], quads)
+
+    def test_parse_trig(self):
+        trig = '''@prefix ex: <http://example.org/> .
+ex:g1 { ex:s ex:p ex:o . ex:s ex:p ex:o2 }
+GRAPH ex:g2 { ex:s ex:p "x" }
+{ ex:s ex:p ex:o3 . }
+ex:s ex:p ex:o4 .
+'''
+        self.assertEqual([(NS.s, NS.p, NS.o, NS.g1),
+                          (NS.s, NS.p, NS.o2, NS.g1),
+                          (NS.s, NS.p, Literal('x'), NS.g2),
+                          (NS.s, NS.p, NS.o3, None),
+                          (NS.s, NS.p, NS.o4, None)], self.parse(TriGParser, trig, 4))
+
+
+class TurtleImportTests(testutils.TestBase):
+
+    @testutils.with_rw_repo("HEAD")
+    def test_import_turtle_and_trig(self, repo):
+        with open('data.ttl', 'w') as f:
+            f.write('@prefix ex: <http://example.org/> .\nex:s ex:p "turtle" ; ex:q ex:o .\n')
+        with open('data.trig', 'w') as f:
+            f.write('@prefix ex: <http://example.org/> .\nex:g { ex:s ex:p "trig" }\n')
+        import_file('data.ttl')
+        import_file('data.trig')
+        store = QuinceStore(qdir())
+        default_graph = URIRef(QUINCE_DEFAULT_GRAPH_IRI)
+        self.assertEqual(sorted([testutils.make_nquad(NS.s, NS.p, Literal('turtle'), default_graph),
+                                 testutils.make_nquad(NS.s, NS.q, NS.o, default_graph),
+                                 testutils.make_nquad(NS.s, NS.p, Literal('trig'), NS.g)]),
+                         sorted(store.match(NS.s, '*', '*')))
+
+
+class DecompressingReaderTests(unittest.TestCase):
+    DATA = b'<http://example.org/s> <http://example.org/p> <http://example.org/o> .\n' * 100
+
+    def test_decompress_by_extension(self):
+        for ext, module in [('.gz', gzip), ('.bz2', bz2), ('.xz', lzma)]:
+            reader = decompressing_reader(io.BytesIO(module.compress(self.DATA)), 'test.nt' + ext)
+            self.assertEqual(self.DATA, reader.read())
+
+    def test_decompress_by_magic_number(self):
+        for module in [gzip, bz2, lzma]:
+            reader = decompressing_reader(io.BytesIO(module.compress(self.DATA)))
+            self.assertEqual(self.DATA, reader.read())
+
+    def test_uncompressed_stream(self):
+        self.assertEqual(self.DATA, decompressing_reader(io.BytesIO(self.DATA), 'test.nt').read())
+        self.assertEqual(self.DATA, decompressing_reader(io.BytesIO(self.DATA)).read())
+
+
+class EntryRecordingSink:
+    def __init__(self, store):
+        self.store = store
+        self.entries = []
+
+    def quad(self, s, p, o, g):
+        self.entries.append(self.store.make_quad_entry(s, p, o, g))
+
+    def raw_quad(self, s, p, o, g):
+        self.entries.append(self.store.make_raw_quad_entry(s, p, o, g))
+
+
+class RawNQuadsParserTests(unittest.TestCase):
+    DATA = '\n'.join([
+        r'<http://example.org/s> <http://example.org/p> <http://example.org/o> <http://example.org/g> .',
+        r'<http://example.org/s> <http://example.org/p> "hello" .',
+        r'<http://example.org/s>  <http://example.org/p>   "h\u00e9llo \"world\"\t"@en-GB .  # comment',
+        r'<http://example.org/s> <http://example.org/p> "caf\u00E9" <http://example.org/g> .',
+        r'<http://example.org/s\u00e9> <http://example.org/p> "01"^^<http://www.w3.org/2001/XMLSchema#integer> .',
+        r'<http://example.org/s> <http://example.org/p> "x"^^<http://example.org/type> .',
+        r'# comment',
+        r'',
+        r'<http://example.org/s> <http://example.org/p> _:b1 .',
+    ]).encode('utf-8')
+
+    def setUp(self):
+        self.store = QuinceStore('store')
+
+    def test_raw_parse_matches_rdflib_parse(self):
+        raw_sink = EntryRecordingSink(self.store)
+        RawNQuadsParser(raw_sink).parse(io.BytesIO(self.DATA))
+        rdflib_sink = EntryRecordingSink(self.store)
+        NQuadsParser(rdflib_sink).parse(io.BytesIO(self.DATA))
+        self.assertEqual(7, len(raw_sink.entries))
+        self.assertEqual(rdflib_sink.entries[:6], raw_sink.entries[:6])
+
+    def test_raw_parse_uses_raw_quad(self):
+        sink = Mock()
+        RawNQuadsParser(sink).parse(io.BytesIO(self.DATA[:self.DATA.index(b'\n')]))
+        sink.raw_quad.assert_called_with('<http://example.org/s>', '<http://example.org/p>',
+                                         '<http://example.org/o>', '<http://example.org/g>')
+        self.assertFalse(sink.quad.called)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,59 @@
+__author__ = 'Kal Ahmed'
+
+import unittest
+
+from rdflib import Namespace, URIRef, Literal
+
+from quince.core.qbatch import apply_batch, parse_operations, ASSERT, RETRACT
+from quince.core.repo import QuinceStore, QUINCE_DEFAULT_GRAPH_IRI, qdir
+from quince.core.exceptions import QuinceMultiException
+import testutils
+
+EG = Namespace('http://example.org/')
+DEFAULT_GRAPH = URIRef(QUINCE_DEFAULT_GRAPH_IRI)
+
+
+class ParseOperationTests(unittest.TestCase):
+
+    def test_parse_assert_and_retract(self):
+        ops = parse_operations(['assert [eg:s] <http://example.org/p> "a\\tb"@en',
+                                '',
+                                '# comment',
+                                '+<http://example.org/s> <http://example.org/p> "1"^^<http://example.org/t> '
+                                '<http://example.org/g> .',
+                                'retract [eg:s] *',
+                                '- <http://example.org/s> <http://example.org/p> <http://example.org/o>'],
+                               {'eg': 'http://example.org/'})
+        self.assertEqual([(ASSERT, (EG.s, EG.p, Literal('a\tb', lang='en'), DEFAULT_GRAPH)),
+                          (ASSERT, (EG.s, EG.p, Literal('1', datatype=EG.t), EG.g)),
+                          (RETRACT, (EG.s, '*', '*', DEFAULT_GRAPH)),
+                          (RETRACT, (EG.s, EG.p, EG.o, DEFAULT_GRAPH))], ops)
+
+    def test_invalid_lines_are_reported(self):
+        with self.assertRaises(QuinceMultiException) as cm:
+            parse_operations(['+ <http://example.org/s> <http://example.org/p>',
+                              '+ <http://example.org/s> * <http://example.org/o>',
+                              '? <http://example.org/s>'], {})
+        self.assertEqual(3, len(cm.exception.inner_exceptions))
+        self.assertTrue(cm.exception.inner_exceptions[0].message.startswith('Line 1:'))
+
+
+class ApplyBatchTests(testutils.TestBase):
+
+    @testutils.with_rw_repo("HEAD")
+    def test_apply_batch(self, repo):
+        asserted, retracted = apply_batch(['+ <http://example.org/s> <http://example.org/p> <http://example.org/o1>',
+                                           '+ <http://example.org/s> <http://example.org/p> <http://example.org/o2>',
+                                           '- <http://example.org/s> <http://example.org/p> <http://example.org/o1>',
+                                           '+ <http://example.org/t> <http://example.org/p> "x"'])
+        self.assertEqual(3, asserted)
+        self.assertEqual([testutils.make_nquad(EG.s, EG.p, EG.o1, DEFAULT_GRAPH)], retracted)
+        store = QuinceStore(qdir())
+        self.assertEqual([testutils.make_nquad(EG.s, EG.p, EG.o2, DEFAULT_GRAPH)],
+                         testutils.get_lines(store.make_file_path(EG.s) + '.nqo'))
+        self.assertEqual([testutils.make_nquad(EG.t, EG.p, Literal('x'), DEFAULT_GRAPH)],
+                         testutils.get_lines(store.make_file_path(EG.t) + '.nqo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
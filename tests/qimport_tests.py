@@ -0,0 +1,99 @@
+__author__ = 'Kal Ahmed'
+
+import functools
+import gzip
+import http.server
+import os
+import threading
+import unittest
+
+from rdflib import URIRef
+
+from quince.core.download import ConnectionPool
+from quince.core.exceptions import QuinceParseException
+from quince.core.qimport import import_urls, QUEUE_BATCH_SIZE
+from quince.core.repo import QuinceStore, qdir
+import testutils
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpServerMixin:
+
+    def start_server(self, directory):
+        handler = functools.partial(_QuietHandler, directory=directory)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        return 'http://127.0.0.1:{0}/'.format(self.server.server_address[1])
+
+
+class ImportUrlsTests(HttpServerMixin, testutils.TestBase):
+
+    @testutils.with_rw_repo("HEAD")
+    def test_import_urls(self, repo):
+        os.makedirs('www')
+        for i in range(6):
+            with open(os.path.join('www', 'data{0}.nt'.format(i)), 'w') as f:
+                f.write('<http://example.org/s{0}> <http://example.org/p> <http://example.org/o> .\n'.format(i))
+        with gzip.open(os.path.join('www', 'data6.nt.gz'), 'wt') as f:
+            f.write('<http://example.org/s6> <http://example.org/p> <http://example.org/o> .\n')
+        base = self.start_server(os.path.abspath('www'))
+        urls = [base + 'data{0}.nt'.format(i) for i in range(6)] + [base + 'data6.nt.gz', base + 'missing.nt']
+        results = import_urls(urls, connections=2)
+        for url in urls[:-1]:
+            self.assertIsNone(results[url])
+        self.assertIsNotNone(results[base + 'missing.nt'])
+        store = QuinceStore(qdir())
+        for i in range(7):
+            path = store.make_file_path(URIRef('http://example.org/s{0}'.format(i))) + '.nqo'
+            self.assertTrue(os.path.exists(path))
+
+    @testutils.with_rw_repo("HEAD")
+    def test_failed_url_is_not_applied(self, repo):
+        os.makedirs('www')
+        with open(os.path.join('www', 'good.nt'), 'w') as f:
+            f.write('<http://example.org/good> <http://example.org/p> <http://example.org/o> .\n')
+        # More lines than are passed to the writer at a time, so some reach it before the parse fails
+        with open(os.path.join('www', 'bad.nt'), 'w') as f:
+            for i in range(QUEUE_BATCH_SIZE * 3):
+                f.write('<http://example.org/s{0}> <http://example.org/p> <http://example.org/o> .\n'.format(i))
+            f.write('not ntriples\n')
+        base = self.start_server(os.path.abspath('www'))
+        results = import_urls([base + 'bad.nt', base + 'good.nt'], connections=2)
+        self.assertIsInstance(results[base + 'bad.nt'], QuinceParseException)
+        self.assertIsNone(results[base + 'good.nt'])
+        store = QuinceStore(qdir())
+        self.assertTrue(os.path.exists(store.make_file_path(URIRef('http://example.org/good')) + '.nqo'))
+        self.assertEqual([], list(store.match(URIRef('http://example.org/s0'), '*', '*')))
+
+
+class ConnectionPoolTests(HttpServerMixin, unittest.TestCase):
+
+    @testutils.with_working_dir()
+    def test_connections_are_reused(self, root_path):
+        with open('a.txt', 'w') as f:
+            f.write('hello')
+        base = self.start_server(root_path)
+        pool = ConnectionPool()
+        try:
+            for _ in range(3):
+                with pool.urlopen(base + 'a.txt') as response:
+                    self.assertEqual(b'hello', response.read())
+            self.assertEqual(1, pool.connections_created)
+            with self.assertRaises(IOError):
+                with pool.urlopen(base + 'b.txt'):
+                    pass
+        finally:
+            pool.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+__author__ = 'Kal Ahmed'
+
+from rdflib import Namespace, URIRef, Literal, RDF
+
+from quince.core import qindex, qmatch
+from quince.core.exceptions import QuinceMultiException
+from quince.core.index import split_terms
+from quince.core.repo import QuinceStore, QUINCE_DEFAULT_GRAPH_IRI, qdir
+import testutils
+
+EG = Namespace('http://example.org/')
+FOAF = Namespace('http://xmlns.com/foaf/0.1/')
+BOB = URIRef('http://example.org/person/bob')
+DEFAULT_GRAPH = URIRef(QUINCE_DEFAULT_GRAPH_IRI)
+
+
+class MatchTests(testutils.TestBase):
+
+    PATTERNS = [
+        (BOB, '*', '*', '*'),
+        (BOB, FOAF.name, '*', '*'),
+        (BOB, FOAF.name, Literal('Bob'), DEFAULT_GRAPH),
+        ('*', RDF.type, '*', '*'),
+        ('*', FOAF.knows, BOB, '*'),
+        ('*', '*', BOB, '*'),
+        ('*', '*', '*', DEFAULT_GRAPH),
+        ('*', '*', Literal('Bob'), EG.g),
+        ('*', '*', '*', '*'),
+    ]
+
+    @staticmethod
+    def expected(store, pattern):
+        terms = [t if t == '*' else store.make_n3(t) for t in pattern]
+        return sorted(q for q in store.all_quads(None)
+                      if all(t == '*' or t == q_t for t, q_t in zip(terms, split_terms(q))))
+
+    def assert_matches(self, store):
+        for pattern in self.PATTERNS:
+            self.assertEqual(self.expected(store, pattern), sorted(store.match(*pattern)), pattern)
+
+    @testutils.with_store("HEAD")
+    def test_match_without_indexes(self, store):
+        store.assert_quad(EG.s, FOAF.name, Literal('Bob'), EG.g)
+        self.assertEqual(1, len(list(store.match(BOB, FOAF.name, Literal('Bob'), DEFAULT_GRAPH))))
+        self.assert_matches(store)
+
+    @testutils.with_store("HEAD")
+    def test_match_with_indexes(self, store):
+        qindex.rebuild()
+        store = QuinceStore(qdir())
+        store.assert_quad(EG.s, FOAF.name, Literal('Bob'), EG.g)
+        store.flush()
+        store = QuinceStore(qdir())
+        self.assertEqual(1, len(list(store.match('*', '*', Literal('Bob'), EG.g))))
+        self.assert_matches(store)
+
+    @testutils.with_store("HEAD")
+    def test_match_command_terms(self, store):
+        store.add_namespace('foaf', str(FOAF))
+        lines = list(qmatch.match('*', '[foaf:knows]', BOB, '*'))
+        self.assertEqual(self.expected(store, ('*', FOAF.knows, BOB, '*')), sorted(lines))
+        self.assertTrue(lines)
+        with self.assertRaises(QuinceMultiException):
+            list(qmatch.match('not an iri', '*', '*', '*'))
@@ -5,11 +5,16 @@ import hashlib
 import os
 import re
 import unittest
+from unittest import mock
 
 from rdflib import Namespace, URIRef, Literal
 
-from quince.core.repo import QuinceStore, QUINCE_DEFAULT_GRAPH_IRI, LRUCache, init, FileEntry
+from quince.core.repo import QuinceStore, QUINCE_DEFAULT_GRAPH_IRI, LRUCache, init, FileEntry, SortedSet, \
+    CachingFileManager, FlushJournal, qdir
+from quince.core.cache import TwoQueueCache
+from quince.core.stats import QuinceStats
 import quince.core.exceptions as quince_exceptions
+from quince.cli import quince as quince_cli
 import testutils
 
 EG = Namespace('http://example.org/')
@@ -78,6 +83,50 @@ class QuinceStoreTests(StoreTestsBase):
         self.assertIn(testutils.make_nquad(EG.s2, EG.p1, EG.o1, StoreTestsBase.DEFAULT_GRAPH), s2_out_lines)
         self.assertIn(testutils.make_nquad(EG.s2, EG.p1, EG.o2, StoreTestsBase.DEFAULT_GRAPH), s2_out_lines)
 
+    @testutils.with_store("HEAD")
+    def test_assert_and_retract_quads(self, store):
+        store.assert_quads([(EG.s3, EG.p1, EG.o2, None), (EG.s4, EG.p1, EG.o1, EG.g1),
+                            (EG.s3, EG.p1, EG.o1, None), (EG.s3, EG.p1, EG.o1, None)])
+        store.flush()
+        s3_out = self.assert_file_for_subject(store, EG.s3.n3())
+        self.assertEqual([testutils.make_nquad(EG.s3, EG.p1, EG.o1, StoreTestsBase.DEFAULT_GRAPH),
+                          testutils.make_nquad(EG.s3, EG.p1, EG.o2, StoreTestsBase.DEFAULT_GRAPH)],
+                         testutils.get_lines(s3_out))
+        retracted = store.retract_quads([(EG.s3, '*', EG.o1, None), (EG.s4, EG.p1, EG.o1, EG.g1),
+                                         ('*', EG.p1, EG.o2, '*')])
+        store.flush()
+        self.assertEqual(3, len(retracted))
+        self.assertFalse(os.path.exists(s3_out))
+        self.assertFalse(os.path.exists(self.get_file_path(store, EG.s4.n3()) + '.nqo'))
+
+    @testutils.with_store("HEAD")
+    def test_cache_configuration(self, store):
+        with open(os.path.join(store.root, 'config'), 'a') as f:
+            f.write('\n[Cache]\npolicy = 2q\nmax_entries = 50\nmax_bytes = 1M\n')
+        cache = QuinceStore(store.root).update_manager.cache
+        self.assertIsInstance(cache, TwoQueueCache)
+        self.assertEqual(50, cache.capacity)
+        self.assertEqual(1 << 20, cache.max_bytes)
+
+    @testutils.with_store("HEAD")
+    def test_stats(self, store):
+        stats = QuinceStats()
+        store = QuinceStore(store.root, stats=stats)
+        store.assert_quad(EG['s'], EG['p'], EG['o'], None)
+        store.assert_quad(EG['s'], EG['p'], EG['o2'], None)
+        store.flush()
+        self.assertEqual((1, 1, 0), (stats.cache_hits, stats.cache_misses, stats.files_read))
+        self.assertEqual((1, 1), (stats.files_written, stats.files_created))
+        self.assertEqual(os.path.getsize(store.make_file_path(EG['s']) + '.nqo'), stats.bytes_written)
+        stats = QuinceStats()
+        store = QuinceStore(store.root, stats=stats)
+        store.retract_quad(EG['s'], EG['p'], EG['o'], None)
+        store.retract_quad(EG['s'], EG['p'], EG['o2'], None)
+        store.flush()
+        self.assertEqual((1, 0), (stats.files_read, stats.bytes_written))
+        self.assertEqual((0, 1), (stats.files_written, stats.files_deleted))
+        self.assertGreater(stats.bytes_read, 0)
+
     @testutils.with_store("HEAD")
     def test_add_namespace(self, store):
         store.add_namespace('eg', 'http://example.org/')
@@ -176,6 +225,334 @@ class MatchQuadTests(StoreTestsBase):
         self.assertEqual(2, len(removed))
 
 
+class DirtyTrackingTests(StoreTestsBase):
+
+    @testutils.with_store("HEAD")
+    def test_reads_do_not_write_files(self, store):
+        store.assert_quad(EG.s1, EG.p1, EG.o1)
+        store.flush()
+        s1_out = self.assert_file_for_subject(store, EG.s1.n3())
+        os.utime(s1_out, (0, 0))
+        store.update_manager = CachingFileManager(10)
+        self.assertEqual(1, len(list(store.exists(EG.s1, EG.p1, EG.o1))))
+        self.assertEqual(0, len(list(store.exists(EG.s2, EG.p1, EG.o1))))
+        store.assert_quad(EG.s1, EG.p1, EG.o1)
+        store.flush()
+        self.assertEqual(0, os.stat(s1_out).st_mtime)
+        self.assertFalse(os.path.exists(self.get_file_path(store, EG.s2.n3()) + '.nqo'))
+
+    @testutils.with_working_dir()
+    def test_unsorted_file_is_dirty(self, root_path):
+        path = os.path.join(root_path, 'a.nqo')
+        with open(path, 'w') as f:
+            f.write('b\na\na')
+        entry = FileEntry(path)
+        entry.load()
+        self.assertTrue(entry.dirty)
+        entry.flush()
+        self.assertFalse(entry.dirty)
+        self.assertEqual(['a\n', 'b\n'], testutils.get_lines(path))
+        self.assertFalse(FileEntry(path).dirty)
+
+
+class MappedFileEntryTests(unittest.TestCase):
+
+    @testutils.with_working_dir()
+    def test_lookups_do_not_load_entry(self, root_path):
+        path = os.path.join(root_path, 'a.nqo')
+        lines = sorted('<a> <p{0:03d}> "{1}" <g> .\n'.format(i // 3, i) for i in range(300))
+        with open(path, 'w') as f:
+            f.writelines(lines)
+        entry = FileEntry(path)
+        for line in lines:
+            self.assertIn(line, entry)
+        self.assertNotIn('<a> <p010> "0" <g> .\n', entry)
+        self.assertNotIn('<b>\n', entry)
+        self.assertEqual([l for l in lines if l.startswith('<a> <p010> ')], list(entry.with_prefix('<a> <p010> ')))
+        self.assertEqual([], list(entry.with_prefix('<a> <q')))
+        self.assertEqual(lines, list(iter(entry)))
+        self.assertFalse(entry.loaded)
+        self.assertEqual(FileEntry.ENTRY_OVERHEAD, entry.size_estimate())
+        entry.insert('<a> <p010> "new" <g> .\n')
+        self.assertTrue(entry.loaded)
+        self.assertTrue(entry.dirty)
+        self.assertEqual(301, len(entry))
+        self.assertEqual(4, len(list(entry.with_prefix('<a> <p010> '))))
+
+    @testutils.with_working_dir()
+    def test_last_line_without_line_ending(self, root_path):
+        path = os.path.join(root_path, 'a.nqo')
+        with open(path, 'w') as f:
+            f.write('a\nb')
+        entry = FileEntry(path)
+        self.assertIn('b\n', entry)
+        self.assertEqual(['a\n', 'b\n'], list(entry))
+
+    @testutils.with_working_dir()
+    def test_unmapped_file_bytes_are_counted(self, root_path):
+        path = os.path.join(root_path, 'a.nqo')
+        lines = ['<a> <p> "{0}" <g> .\n'.format(i) for i in range(10)]
+        with open(path, 'w') as f:
+            f.writelines(lines)
+        with mock.patch('mmap.mmap', side_effect=OSError('no more mappings')):
+            entry = FileEntry(path)
+        self.assertIn(lines[3], entry)
+        self.assertEqual(FileEntry.ENTRY_OVERHEAD + sum(map(len, lines)), entry.size_estimate())
+
+
+class SmallBlockFileEntry(FileEntry):
+    LOAD = 2
+
+
+class PackedFileEntryTests(unittest.TestCase):
+
+    @testutils.with_working_dir()
+    def test_packed_entry_writes_same_bytes(self, root_path):
+        path = os.path.join(root_path, 'a.nqo')
+        lines = sorted(['<a> <p> "x y" <g> .\n', '<a> <p> <b> <g> .\n', '<a> <q> "z"@en <h> .\n',
+                        'not a quad\n', '<a> <p> "\u00e9" <g> .\n', '<a> <p> "x" .\n'])
+        entry = SmallBlockFileEntry(path, exists=False)
+        entry.update(lines)
+        for line in lines:
+            self.assertIn(line, entry)
+        entry.flush()
+        with open(path, 'rb') as f:
+            self.assertEqual(''.join(lines).encode('utf-8'), f.read())
+
+    @testutils.with_working_dir()
+    def test_modified_blocks_are_packed_when_written(self, root_path):
+        path = os.path.join(root_path, 'a.nqo')
+        entry = SmallBlockFileEntry(path, exists=False)
+        lines = ['<a> <p> "{0:02d}" <g> .\n'.format(i) for i in range(20)]
+        entry.update(lines)
+        entry.remove(lines[3])
+        entry.insert('<a> <p> "15a" <g> .\n')
+        entry.remove(lines[0])
+        entry.insert('<a> <p> "99" <g> .\n')
+        expected = sorted(set(lines[1:]) - {lines[3]} | {'<a> <p> "15a" <g> .\n', '<a> <p> "99" <g> .\n'})
+        self.assertEqual(expected, list(entry))
+        self.assertEqual(sum(map(len, expected)), entry.chars)
+        self.assertTrue(any(isinstance(b, list) for b in entry._blocks))
+        entry.flush()
+        self.assertFalse(any(isinstance(b, list) for b in entry._blocks))
+        self.assertEqual(expected, list(entry))
+        self.assertEqual(expected, testutils.get_lines(path))
+
+    def test_packed_lines_are_smaller(self):
+        entry = FileEntry('a.nqo', exists=False)
+        lines = ['<http://example.org/s> <http://example.org/p> "{0}" <http://example.org/g> .\n'.format(i)
+                 for i in range(1000)]
+        entry.update(lines)
+        lines.sort()
+        self.assertEqual(lines[10], entry._blocks[0][10])
+        self.assertLess(entry.size_estimate(), sum(map(len, lines)) // 2)
+
+
+class WriteBackTests(unittest.TestCase):
+
+    @testutils.with_working_dir()
+    def test_flush_replaces_files_and_removes_journal(self, root_path):
+        journal_path = os.path.join(root_path, 'flush.journal')
+        manager = CachingFileManager(2, journal_path)
+        manager.EVICTION_BATCH_SIZE = 2
+        for name in 'abcde':
+            manager.add_line_to_file(os.path.join(root_path, name, name + '.nqo'), name + '\n')
+        # Two evicted entries have been written back and one is waiting to be written
+        self.assertEqual(['a\n'], testutils.get_lines(os.path.join(root_path, 'a', 'a.nqo')))
+        self.assertFalse(os.path.exists(os.path.join(root_path, 'c', 'c.nqo')))
+        manager.add_line_to_file(os.path.join(root_path, 'c', 'c.nqo'), 'c2\n')
+        manager.flush()
+        self.assertEqual(['c\n', 'c2\n'], testutils.get_lines(os.path.join(root_path, 'c', 'c.nqo')))
+        self.assertEqual(['e\n'], testutils.get_lines(os.path.join(root_path, 'e', 'e.nqo')))
+        self.assertEqual(['a', 'b', 'c', 'd', 'e'], sorted(os.listdir(root_path)))
+        self.assertEqual(['c.nqo'], os.listdir(os.path.join(root_path, 'c')))
+
+    @testutils.with_working_dir()
+    def test_background_write_back(self, root_path):
+        manager = CachingFileManager(2, os.path.join(root_path, 'flush.journal'), writers=2)
+        manager.EVICTION_BATCH_SIZE = 2
+        paths = [os.path.join(root_path, name, name + '.nqo') for name in 'abcdefgh']
+        for path in paths:
+            manager.add_line_to_file(path, 'x\n')
+        # Re-requesting an entry waits for its queued write and reuses the entry
+        manager.add_line_to_file(paths[0], 'y\n')
+        manager.flush()
+        self.assertEqual(['x\n', 'y\n'], testutils.get_lines(paths[0]))
+        for path in paths[1:]:
+            self.assertEqual(['x\n'], testutils.get_lines(path))
+        # a.nqo is written once in the background and again when it is flushed
+        self.assertEqual(9, manager.stats.files_written)
+        self.assertFalse(os.path.exists(os.path.join(root_path, 'flush.journal')))
+
+    @testutils.with_working_dir()
+    def test_recover_committed_journal(self, root_path):
+        journal_path = os.path.join(root_path, 'flush.journal')
+        self.write_files(root_path, {'a.nqo': 'old\n', 'a.nqo.tmp': 'new\n', 'b.nqo': 'new\n', 'c.nqo': 'old\n'})
+        with open(journal_path, 'w') as f:
+            f.write(FlushJournal.HEADER + 'W a.nqo\nW b.nqo\nD c.nqo\n' + FlushJournal.COMMIT)
+        self.assertTrue(FlushJournal.recover(journal_path))
+        self.assertEqual(['a.nqo', 'b.nqo'], sorted(os.listdir(root_path)))
+        self.assertEqual(['new\n'], testutils.get_lines(os.path.join(root_path, 'a.nqo')))
+        self.assertIsNone(FlushJournal.recover(journal_path))
+
+    @testutils.with_working_dir()
+    def test_recover_uncommitted_journal(self, root_path):
+        journal_path = os.path.join(root_path, 'flush.journal')
+        self.write_files(root_path, {'a.nqo': 'old\n', 'a.nqo.tmp': 'new\n', 'c.nqo': 'old\n'})
+        with open(journal_path, 'w') as f:
+            f.write(FlushJournal.HEADER + 'W a.nqo\nD c.nqo\n')
+        self.assertFalse(FlushJournal.recover(journal_path))
+        self.assertEqual(['a.nqo', 'c.nqo'], sorted(os.listdir(root_path)))
+        self.assertEqual(['old\n'], testutils.get_lines(os.path.join(root_path, 'a.nqo')))
+
+    @staticmethod
+    def write_files(root_path, files):
+        for name, content in files.items():
+            with open(os.path.join(root_path, name), 'w') as f:
+                f.write(content)
+
+
+class SplitShardTests(StoreTestsBase):
+
+    @testutils.with_store("HEAD")
+    def test_oversized_shard_is_split(self, store):
+        store.split_size = 1000
+        for i in range(100):
+            store.assert_quad(EG['hub'], EG['member'], EG['m{0}'.format(i)])
+        store.assert_quad(EG['hub'], EG['label'], Literal('Hub'))
+        store.flush()
+        shard_path = store.make_file_path(EG['hub'])
+        self.assertFalse(os.path.exists(shard_path + '.nqo'))
+        split_files = os.listdir(shard_path + '.nqs')
+        self.assertGreater(len(split_files), 1)
+
+        store = QuinceStore(store.root)
+        self.assertTrue(list(store.exists(EG['hub'], EG['member'], EG['m42'])))
+        self.assertEqual(100, len(list(store.exists(EG['hub'], EG['member'], '*'))))
+        store.assert_quad(EG['hub'], EG['member'], EG['new'])
+        self.assertEqual(1, len(store.retract_quad(EG['hub'], EG['label'], '*')))
+        store.flush()
+        self.assertFalse(os.path.exists(shard_path + '.nqo'))
+        hub_quads = [q for q in store.all_quads(None) if q.startswith(EG['hub'].n3())]
+        self.assertEqual(101, len(hub_quads))
+        self.assertEqual(set(hub_quads), set(q for f in store._iterate_quad_files() if '.nqs' in f
+                                             for q in testutils.get_lines(f)))
+
+    @testutils.with_store("HEAD")
+    def test_sort_command_splits_oversized_shard(self, store):
+        with open(os.path.join(qdir(), 'config'), 'a') as f:
+            f.write('\n[Store]\nsplit_size = 1K\n')
+        shard_path = store.make_file_path(EG['hub'])
+        os.makedirs(os.path.dirname(shard_path), exist_ok=True)
+        with open(shard_path + '.nqo', 'w') as f:
+            f.writelines(reversed([store.make_nquad(EG['hub'], EG['member'], EG['m{0}'.format(i)], store.default_graph)
+                                   for i in range(50)]))
+        with mock.patch('sys.argv', ['quince', 'sort', '--all']):
+            self.assertEqual(quince_cli.SUCCESS, quince_cli.main())
+        self.assertFalse(os.path.exists(shard_path + '.nqo'))
+        self.assertGreater(len(os.listdir(shard_path + '.nqs')), 1)
+        store = QuinceStore(qdir())
+        self.assertEqual(50, len(list(store.exists(EG['hub'], EG['member'], '*'))))
+
+
+class ReadOnlyTests(StoreTestsBase):
+
+    @testutils.with_store("HEAD")
+    def test_read_only_store(self, store):
+        store.assert_quad(EG['s'], EG['p'], EG['o'], None)
+        store.flush()
+        count = len(list(store.all_quads(None)))
+        store = QuinceStore(store.root, read_only=True)
+        self.assertTrue(list(store.exists(EG['s'], EG['p'], EG['o'])))
+        self.assertFalse(list(store.exists(EG['s'], EG['p'], EG['o2'])))
+        self.assertRaises(quince_exceptions.QuinceReadOnlyException, store.assert_quad, EG['s'], EG['p'], EG['o2'])
+        self.assertRaises(quince_exceptions.QuinceReadOnlyException, store.retract_quad, EG['s'], EG['p'], EG['o'])
+        self.assertRaises(quince_exceptions.QuinceReadOnlyException, store.add_namespace, 'eg', 'http://example.org/')
+        store.flush()
+        self.assertEqual(count, len(list(store.all_quads(None))))
+
+    @testutils.with_store("HEAD")
+    def test_missing_files_are_not_cached(self, store):
+        for _ in range(3):
+            self.assertFalse(list(store.exists(EG['missing'], EG['p'], EG['o'])))
+        self.assertEqual(0, len(store.update_manager.cache))
+        self.assertEqual((1, 2), (store.stats.cache_misses, store.stats.missing_hits))
+        store.assert_quad(EG['missing'], EG['p'], EG['o'])
+        self.assertTrue(list(store.exists(EG['missing'], EG['p'], EG['o'])))
+        store.flush()
+        self.assertTrue(os.path.exists(store.make_file_path(EG['missing']) + '.nqo'))
+
+
+class PrefetchTests(unittest.TestCase):
+
+    @testutils.with_working_dir()
+    def test_prefetch(self, root_path):
+        paths = [os.path.join(root_path, name + '.nqo') for name in 'abcdef']
+        for path in paths:
+            with open(path, 'w') as f:
+                f.write(os.path.basename(path) + '\n')
+        manager = CachingFileManager(100, readers=2, prefetch_depth=3)
+        manager.touch(paths[1])
+        lines = []
+        for path in manager.prefetch(paths):
+            if path == paths[0]:
+                # A file read before the prefetch iterator reaches it uses the entry being loaded
+                manager.add_line_to_file(paths[2], 'new\n')
+            lines.extend(manager.iter_lines(path))
+        self.assertEqual(['a.nqo\n', 'b.nqo\n', 'c.nqo\n', 'new\n', 'd.nqo\n', 'e.nqo\n', 'f.nqo\n'], lines)
+        self.assertEqual(6, manager.stats.files_read)
+        self.assertEqual({}, manager.loading)
+
+    @testutils.with_working_dir()
+    def test_abandoned_prefetch(self, root_path):
+        manager = CachingFileManager(100, readers=2, prefetch_depth=3)
+        paths = manager.prefetch(os.path.join(root_path, name + '.nqo') for name in 'abcdef')
+        next(paths)
+        paths.close()
+        self.assertEqual({}, manager.loading)
+
+
+class SmallBlockSortedSet(SortedSet):
+    LOAD = 2
+
+
+class SortedSetTests(unittest.TestCase):
+    def test_insert_keeps_items_sorted_and_unique(self):
+        s = SmallBlockSortedSet(['m', 'c'])
+        for item in ['x', 'a', 'c', 'q', 'b', 'z', 'a', 'n', 'd']:
+            s.insert(item)
+        self.assertEqual(['a', 'b', 'c', 'd', 'm', 'n', 'q', 'x', 'z'], list(s))
+        self.assertEqual(9, len(s))
+        self.assertIn('q', s)
+        self.assertNotIn('p', s)
+        self.assertEqual(5, s.index('n'))
+
+    def test_remove(self):
+        s = SmallBlockSortedSet('abcdefghij')
+        for item in 'aceghij':
+            s.remove(item)
+        self.assertEqual(['b', 'd', 'f'], list(s))
+        self.assertRaises(ValueError, s.remove, 'a')
+        self.assertRaises(ValueError, s.remove, 'z')
+
+    def test_update(self):
+        s = SmallBlockSortedSet('bdf')
+        s.update('aedc')
+        self.assertEqual(['a', 'b', 'c', 'd', 'e', 'f'], list(s))
+        s.update('g')
+        self.assertEqual(['a', 'b', 'c', 'd', 'e', 'f', 'g'], list(s))
+
+    def test_with_prefix(self):
+        s = SmallBlockSortedSet(['aa', 'ab', 'ac', 'b', 'ba', 'c'])
+        self.assertEqual(['b', 'ba'], list(s.with_prefix('b')))
+        self.assertEqual([], list(s.with_prefix('d')))
+
+    def test_remove_matches(self):
+        s = SmallBlockSortedSet(['a1', 'b1', 'a2', 'c1'])
+        self.assertEqual(['a1', 'a2'], s.remove_matches(re.compile('a')))
+        self.assertEqual(['b1', 'c1'], list(s))
+
+
 class LruCacheTests(unittest.TestCase):
     def test_insert(self):
         cache = LRUCache(capacity=10)
@@ -185,6 +562,17 @@ class LruCacheTests(unittest.TestCase):
         self.assertEqual(1, cache.get('foo'))
         self.assertIsNone(cache.get('bar'))
 
+    def test_eviction(self):
+        evicted = []
+        cache = LRUCache(capacity=2, eviction_callback=lambda k, v: evicted.append((k, v)))
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual([('b', 2)], evicted)
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(3, cache.get('c'))
+
     def test_remove(self):
         cache = LRUCache(capacity=10)
         cache.set('foo', 1)
@@ -0,0 +1,135 @@
+__author__ = 'Kal Ahmed'
+
+import os
+import time
+import unittest
+from unittest import mock
+
+from rdflib import Namespace, Literal
+
+from quince.core.repo import QuinceStore, FileEntry, GITIGNORE, qdir
+from quince.core.shardcache import ShardCache, CACHE_DIR, SIZE_FILE
+from quince.core.stats import QuinceStats
+import testutils
+
+EG = Namespace('http://example.org/')
+
+
+def lines_for(n):
+    return sorted('<http://example.org/s> <http://example.org/p{0}> "{1}" <http://example.org/g> .\n'.format(
+        i % 3, i) for i in range(n))
+
+
+class ShardCacheTests(unittest.TestCase):
+
+    @testutils.with_working_dir()
+    def test_entry_is_loaded_from_cache(self, root_path):
+        stats = QuinceStats()
+        cache = ShardCache(os.path.join(root_path, CACHE_DIR), root_path, 1024 * 1024, stats)
+        path = os.path.join(root_path, 'a.nqo')
+        lines = lines_for(50) + ['not a quad\n']
+        lines.sort()
+        entry = FileEntry(path, exists=False, shard_cache=cache)
+        entry.update(lines)
+        entry.flush()
+
+        entry = FileEntry(path, shard_cache=cache)
+        entry.load()
+        self.assertEqual(1, stats.shard_cache_hits)
+        self.assertFalse(entry.dirty)
+        self.assertEqual(lines, list(entry))
+        self.assertEqual(sum(map(len, lines)), entry.chars)
+        self.assertIn(lines[10], entry)
+        entry.remove(lines[10])
+        entry.flush()
+        self.assertEqual(lines[:10] + lines[11:], testutils.get_lines(path))
+
+        # The file has changed since the previous entry was cached, so only the new entry is cached
+        self.assertEqual(1, sum(len(files) for _, _, files in os.walk(cache.path)))
+
+    @testutils.with_working_dir()
+    def test_changed_file_is_not_loaded_from_cache(self, root_path):
+        stats = QuinceStats()
+        cache = ShardCache(os.path.join(root_path, CACHE_DIR), root_path, 1024 * 1024, stats)
+        path = os.path.join(root_path, 'a.nqo')
+        entry = FileEntry(path, exists=False, shard_cache=cache)
+        entry.update(lines_for(10))
+        entry.flush()
+        with open(path, 'a') as f:
+            f.write('z\n')
+        entry = FileEntry(path, shard_cache=cache)
+        entry.load()
+        self.assertEqual(0, stats.shard_cache_hits)
+        self.assertEqual(1, stats.shard_cache_misses)
+        self.assertEqual(lines_for(10) + ['z\n'], list(entry))
+
+    @testutils.with_working_dir()
+    def test_invalid_cache_file_is_ignored(self, root_path):
+        cache = ShardCache(os.path.join(root_path, CACHE_DIR), root_path, 1024 * 1024)
+        path = os.path.join(root_path, 'a.nqo')
+        with open(path, 'w') as f:
+            f.writelines(lines_for(10))
+        cache.put(path, os.stat(path), b'QPK1 truncated')
+        entry = FileEntry(path, shard_cache=cache)
+        entry.load()
+        self.assertEqual(lines_for(10), list(entry))
+
+    @testutils.with_working_dir()
+    def test_trim_removes_least_recently_used(self, root_path):
+        cache = ShardCache(os.path.join(root_path, CACHE_DIR), root_path, 250)
+        paths = [os.path.join(root_path, name + '.nqo') for name in 'abc']
+        for i, path in enumerate(paths):
+            with open(path, 'w') as f:
+                f.write(path)
+            cache.put(path, os.stat(path), b'x' * 100)
+            cache_path = cache._cache_path(path, os.stat(path))
+            os.utime(cache_path, (time.time() - 100 + i, time.time() - 100 + i))
+        self.assertIsNotNone(cache.get(paths[0], os.stat(paths[0])))
+        cache.trim()
+        self.assertIsNotNone(cache.get(paths[0], os.stat(paths[0])))
+        self.assertIsNone(cache.get(paths[1], os.stat(paths[1])))
+        self.assertIsNotNone(cache.get(paths[2], os.stat(paths[2])))
+
+    @testutils.with_working_dir()
+    def test_trim_walks_cache_only_when_over_budget(self, root_path):
+        cache = ShardCache(os.path.join(root_path, CACHE_DIR), root_path, 250)
+        paths = [os.path.join(root_path, name + '.nqo') for name in 'abc']
+        for path in paths:
+            with open(path, 'w') as f:
+                f.write(path)
+        cache.put(paths[0], os.stat(paths[0]), b'x' * 100)
+        # The first trim records the total size of the cache
+        cache.trim()
+        with open(os.path.join(cache.path, SIZE_FILE)) as f:
+            self.assertEqual('100\n', f.read())
+        cache.put(paths[1], os.stat(paths[1]), b'x' * 100)
+        with mock.patch('os.walk', side_effect=AssertionError('walked the cache')):
+            cache.trim()
+        cache.discard(paths[0], os.stat(paths[0]))
+        cache.put(paths[2], os.stat(paths[2]), b'x' * 200)
+        cache.trim()
+        self.assertIsNone(cache.get(paths[1], os.stat(paths[1])))
+        self.assertIsNotNone(cache.get(paths[2], os.stat(paths[2])))
+        with open(os.path.join(cache.path, SIZE_FILE)) as f:
+            self.assertEqual('200\n', f.read())
+
+
+class StoreShardCacheTests(testutils.TestBase):
+
+    @testutils.with_store("HEAD")
+    def test_store_uses_configured_shard_cache(self, store):
+        with open(os.path.join(qdir(), 'config'), 'a') as f:
+            f.write('\n[Cache]\nshard_cache = 1M\n')
+        quads = sorted(store.all_quads(None))
+        store = QuinceStore(qdir())
+        store.assert_quad(EG.s, EG.p, Literal(1))
+        store.flush()
+        with open(os.path.join(qdir(), GITIGNORE)) as f:
+            self.assertEqual(['/{0}/\n'.format(CACHE_DIR)], f.readlines())
+
+        store = QuinceStore(qdir())
+        store.assert_quad(EG.s, EG.p, Literal(2))
+        store.flush()
+        self.assertEqual(1, store.stats.shard_cache_hits)
+        store = QuinceStore(qdir())
+        self.assertEqual(len(quads) + 2, len(list(store.all_quads(None))))
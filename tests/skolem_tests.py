@@ -0,0 +1,113 @@
+__author__ = 'Kal Ahmed'
+
+import io
+import os
+import unittest
+
+from rdflib import Namespace, BNode, RDF
+
+from quince.core.qimport import import_file, SKOLEMIZE_DETERMINISTIC
+from quince.core.repo import QuinceStore, qdir
+from quince.core.skolem import SkolemizingSink, SKOLEM_BASE, canonical_labels
+from quince.core.turtle import TurtleParser
+import testutils
+
+EG = Namespace('http://example.org/')
+
+TURTLE = '''@prefix ex: <http://example.org/> .
+ex:s ex:address [ ex:street "1 High St" ; ex:city "Oxford" ] ;
+    ex:list ( ex:a ex:b ) .
+'''
+
+
+class RecordingSink:
+    def __init__(self):
+        self.quads = []
+        self.closed = False
+
+    def quad(self, s, p, o, g):
+        self.quads.append((s, p, o, g))
+
+    def close(self):
+        self.closed = True
+
+
+class SkolemizingSinkTests(unittest.TestCase):
+
+    def parse(self):
+        inner = RecordingSink()
+        sink = SkolemizingSink(inner)
+        TurtleParser(sink).parse(io.BytesIO(TURTLE.encode('utf-8')))
+        sink.close()
+        self.assertTrue(inner.closed)
+        return inner.quads
+
+    def test_skolem_iris_are_repeatable(self):
+        first = self.parse()
+        second = self.parse()
+        self.assertEqual(sorted(first), sorted(second))
+        self.assertFalse(any(isinstance(t, BNode) for q in first for t in q))
+        address = [q[2] for q in first if q[1] == EG.address][0]
+        self.assertTrue(address.startswith(SKOLEM_BASE))
+
+    def test_quads_without_blank_nodes_are_passed_through(self):
+        inner = RecordingSink()
+        sink = SkolemizingSink(inner)
+        sink.quad(EG.s, EG.p, EG.o, None)
+        sink.quad(EG.s, EG.p, BNode(), None)
+        self.assertEqual([(EG.s, EG.p, EG.o, None)], inner.quads)
+
+    def test_labels_distinguish_blank_nodes_by_neighbourhood(self):
+        # Two list nodes that differ only in the rest of the list
+        b1, b2, b3 = BNode(), BNode(), BNode()
+        labels = canonical_labels([(EG.s, EG.p, b1, None),
+                                   (b1, EG.first, EG.a, None), (b1, EG.rest, b2, None),
+                                   (b2, EG.first, EG.a, None), (b2, EG.rest, b3, None),
+                                   (b3, EG.first, EG.b, None)])
+        self.assertEqual(3, len(set(labels.values())))
+
+    def test_labels_distinguish_blank_nodes_in_a_cycle(self):
+        a, b = BNode(), BNode()
+        labels = canonical_labels([(a, EG.knows, b, None), (b, EG.knows, a, None)])
+        self.assertNotEqual(labels[a], labels[b])
+        # The labels do not depend on the identifiers of the blank nodes
+        c, d = BNode(), BNode()
+        self.assertEqual([labels[a], labels[b]],
+                         [canonical_labels([(c, EG.knows, d, None), (d, EG.knows, c, None)])[n] for n in (c, d)])
+
+    def test_labels_distinguish_identical_structures(self):
+        quads = []
+        for _ in range(3):
+            address, city = BNode(), BNode()
+            quads.extend([(EG.s, EG.address, address, None), (address, EG.city, city, None),
+                          (city, EG.name, EG.oxford, None)])
+        labels = canonical_labels(quads)
+        self.assertEqual(6, len(set(labels.values())))
+
+    def test_long_list_of_identical_values(self):
+        nodes = [BNode() for _ in range(2000)]
+        quads = [(EG.s, EG.list, nodes[0], None)]
+        for node, rest in zip(nodes, nodes[1:] + [RDF.nil]):
+            quads.extend([(node, RDF.first, EG.a, None), (node, RDF.rest, rest, None)])
+        labels = canonical_labels(quads)
+        self.assertEqual(len(nodes), len(set(labels.values())))
+
+
+class DeterministicImportTests(testutils.TestBase):
+
+    @testutils.with_rw_repo("HEAD")
+    def test_reimport_does_not_modify_files(self, repo):
+        with open('data.ttl', 'w') as f:
+            f.write(TURTLE)
+        import_file('data.ttl', bulk=True, skolemize=SKOLEMIZE_DETERMINISTIC)
+        store = QuinceStore(qdir())
+        path = store.make_file_path(EG.s) + '.nqo'
+        before = testutils.get_lines(path)
+        os.utime(path, (0, 0))
+        import_file('data.ttl', bulk=True, skolemize=SKOLEMIZE_DETERMINISTIC)
+        self.assertEqual(before, testutils.get_lines(path))
+        self.assertEqual(0, os.stat(path).st_mtime)
+
+
+if __name__ == '__main__':
+    unittest.main()